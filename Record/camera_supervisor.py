@@ -0,0 +1,304 @@
+# One recording process per camera, coordinated by a supervisor.
+#
+# A single interpreter grabbing several HD720 cameras is a contention point:
+# every grab, recording and timestamp call of every camera goes through the
+# same GIL. Here each camera records in its own process (optionally pinned to
+# a set of CPUs), and the parent only supervises:
+#
+#   supervisor                      worker (one per camera)
+#       spawn  ------------------>  open the camera
+#              <------------------  ('ready', index)
+#       once every worker is ready:
+#       'start' ----------------->  enable recording, grab...
+#              <------------------  ('stats', index, frames, dropped)  (periodic)
+#       'stop' ------------------>  disable recording
+#              <------------------  ('stopped', index, frames, dropped)
+#
+# A worker that dies or reports ('error', index, message) is restarted (up to
+# max_restarts times) with the next attempt number, so it records to a new
+# file; once it is ready again it is told to start right away. Workers ignore
+# Ctrl-C: the supervisor stops them, so a stop is never handled from inside a
+# signal handler.
+#
+# The worker is any function worker(link, *args) using a WorkerLink, so the
+# supervisor runs the same with fake workers: run this file to watch three fake
+# cameras, one of which crashes and is restarted.
+
+# =========================================================================== #
+import multiprocessing
+import os
+import random
+import signal
+import sys
+import time
+from multiprocessing.connection import wait
+
+
+class WorkerLink:
+    """
+        Worker side of the supervisor pipe.
+
+        Parameters
+        ----------
+        conn: multiprocessing.connection.Connection
+            Pipe to the supervisor.
+        index: int
+            Index of the camera.
+        attempt: int
+            0 for the first run, incremented on each restart.
+        stats_every: float
+            Seconds between two stats reports.
+    """
+
+    def __init__(self, conn, index, attempt=0, stats_every=0.5):
+        self.conn = conn
+        self.index = index
+        self.attempt = attempt
+        self.stats_every = stats_every
+        self._next_stats = 0.0
+        self._stop = False
+
+    def ready(self):
+        """ Camera opened, wait for the start: return False if told to stop """
+        self.conn.send(('ready', self.index))
+        return self.conn.recv() == 'start'
+
+    def should_stop(self):
+        """ True once the supervisor asked to stop (never blocks) """
+        if not self._stop and self.conn.poll():
+            self._stop = self.conn.recv() == 'stop'
+        return self._stop
+
+    def stats(self, frames, dropped):
+        """ Report the counters, at most every stats_every seconds """
+        now = time.monotonic()
+        if now >= self._next_stats:
+            self._next_stats = now + self.stats_every
+            self.conn.send(('stats', self.index, frames, dropped))
+
+    def stopped(self, frames, dropped):
+        self.conn.send(('stopped', self.index, frames, dropped))
+
+    def error(self, message):
+        self.conn.send(('error', self.index, message))
+
+
+def _run_worker(target, conn, index, attempt, stats_every, cpus, args):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)      # The supervisor stops us
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    link = WorkerLink(conn, index, attempt, stats_every)
+    try:
+        target(link, *args)
+    except Exception as e:
+        link.error(repr(e))
+        sys.exit(1)
+
+
+class _Worker:
+    """ Supervisor-side state of one camera """
+
+    def __init__(self, index, args):
+        self.index = index
+        self.args = args
+        self.attempt = 0
+        self.process = self.conn = None
+        self.state = 'starting'     # 'ready', 'recording', 'stopped' or 'failed'
+        self.frames = self.dropped = 0
+        self.past_frames = self.past_dropped = 0    # Of the previous attempts
+        self.error = None
+
+
+class Supervisor:
+    """
+        Runs and supervises one worker process per camera.
+
+        Parameters
+        ----------
+        target: callable
+            Worker function, called as target(link, *args[i]) in process i.
+        args: list
+            Arguments of each worker (one tuple per camera).
+        cpus: list
+            Optional set of CPUs for each worker (os.sched_setaffinity).
+        max_restarts: int
+            Restarts allowed per camera before it is given up.
+        stats_every: float
+            Seconds between two stats reports of a worker.
+        start_method: str
+            multiprocessing start method ('spawn' does not inherit the
+            parent's SDK state).
+    """
+
+    def __init__(self, target, args, cpus=None, max_restarts=3, stats_every=0.5,
+                 start_method='spawn'):
+        self.target = target
+        self.workers = [_Worker(i, tuple(a)) for i, a in enumerate(args)]
+        self.cpus = cpus
+        self.max_restarts = max_restarts
+        self.stats_every = stats_every
+        self.restarts = 0
+        self.started = False
+        self._context = multiprocessing.get_context(start_method)
+
+    def _spawn(self, worker):
+        parent, child = self._context.Pipe()
+        cpus = self.cpus[worker.index] if self.cpus else None
+        worker.process = self._context.Process(
+            target=_run_worker, daemon=True,
+            args=(self.target, child, worker.index, worker.attempt, self.stats_every,
+                  cpus, worker.args))
+        worker.process.start()
+        child.close()
+        worker.conn = parent
+        worker.state = 'starting'
+        worker.frames = worker.dropped = 0
+        worker.error = None
+
+    def start(self, timeout=60.0):
+        """
+            Spawn the workers and start them together once all are ready.
+            Return False (everything stopped) if one of them failed.
+        """
+        for worker in self.workers:
+            self._spawn(worker)
+        deadline = time.monotonic() + timeout
+        while not all(w.state == 'ready' for w in self.workers):
+            if time.monotonic() > deadline or any(w.state == 'failed' for w in self.workers):
+                self.stop()
+                return False
+            self.poll(0.1)
+        for worker in self.workers:
+            worker.conn.send('start')
+            worker.state = 'recording'
+        self.started = True
+        return True
+
+    def poll(self, timeout=0.1):
+        """ Handle the messages and deaths of the workers (waits up to timeout) """
+        live = [w for w in self.workers if w.process is not None]
+        ready = wait([w.conn for w in live] + [w.process.sentinel for w in live], timeout)
+        for worker in live:
+            exited = worker.process.sentinel in ready
+            if not exited and worker.conn not in ready:
+                continue
+            self._receive(worker)       # Messages, or the last words of a dead one
+            if not exited:
+                continue
+            if worker.state == 'stopped':
+                worker.process.join()
+                worker.conn.close()
+                worker.process = None
+            else:
+                self._failed(worker, worker.error or
+                             f"exited with code {worker.process.exitcode}")
+
+    def _receive(self, worker):
+        try:
+            while worker.conn.poll():
+                message = worker.conn.recv()
+                kind = message[0]
+                if kind == 'ready':
+                    worker.state = 'ready'
+                    if self.started:            # Restarted during the session
+                        worker.conn.send('start')
+                        worker.state = 'recording'
+                elif kind == 'stats':
+                    worker.frames, worker.dropped = message[2:]
+                elif kind == 'stopped':
+                    worker.frames, worker.dropped = message[2:]
+                    worker.state = 'stopped'
+                elif kind == 'error':
+                    worker.error = message[2]
+        except (EOFError, OSError):
+            pass                                # Died, seen through its sentinel
+
+    def _failed(self, worker, error):
+        worker.process.join()
+        worker.conn.close()
+        worker.past_frames += worker.frames
+        worker.past_dropped += worker.dropped
+        worker.error = error
+        if worker.attempt >= self.max_restarts:
+            print(f"[ERROR] CAMERA {worker.index} FAILED ({error}), GIVING UP")
+            worker.process = None
+            worker.state = 'failed'
+            return
+        worker.attempt += 1
+        self.restarts += 1
+        print(f"[WARNING] CAMERA {worker.index} FAILED ({error}), RESTART {worker.attempt}")
+        self._spawn(worker)
+
+    def stop(self, timeout=10.0):
+        """ Ask every worker to stop, wait for them (terminate the stragglers) """
+        self.started = False
+        for worker in self.workers:
+            if worker.process is not None and worker.state != 'stopped':
+                try:
+                    worker.conn.send('stop')
+                except OSError:
+                    pass
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and any(
+                w.process is not None and w.process.is_alive() for w in self.workers):
+            for worker in self.workers:
+                if worker.process is not None:
+                    self._receive(worker)
+            time.sleep(0.05)
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            self._receive(worker)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.process.join()
+            worker.conn.close()
+            worker.process = None
+            if worker.state != 'stopped':
+                worker.state = 'failed'
+
+    def totals(self):
+        """ (frames, dropped) of each camera, all attempts included """
+        return [(w.past_frames + w.frames, w.past_dropped + w.dropped) for w in self.workers]
+
+    def format(self):
+        """ One-line status of all the cameras """
+        return "  ".join(f"cam{w.index}: {frames} frames, {dropped} dropped"
+                         + (f" (restart {w.attempt})" if w.attempt else "")
+                         + ("" if w.state == 'recording' else f" [{w.state}]")
+                         for w, (frames, dropped) in zip(self.workers, self.totals()))
+
+
+# Fake camera =============================================================== #
+def fake_worker(link, fps=60.0, crash_after=None, drop_rate=0.01):
+    """
+        Worker that pretends to record: counts frames at fps, drops some, and
+        raises after crash_after seconds (first attempt only).
+    """
+    time.sleep(random.uniform(0.2, 1.0))        # Opening the camera
+    if not link.ready():
+        return
+    frames = dropped = 0
+    start = time.monotonic()
+    while not link.should_stop():
+        time.sleep(1.0 / fps)
+        if random.random() < drop_rate:
+            dropped += 1
+        else:
+            frames += 1
+        link.stats(frames, dropped)
+        if crash_after is not None and link.attempt == 0 and time.monotonic() - start > crash_after:
+            raise RuntimeError("camera unplugged")
+    link.stopped(frames, dropped)
+
+
+if __name__ == '__main__':
+    supervisor = Supervisor(fake_worker, [(60.0,), (60.0, 2.0), (30.0,)])
+    if not supervisor.start():
+        sys.exit(1)
+    end = time.monotonic() + 6.0
+    while time.monotonic() < end:
+        supervisor.poll(0.5)
+        print(supervisor.format(), end="\r")
+    supervisor.stop()
+    print("\n" + supervisor.format())
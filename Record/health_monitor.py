@@ -0,0 +1,219 @@
+# Live health of a recording camera.
+#
+# Dropped frames used to show up only afterwards (the dropped count printed at
+# stop, or the gaps timestamp_align.py fills). HealthMonitor follows a
+# recording as a stream of (IMAGE timestamp, recording status) events, one per
+# grab, and optionally the size of the file being written:
+#
+#   - frame intervals against the expected period (1 / camera_fps): a gap of
+#     k periods means k - 1 missing frames, a burst when k - 1 >= burst_frames
+#   - recording status failures (frame grabbed but not written), in a row
+#   - drop rate and disk write rate over the last rate_window seconds
+#
+# Alerts (printed by default) are raised past the thresholds, at most once per
+# alert_every seconds for each kind, and collected in the session health
+# report (<name>_health.json, next to the SVO). Everything is computed from
+# the event timestamps, so a recorded session can be replayed offline: run
+# this file on timestamp sidecars to get their report.
+
+# =========================================================================== #
+import collections
+import json
+import os
+import sys
+import numpy as np
+
+Alert = collections.namedtuple('Alert', 'time kind message')
+
+INTERVAL_BINS = 20000       # Frame interval histogram: 0.1 ms bins up to 2 s
+
+
+def health_path(svo_path):
+    """ Path of the health report of an SVO file (exp1.svo -> exp1_health.json) """
+    root, _ = os.path.splitext(svo_path)
+    return root + '_health.json'
+
+
+class HealthMonitor:
+    """
+        Frame interval, drop, status and disk statistics of one camera.
+
+        Parameters
+        ----------
+        fps: float
+            Frame rate the camera was opened with (camera_fps).
+        name: str
+            Name of the camera in the alerts.
+        path: str
+            File being recorded, its size gives the disk write rate (or None).
+        burst_frames: int
+            Missing frames in one gap that make a drop burst (alert).
+        status_failures: int
+            Consecutive recording status failures that raise an alert.
+        max_drop_rate: float
+            Fraction of missing frames over rate_window that raises an alert.
+        min_write_rate: float
+            Disk write rate (bytes/s) under which an alert is raised, or None.
+        rate_window: float
+            Seconds over which the drop and write rates are measured.
+        alert_every: float
+            Seconds between two alerts of the same kind.
+        on_alert: callable
+            Called with the text of each alert, print by default (None:
+            collect them only).
+    """
+
+    def __init__(self, fps, name='', path=None, burst_frames=5, status_failures=10,
+                 max_drop_rate=0.02, min_write_rate=None, rate_window=5.0,
+                 alert_every=10.0, on_alert=print):
+        self.period = 1e9 / fps             # ns
+        self.fps = fps
+        self.name = name
+        self.path = path
+        self.burst_frames = burst_frames
+        self.status_failures = status_failures
+        self.max_drop_rate = max_drop_rate
+        self.min_write_rate = min_write_rate
+        self.rate_window = rate_window * 1e9
+        self.alert_every = alert_every * 1e9
+        self.on_alert = on_alert
+        self.alerts = []
+        self._last_alert = {}               # kind -> time of its last alert
+        self.frames = 0                     # Events
+        self.failures = 0                   # Grabbed but not recorded
+        self.missing = 0                    # Inferred from the gaps
+        self.bursts = 0
+        self.longest_burst = 0
+        self.max_failures_in_row = 0
+        self._failures_in_row = 0
+        self._first = self._last = None
+        self._intervals = np.zeros(INTERVAL_BINS, np.int64)   # Histogram, 0.1 ms bins
+        self._sum = self._sum2 = self._max = 0.0                # Of the intervals (ms)
+        self._window = collections.deque()  # (time, missing) over rate_window
+        self._window_missing = 0
+        self._disk = collections.deque()    # (time, bytes) over rate_window
+        self.write_rate = None              # bytes/s over rate_window
+        self._next_disk = 0
+
+    def update(self, timestamp_ns, recorded=True, file_bytes=None):
+        """ Add the event of one grab """
+        self.frames += 1
+        if self._first is None:
+            self._first = timestamp_ns
+        if recorded:
+            self._failures_in_row = 0
+        else:
+            self.failures += 1
+            self._failures_in_row += 1
+            self.max_failures_in_row = max(self.max_failures_in_row, self._failures_in_row)
+            if self._failures_in_row == self.status_failures:
+                self._alert(timestamp_ns, 'status',
+                            f"{self._failures_in_row} frames in a row not recorded")
+        missing = 0
+        if self._last is not None and timestamp_ns > self._last:
+            interval = timestamp_ns - self._last
+            self._interval(interval / 1e6)
+            missing = max(int(round(interval / self.period)) - 1, 0)
+            if missing:
+                self.missing += missing
+                if missing >= self.burst_frames:
+                    self.bursts += 1
+                    self._alert(timestamp_ns, 'burst',
+                                f"{missing} frames dropped ({interval / 1e6:.0f} ms gap)")
+                self.longest_burst = max(self.longest_burst, missing)
+        self._last = max(timestamp_ns, self._last or timestamp_ns)
+        self._rates(timestamp_ns, missing, file_bytes)
+
+    def _interval(self, ms):
+        self._intervals[min(int(ms * 10), INTERVAL_BINS - 1)] += 1
+        self._sum += ms
+        self._sum2 += ms * ms
+        self._max = max(self._max, ms)
+
+    def _rates(self, now, missing, file_bytes):
+        window = self._window
+        window.append((now, missing))
+        self._window_missing += missing
+        while now - window[0][0] > self.rate_window:
+            self._window_missing -= window.popleft()[1]
+        full = now - self._first >= self.rate_window
+        expected = len(window) + self._window_missing
+        if full and self._window_missing > self.max_drop_rate * expected:
+            self._alert(now, 'drop_rate', f"{self._window_missing / expected:.1%} of the "
+                        f"frames dropped over {self.rate_window / 1e9:.0f} s")
+        if file_bytes is None:
+            # Sample the file about 4 times per window
+            if self.path is None or now < self._next_disk or not os.path.exists(self.path):
+                return
+            self._next_disk = now + self.rate_window / 4
+            file_bytes = os.path.getsize(self.path)
+        disk = self._disk
+        if disk and file_bytes < disk[-1][1]:
+            disk.clear()                    # New file (segmented recording)
+        disk.append((now, file_bytes))
+        while now - disk[0][0] > self.rate_window:
+            disk.popleft()
+        if now > disk[0][0]:
+            self.write_rate = (file_bytes - disk[0][1]) / ((now - disk[0][0]) / 1e9)
+        if (full and self.min_write_rate is not None and self.write_rate is not None
+                and self.write_rate < self.min_write_rate):
+            self._alert(now, 'disk', f"writing {self.write_rate / 1e6:.1f} MB/s")
+
+    def _alert(self, now, kind, message):
+        last = self._last_alert.get(kind)
+        if last is not None and now - last < self.alert_every:
+            return
+        self._last_alert[kind] = now
+        alert = Alert(now, kind, message)
+        self.alerts.append(alert)
+        if self.on_alert is not None:
+            self.on_alert(f"[ALERT] {self.name + ': ' if self.name else ''}{message}")
+
+    def report(self):
+        """ Health summary of the session (JSON serializable) """
+        n = int(self._intervals.sum())
+        duration = (self._last - self._first) / 1e9 if self.frames else 0.0
+        expected = self.frames + self.missing
+        return {
+            'camera': self.name,
+            'fps': self.fps,
+            'expected_interval_ms': self.period / 1e6,
+            'duration_s': duration,
+            'frames': self.frames,
+            'missing_frames': self.missing,
+            'drop_rate': self.missing / expected if expected else 0.0,
+            'drop_bursts': self.bursts,
+            'longest_burst': self.longest_burst,
+            'status_failures': self.failures,
+            'max_status_failures_in_row': self.max_failures_in_row,
+            'interval_ms': {
+                'mean': self._sum / n,
+                'std': max(self._sum2 / n - (self._sum / n) ** 2, 0.0) ** 0.5,
+                'p99': float(np.searchsorted(np.cumsum(self._intervals), 0.99 * n) + 1) / 10,
+                'max': self._max,
+            } if n else None,
+            'write_rate_mb_s': self.write_rate / 1e6 if self.write_rate is not None else None,
+            'alerts': [{'time_ns': a.time, 'kind': a.kind, 'message': a.message}
+                       for a in self.alerts],
+        }
+
+    def write_report(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+def main():
+    from timestamp_sidecar import read_sidecar
+    if len(sys.argv) < 2:
+        print("Please specify path to _ts.bin file.")
+        exit()
+    for filepath in sys.argv[1:]:
+        sidecar = read_sidecar(filepath)
+        monitor = HealthMonitor(sidecar.fps or 60, os.path.basename(filepath), on_alert=None)
+        for timestamp in sidecar.timestamp.tolist():
+            monitor.update(timestamp)
+        print(json.dumps(monitor.report(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
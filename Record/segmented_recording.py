@@ -0,0 +1,182 @@
+# Segmented recording: one session, several SVO files.
+#
+# A single ever-growing SVO is lost as a whole on a crash or a full disk, and
+# the postprocessing tools have to go through all of it. SegmentedRecorder
+# rolls over to a new SVO every segment_seconds (of image time) or once the
+# file reaches segment_bytes:
+#
+#   exp1.svo  ->  exp1_000.svo, exp1_001.svo, ...  (each with its _ts.bin)
+#                 exp1_manifest.json
+#
+# The rollover happens on the grab thread right after a recorded frame, so
+# every grabbed frame lands in exactly one segment; if the camera still drops
+# frames while the previous file is closed, they are counted in the first
+# record of the next segment's sidecar and in the manifest.
+#
+# The manifest lists the segments with their first and last IMAGE timestamps,
+# frame range and size. It is rewritten (atomically) each time a segment is
+# closed, so it is usable after a crash; "complete" tells whether the session
+# was stopped cleanly. select_segments() picks the segments covering a time
+# range, so the downstream tools only open those (in parallel if they like).
+
+# =========================================================================== #
+import json
+import os
+import time
+from timestamp_sidecar import CameraTimestamps, sidecar_path
+
+try:
+    import pyzed.sl as sl
+except ImportError:         # Only SegmentedRecorder needs the ZED SDK
+    sl = None
+
+
+def manifest_path(rec_path):
+    """ Path of the manifest of a segmented session (exp1.svo -> exp1_manifest.json) """
+    root, _ = os.path.splitext(rec_path)
+    return root + '_manifest.json'
+
+
+class SegmentedRecorder:
+    """
+        Records an opened camera into a sequence of SVO segments.
+
+        Call start(), then grabbed() after every successful grab, and close()
+        when done.
+
+        Parameters
+        ----------
+        zed: sl.Camera
+            Opened camera, not recording.
+        rec_path: str
+            Path of the session (exp1.svo), the segments are numbered after it.
+        segment_seconds: float
+            Image time after which a new segment is started, or None.
+        segment_bytes: int
+            SVO size after which a new segment is started, or None.
+        compression: sl.SVO_COMPRESSION_MODE
+            Compression of the segments (H265 by default).
+        check_every: int
+            Number of frames between two checks of the SVO size.
+        monitor: HealthMonitor
+            Optional health monitor fed with every grab, it follows the
+            size of the current segment.
+    """
+
+    def __init__(self, zed, rec_path, segment_seconds=None, segment_bytes=None,
+                 compression=None, check_every=30, monitor=None):
+        if sl is None:
+            raise ImportError("SegmentedRecorder needs the ZED SDK (pyzed)")
+        self.zed = zed
+        self.root = os.path.splitext(rec_path)[0]
+        self.manifest_path = manifest_path(rec_path)
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.compression = sl.SVO_COMPRESSION_MODE.H265 if compression is None else compression
+        self.check_every = check_every
+        self.monitor = monitor
+        self.segments = []          # Manifest entries of the closed segments
+        self.frames = 0             # Frames recorded in all segments
+        self.path = None            # SVO of the current segment
+        self.timestamps = None      # Sidecar of the current segment
+        self.switch_time = 0.0      # Longest rollover (s)
+
+    def start(self):
+        self._open(None)
+        return self
+
+    def segment_path(self, index):
+        return f'{self.root}_{index:03d}.svo'
+
+    def grabbed(self):
+        """ Record the last grabbed frame, return the number of recorded frames """
+        before = self.timestamps.frames
+        if self.timestamps.grabbed() == before:
+            return self.frames              # Not written to the SVO
+        self.frames += 1
+        if self._full():
+            start = time.perf_counter()
+            self._close_segment()
+            self._open(self.timestamps.camera_dropped)
+            self.switch_time = max(self.switch_time, time.perf_counter() - start)
+        return self.frames
+
+    def close(self):
+        """ Close the last segment and mark the manifest complete """
+        if self.timestamps is None:
+            return
+        self._close_segment()
+        self.timestamps = None
+        self._write_manifest(complete=True)
+
+    def _full(self):
+        timestamps = self.timestamps
+        if (self.segment_seconds is not None
+                and timestamps.last_ns - timestamps.first_ns >= self.segment_seconds * 1e9):
+            return True
+        return (self.segment_bytes is not None and timestamps.frames % self.check_every == 0
+                and os.path.getsize(self.path) >= self.segment_bytes)
+
+    def _open(self, dropped):
+        self.path = self.segment_path(len(self.segments))
+        err = self.zed.enable_recording(sl.RecordingParameters(self.path, self.compression))
+        if err != sl.ERROR_CODE.SUCCESS:
+            raise RuntimeError(f"cannot record to {self.path}: {err!r}")
+        self.timestamps = CameraTimestamps(self.zed, sidecar_path(self.path), dropped,
+                                           self.monitor)
+        if self.monitor is not None:
+            self.monitor.path = self.path
+
+    def _close_segment(self):
+        self.zed.disable_recording()
+        timestamps = self.timestamps
+        timestamps.close()
+        if not timestamps.frames:           # Stopped right after a rollover
+            for path in (self.path, timestamps.writer.path):
+                if os.path.exists(path):
+                    os.remove(path)
+            return
+        self.segments.append({
+            'index': len(self.segments),
+            'svo': os.path.basename(self.path),
+            'timestamps': os.path.basename(timestamps.writer.path),
+            'first_frame': self.frames - timestamps.frames,
+            'frames': timestamps.frames,
+            'first_timestamp_ns': timestamps.first_ns,
+            'last_timestamp_ns': timestamps.last_ns,
+            'dropped': timestamps.dropped,
+            'bytes': os.path.getsize(self.path),
+        })
+        self._write_manifest(complete=False)
+
+    def _write_manifest(self, complete):
+        manifest = {
+            'session': os.path.basename(self.root),
+            'segment_seconds': self.segment_seconds,
+            'segment_bytes': self.segment_bytes,
+            'complete': complete,
+            'frames': sum(segment['frames'] for segment in self.segments),
+            'segments': self.segments,
+        }
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+
+def load_manifest(path):
+    """ Read a manifest, the segment file names are made absolute """
+    with open(path) as f:
+        manifest = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    for segment in manifest['segments']:
+        segment['svo'] = os.path.join(base, segment['svo'])
+        segment['timestamps'] = os.path.join(base, segment['timestamps'])
+    return manifest
+
+
+def select_segments(manifest, start_ns=None, end_ns=None):
+    """ Segments of a manifest that overlap [start_ns, end_ns] (IMAGE time) """
+    return [segment for segment in manifest['segments']
+            if (start_ns is None or segment['last_timestamp_ns'] >= start_ns)
+            and (end_ns is None or segment['first_timestamp_ns'] <= end_ns)]
@@ -0,0 +1,228 @@
+# Per-frame timestamp sidecar written next to each SVO while recording.
+#
+# Reading the timestamps back from an SVO takes a full decode pass
+# (postprocessing/timestamp_extract.py). The recorders already have them at
+# grab time, so they append one fixed-size record per recorded frame to
+# <name>_ts.bin instead:
+#
+#   header   magic | version | record size | fps | camera serial
+#             4s   |    H    |      H      |  f  |      I
+#   records  frame index (SVO position) | IMAGE timestamp (ns) | dropped
+#                         I             |          q           |    I
+#
+# where dropped is the number of frames the camera dropped just before that
+# one. The grab thread only fills a preallocated chunk; full chunks (and the
+# current one, every flush_every seconds) are written by a background thread,
+# so a crash loses at most the last flush_every seconds. A record cut short by
+# a crash is ignored by the reader.
+#
+# postprocessing/timestamp_store.py reads and writes the same layout.
+#
+# Run this file on sidecars to write the same CSV as timestamp_extract.py:
+#   python timestamp_sidecar.py exp1_0_ts.bin exp1_1_ts.bin ...
+
+# =========================================================================== #
+import collections
+import csv
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import numpy as np
+
+try:
+    import pyzed.sl as sl
+except ImportError:         # Only CameraTimestamps needs the ZED SDK
+    sl = None
+
+
+SIDECAR_MAGIC = b'ZTS1'
+SIDECAR_VERSION = 1
+SIDECAR_HEADER = struct.Struct('<4sHHfI')
+RECORD = np.dtype([('frame', '<u4'), ('timestamp', '<i8'), ('dropped', '<u4')])
+
+Sidecar = collections.namedtuple('Sidecar', 'frame timestamp dropped fps serial')
+
+
+def sidecar_path(svo_path):
+    """ Path of the sidecar of an SVO file (exp1.svo -> exp1_ts.bin) """
+    root, _ = os.path.splitext(svo_path)
+    return root + '_ts.bin'
+
+
+def camera_fps(zed):
+    """ Frame rate an opened camera runs at """
+    info = zed.get_camera_information()
+    fps = getattr(info, 'camera_fps', None)
+    if fps is None:         # Moved to camera_configuration in SDK 4
+        fps = info.camera_configuration.fps
+    return fps
+
+
+class TimestampWriter:
+    """
+        Append-only writer of a timestamp sidecar.
+
+        Parameters
+        ----------
+        path: str
+            Sidecar file, replaced if it exists.
+        fps: float
+            Nominal frame rate of the camera (stored in the header).
+        serial: int
+            Serial number of the camera (stored in the header).
+        chunk: int
+            Number of records handed to the writer thread at once.
+        flush_every: float
+            Seconds after which a partial chunk is written anyway.
+    """
+
+    def __init__(self, path, fps=0.0, serial=0, chunk=1024, flush_every=1.0):
+        self.path = path
+        self.chunk = chunk
+        self.flush_every = flush_every
+        self.count = 0
+        self._file = open(path, 'wb')
+        self._file.write(SIDECAR_HEADER.pack(SIDECAR_MAGIC, SIDECAR_VERSION,
+                                             RECORD.itemsize, fps, serial))
+        self._buffer = np.empty(chunk, RECORD)
+        self._size = 0
+        self._next_flush = time.monotonic() + flush_every
+        self._chunks = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def append(self, frame, timestamp_ns, dropped=0):
+        """ Add one record (cheap, called on the grab thread) """
+        self._buffer[self._size] = (frame, timestamp_ns, dropped)
+        self._size += 1
+        self.count += 1
+        if self._size == self.chunk or time.monotonic() > self._next_flush:
+            self.flush()
+
+    def flush(self):
+        """ Hand the buffered records to the writer thread """
+        if self._size:
+            self._chunks.put(self._buffer[:self._size])
+            self._buffer = np.empty(self.chunk, RECORD)
+            self._size = 0
+        self._next_flush = time.monotonic() + self.flush_every
+
+    def close(self):
+        """ Write the remaining records and close the file """
+        if self._file is None:
+            return
+        self.flush()
+        self._chunks.put(None)
+        self._thread.join()
+        self._file.close()
+        self._file = None
+
+    def _run(self):
+        while True:
+            records = self._chunks.get()
+            if records is None:
+                return
+            self._file.write(records.tobytes())
+            self._file.flush()
+
+
+class CameraTimestamps:
+    """
+        Sidecar of a recording camera: call grabbed() after every successful
+        grab, the frame is recorded if the SDK wrote it to the SVO.
+
+        Parameters
+        ----------
+        zed: sl.Camera
+            Opened camera, recording enabled.
+        path: str
+            Sidecar file (see sidecar_path).
+        dropped: int
+            Camera dropped count the first record is relative to, by default
+            the count when the sidecar is created.
+        monitor: HealthMonitor
+            Optional health monitor fed with every grab (health_monitor.py).
+    """
+
+    def __init__(self, zed, path, dropped=None, monitor=None):
+        if sl is None:
+            raise ImportError("CameraTimestamps needs the ZED SDK (pyzed)")
+        self.zed = zed
+        self.writer = TimestampWriter(path, camera_fps(zed),
+                                      zed.get_camera_information().serial_number)
+        self.monitor = monitor
+        self.frames = 0
+        self.first_ns = self.last_ns = None     # Timestamps of the recorded frames
+        self.dropped = 0                        # Frames dropped while recording
+        # The camera may have been open (and dropping frames) before recording
+        self.camera_dropped = zed.get_frame_dropped_count() if dropped is None else dropped
+
+    def grabbed(self):
+        """ Record the last grabbed frame, return the number of recorded frames """
+        recorded = self.zed.get_recording_status().status
+        if self.monitor is not None:
+            timestamp = self.zed.get_timestamp(sl.TIME_REFERENCE.IMAGE).get_nanoseconds()
+            self.monitor.update(timestamp, recorded)
+        if not recorded:
+            return self.frames
+        dropped = self.zed.get_frame_dropped_count()
+        if self.monitor is None:
+            timestamp = self.zed.get_timestamp(sl.TIME_REFERENCE.IMAGE).get_nanoseconds()
+        self.last_ns = timestamp
+        if self.first_ns is None:
+            self.first_ns = self.last_ns
+        self.writer.append(self.frames, self.last_ns, dropped - self.camera_dropped)
+        self.dropped += dropped - self.camera_dropped
+        self.camera_dropped = dropped
+        self.frames += 1
+        return self.frames
+
+    def close(self):
+        self.writer.close()
+
+
+def read_sidecar(path):
+    """ Load a sidecar, return a Sidecar of NumPy arrays (and header fields) """
+    with open(path, 'rb') as f:
+        header = f.read(SIDECAR_HEADER.size)
+        if len(header) < SIDECAR_HEADER.size:
+            raise ValueError(f"{path}: not a timestamp sidecar")
+        magic, version, size, fps, serial = SIDECAR_HEADER.unpack(header)
+        if magic != SIDECAR_MAGIC or size != RECORD.itemsize:
+            raise ValueError(f"{path}: not a timestamp sidecar")
+        data = f.read()
+    # A crash may have cut the last record short
+    records = np.frombuffer(data, RECORD, len(data) // RECORD.itemsize)
+    return Sidecar(records['frame'].copy(), records['timestamp'].copy(),
+                   records['dropped'].copy(), fps, serial)
+
+
+def write_csv(sidecar, path):
+    """ Write a sidecar as the CSV of timestamp_extract.py (timestamps in ms) """
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['#', 'timestamp', 'dropped frames'])
+        writer.writerows(zip(sidecar.frame.tolist(), (sidecar.timestamp // 1000000).tolist(),
+                             sidecar.dropped.tolist()))
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Please specify path to _ts.bin file.")
+        exit()
+    for filepath in sys.argv[1:]:
+        sidecar = read_sidecar(filepath)
+        # Same place and name as timestamp_extract.py: <dir>/ts/<name>_ts.csv
+        newdir = os.path.join(os.path.dirname(filepath), 'ts')
+        if not os.path.exists(newdir):
+            os.mkdir(newdir)
+        newfilename = os.path.basename(filepath).replace('_ts.bin', '_ts.csv')
+        write_csv(sidecar, os.path.join(newdir, newfilename))
+        print(f"{filepath}: {len(sidecar.frame)} frames, {int(sidecar.dropped.sum())} dropped")
+
+
+if __name__ == '__main__':
+    main()
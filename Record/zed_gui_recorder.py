@@ -7,6 +7,9 @@ from datetime import datetime
 import threading
 import csv
 import pyzed.sl as sl
+from timestamp_sidecar import CameraTimestamps, camera_fps, sidecar_path
+from segmented_recording import SegmentedRecorder
+from health_monitor import HealthMonitor, health_path
 import tkinter as tk
 from tkinter import messagebox
 
@@ -16,6 +19,12 @@ zed = sl.Camera()  		# Camera object
 is_recording = False	# Recording condition (Set false to stop any thread recording)
 aborted = False			# Recording abortion indicator
 n_frames = 0			# Tracks number of recorded frames in real-time
+segment_seconds = None	# Roll over to a new SVO every segment_seconds or
+segment_bytes = None	# ... segment_bytes (see segmented_recording.py), None: one SVO
+warm_standby = True		# Keep the camera open and grabbing between recordings
+standby_period = 0.1	# Seconds between two grabs in standby
+standby_stop = threading.Event()	# Set to stop the standby thread
+standby_th = None		# Standby thread holder
 
 # =========== Ctrl-C Handler =========== #
 def handler(sig, stack_frame):
@@ -30,6 +39,7 @@ def handler(sig, stack_frame):
 	global zed					# Camera object
 	global is_recording			# Recording condition (Set false to stop any thread recording)
 	is_recording=False  		# Stop any threads that are recording
+	standby_stop.set()			# Stop the standby thread
 	time.sleep(0.5)				# Wait for the thread. (no need for a thread.join())
 	zed.disable_recording()		# Disable recording
 	zed.close()					# Close the camera
@@ -51,8 +61,46 @@ def on_close():
 		handler(None, None)  	# Use the same Ctrl-C handler, no need to rewrite the code
 
 
+# ========= Standby Functions ========== #
+def standby_loop(runtime_params):
+	"""
+		This function keeps the opened camera grabbing between recordings.
+
+		Nothing is retrieved or recorded, so it costs little, and starting
+		a recording only needs to enable it on the running camera instead
+		of opening the camera again. The function is intended to be used
+		as a thread, stopped with standby_stop.
+
+		Parameters
+		----------
+		runtime_params: sl.RuntimeParameters
+			runtime parameters of the ZED camera
+	"""
+
+	while not standby_stop.is_set():
+		zed.grab(runtime_params)
+		standby_stop.wait(standby_period)
+
+
+def start_standby(runtime_params):
+	""" Start the standby thread on the opened camera """
+	global standby_th
+	standby_stop.clear()
+	standby_th = threading.Thread(target=standby_loop, args=(runtime_params,), daemon=True)
+	standby_th.start()
+
+
+def stop_standby():
+	""" Stop the standby thread (if any), the camera stays open """
+	global standby_th
+	if standby_th is not None:
+		standby_stop.set()
+		standby_th.join()
+		standby_th = None
+
+
 # ========= Recording Function ========= #
-def rec_loop(status, runtime_params, rec_path, usrid, dt):
+def rec_loop(status, runtime_params, rec_path, usrid, dt, start_time=None, latency=None):
 	"""
 		This function manages video recording. 
 		
@@ -71,6 +119,11 @@ def rec_loop(status, runtime_params, rec_path, usrid, dt):
 			Recording directory. must exists.
 		usrid: int
 			user id provided from GUI to use in file name.
+		start_time: float
+			time.perf_counter() when start was pressed, to measure the
+			start-to-first-frame latency.
+		latency: tk.StringVar()
+			variable to show that latency in the GUI
 	"""
 
 	global zed 			 # Camera object
@@ -82,34 +135,68 @@ def rec_loop(status, runtime_params, rec_path, usrid, dt):
 	# Recording path
 	rec_path = os.path.join(rec_path, dt+'.svo')  
 	print("[INFO] RECORDING TO: ", rec_path) 
-	# Recording Parameters
-	rec_params = sl.RecordingParameters(rec_path, sl.SVO_COMPRESSION_MODE.H265)
-	
-	# Enable Recording
-	print("\n[REC] ENABLING RECORDING")
-	err = zed.enable_recording(rec_params)
-	if err != sl.ERROR_CODE.SUCCESS:
-		print(repr(err))
-		exit(1)
+	# Drop/health alerts while recording, report written next to the SVO
+	monitor = HealthMonitor(camera_fps(zed), path=rec_path)
+	# The camera's dropped count is cumulative since it was opened (standby included)
+	dropped_before = zed.get_frame_dropped_count()
+	if segment_seconds is not None or segment_bytes is not None:
+		# Segments <dt>_000.svo, <dt>_001.svo ... listed in <dt>_manifest.json
+		print("\n[REC] ENABLING SEGMENTED RECORDING")
+		try:
+			timestamps = SegmentedRecorder(zed, rec_path, segment_seconds, segment_bytes,
+			                               monitor=monitor).start()
+		except RuntimeError as e:
+			print(e)
+			exit(1)
+	else:
+		# Recording Parameters
+		rec_params = sl.RecordingParameters(rec_path, sl.SVO_COMPRESSION_MODE.H265)
+		
+		# Enable Recording
+		print("\n[REC] ENABLING RECORDING")
+		err = zed.enable_recording(rec_params)
+		if err != sl.ERROR_CODE.SUCCESS:
+			print(repr(err))
+			exit(1)
+
+		# Frame index, image timestamp and dropped count of every recorded frame
+		timestamps = CameraTimestamps(zed, sidecar_path(rec_path), monitor=monitor)
 
 	# Start main loop
 	status.set("Recording Started")
 	while is_recording:
-		zed.grab(runtime_params)
-		# Increment frame number only if it was written to svo.
-		if zed.get_recording_status().status: n_frames += 1 
+		if zed.grab(runtime_params) == sl.ERROR_CODE.SUCCESS:
+			# Increment frame number only if it was written to svo.
+			n_frames = timestamps.grabbed()
+			if start_time is not None and n_frames:
+				# Time from the start button to the first recorded frame
+				first_frame = (time.perf_counter() - start_time) * 1e3
+				print(f"[REC] FIRST FRAME {first_frame:.0f} ms AFTER START")
+				if latency is not None:
+					latency.set(f"{first_frame:.0f} ms")
+				start_time = None
+	timestamps.close()
 		
 	# When the user asks to stop recording
 	if aborted: 
-		# If aborted, delete the file
-		os.remove(rec_path)
+		# If aborted, delete the file(s)
+		if isinstance(timestamps, SegmentedRecorder):
+			for segment in timestamps.segments:
+				os.remove(os.path.join(os.path.dirname(rec_path), segment['svo']))
+				os.remove(os.path.join(os.path.dirname(rec_path), segment['timestamps']))
+			os.remove(timestamps.manifest_path)
+		else:
+			os.remove(rec_path)
+			os.remove(timestamps.writer.path)
 		print("[REC] Recording Aborted and file was deleted")
 	else:
 		print("[REC] Recording Stopped")
+		monitor.write_report(health_path(rec_path))
+		print(f"[INFO] HEALTH: {monitor.missing} FRAMES DROPPED, {len(monitor.alerts)} ALERTS")
 
-	# Either way, disable recording and print number of dropped frames
+	# Either way, disable recording and print number of frames dropped while recording
 	zed.disable_recording()
-	print("[INFO] DROPPED FRAMES: ", zed.get_frame_dropped_count())
+	print("[INFO] DROPPED FRAMES: ", zed.get_frame_dropped_count() - dropped_before)
 	
 
 def main():
@@ -160,6 +247,8 @@ def main():
 	usrid.set(-1)					 # Initially set to -1
 	fps=tk.IntVar()					 # Store current FPS
 	fps.set(0)						 # initially set to 0
+	latency=tk.StringVar()			 # Start-to-first-frame latency of the last recording
+	latency.set("-")
 	
 	# The same button is used for start/stop. So, to iterate the text,
 	# ... the test is initialized as tk.StringVar() which changes in rt.
@@ -183,6 +272,7 @@ def main():
 		global is_recording
 		nonlocal metadata
 		nonlocal metadata_fname
+		nonlocal th
 
 		# If recording is already started (there is already an active user using the interface)
 		# ... then no need to start the recording again, as it is already running.
@@ -190,6 +280,9 @@ def main():
 			print("Recordings Locked!")
 			# Returning true indicates that the recording is running
 			return True
+		start_time = time.perf_counter()
+		# The standby thread must not grab while recording
+		stop_standby()
 		# If the camera is not open, then open it.
 		if not zed.is_opened():
 			print("Opening camera")
@@ -204,7 +297,7 @@ def main():
 		# Current date & time
 		dt=datetime.now().strftime("%Y_%m_%d-%I_%M_%S_%p")
 		# Start the recording thread
-		th=threading.Thread(target=rec_loop, args=(status,runtime_params,rec_path,usrid,dt))
+		th=threading.Thread(target=rec_loop, args=(status,runtime_params,rec_path,usrid,dt,start_time,latency))
 		th.start()
 		# Set the file name of the output file to the time at which the recording started at
 		metadata_fname = dt
@@ -235,18 +328,21 @@ def main():
 		is_recording = False
 		# Update the recording status label  
 		status.set("Recording Stopped")
-		# Wait for the thread
-		try:
+		# Wait for the thread to close the file
+		if th is not None:
 			th.join()
-		except:
-			# Update status label
-			recstat_lbl.configure(bg="#de5e5e")  
+		# Update status label
+		recstat_lbl.configure(bg="#de5e5e")  
+		if warm_standby:
+			# Keep the camera open and grabbing for the next recording
+			start_standby(runtime_params)
+		else:
 			# Close the camera
 			zed.close()
-			# return datetime.now().strftime("%Y_%m_%d-%I_%M_%S_%p")
-			_n_frames = n_frames
-			n_frames = 0
-			return _n_frames
+		# return datetime.now().strftime("%Y_%m_%d-%I_%M_%S_%p")
+		_n_frames = n_frames
+		n_frames = 0
+		return _n_frames
 
 
 	# Read User id input
@@ -365,6 +461,11 @@ def main():
 	status_lbl.grid(row=6, column=0, padx=(15,0), pady=(15,15), sticky="NSE")
 	recstat_lbl = tk.Label(master=frm_main, textvariable=status, font=('Times New Roman', 14), bg="#de5e5e")
 	recstat_lbl.grid(row=6, column=1, columnspan=3, padx=(15,15), pady=(15,15), sticky="NSW")
+	# Show the start-to-first-frame latency of the last recording
+	latency_lbl = tk.Label(master=frm_main, text="First frame", font=('Times New Roman', 14))
+	latency_lbl.grid(row=7, column=0, padx=(15,0), pady=(15,15), sticky="NSE")
+	curlatency_lbl = tk.Label(master=frm_main, textvariable=latency, font=('Times New Roman', 14))
+	curlatency_lbl.grid(row=7, column=1, columnspan=3, padx=(15,15), pady=(15,15), sticky="NSW")
 
 	# curid_lbl = tk.Label(master=frm_main, text="Current User: ", font=('Times New Roman', 14))
 	# curid_lbl.grid(row=2, column=0, padx=(15,0), pady=(15,15), sticky="NSE")
@@ -385,6 +486,16 @@ def main():
 	# curfps_lbl = tk.Label(master=frm_main, textvariable=fps, font=('Times New Roman', 14))
 	# curfps_lbl.grid(row=5, column=0, columnspan=4, padx=(15,15), pady=(15,15), sticky="NSEW")
 
+	# Warm standby: open the camera now, so the first recording does not
+	# ... wait for it either (opened on demand if this fails)
+	if warm_standby:
+		print("\n[INFO] OPENING CAMERA (WARM STANDBY)")
+		st = zed.open(init_params)
+		if st == sl.ERROR_CODE.SUCCESS:
+			start_standby(runtime_params)
+		else:
+			print(st)
+
 	root.protocol("WM_DELETE_WINDOW", on_close)
 	root.mainloop()
 
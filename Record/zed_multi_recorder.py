@@ -1,18 +1,44 @@
+import json
 import os
 import sys
 from signal import signal, SIGINT
 import cv2
 import time
 import pyzed.sl as sl
+from timestamp_sidecar import CameraTimestamps, sidecar_path
+from camera_supervisor import Supervisor
+from health_monitor import HealthMonitor, health_path
 
 # ========== Global Variables ========== # 
 zeds = []  # Holder for Cameras	
+timestamps = []  # Timestamp sidecar of each camera
+monitors = []    # Drop/health monitor of each camera
+
+# Record each camera in its own process (camera_supervisor.py), else all of
+# ... them in this one. pin_cpus: optional CPU set of each camera's process,
+# ... e.g. [{0, 1}, {2, 3}, {4, 5}].
+process_per_camera = True
+pin_cpus = None
+supervisor = None
+stop_requested = False
+# Consecutive failed grabs (about 1 s at 60 fps) after which a camera
+# ... process gives up, so the supervisor restarts it
+max_grab_errors = 60
 
 # ========== Ctrl-C Handler ========== #
 
 def handler(sig, frame):
     global zeds
+    global stop_requested
     
+    if supervisor is not None:
+        # The main loop stops the workers, not the signal handler
+        stop_requested = True
+        return
+    for sidecar in timestamps:
+        sidecar.close()
+    for monitor in monitors:
+        monitor.write_report(health_path(monitor.path))
     for zed in zeds:
         zed.disable_recording()
         zed.close()
@@ -20,6 +46,118 @@ def handler(sig, frame):
 
 signal(SIGINT, handler)
 
+# ========== Camera Process ========== #
+def init_parameters():
+    return sl.InitParameters(camera_resolution=sl.RESOLUTION.HD720,
+                    camera_fps=60,
+                    depth_mode=sl.DEPTH_MODE.NONE)
+
+
+def session_path(rec_path):
+    """ Files of a session, for the postprocessing (exp1.svo -> exp1_session.json) """
+    root, _ = os.path.splitext(rec_path)
+    return root + '_session.json'
+
+
+def camera_path(rec_path, index, attempt=0):
+    """ SVO of camera index (exp1_0.svo), of a restarted camera exp1_0_r<attempt>.svo """
+    root, _ = os.path.splitext(rec_path)
+    return f'{root}_{index}.svo' if not attempt else f'{root}_{index}_r{attempt}.svo'
+
+
+def write_session(rec_path, groups):
+    """
+        Write the session file: the SVO files recorded together, one group
+        per set of files (a new group each time a camera is restarted).
+    """
+    session = {
+        'session': os.path.basename(os.path.splitext(rec_path)[0]),
+        'groups': [[os.path.basename(path) for path in group] for group in groups],
+    }
+    tmp_path = session_path(rec_path) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(session, f, indent=2)
+    os.replace(tmp_path, session_path(rec_path))
+
+
+def record_camera(link, serial, rec_path):
+    """
+        Records one camera, in its own process (see camera_supervisor.py).
+
+        Parameters
+        ----------
+        link: WorkerLink
+            Pipe to the supervisor.
+        serial: int
+            Serial number of the camera.
+        rec_path: str
+            SVO path of the session, this camera records to camera_path().
+
+        A camera whose grabs fail max_grab_errors times in a row (unplugged)
+        raises, so that the supervisor restarts it.
+    """
+    rec_path = camera_path(rec_path, link.index, link.attempt)
+    init_params = init_parameters()
+    init_params.set_from_serial_number(serial)
+    zed = sl.Camera()
+    status = zed.open(init_params)
+    if status != sl.ERROR_CODE.SUCCESS:
+        raise RuntimeError(f"cannot open camera {serial}: {status!r}")
+    runtime_params = sl.RuntimeParameters(enable_depth=False)
+    if not link.ready():
+        zed.close()
+        return
+    err = zed.enable_recording(sl.RecordingParameters(rec_path, sl.SVO_COMPRESSION_MODE.H265))
+    if err != sl.ERROR_CODE.SUCCESS:
+        zed.close()
+        raise RuntimeError(f"cannot record to {rec_path}: {err!r}")
+    monitor = HealthMonitor(init_params.camera_fps, f'cam{link.index}', rec_path)
+    sidecar = CameraTimestamps(zed, sidecar_path(rec_path), monitor=monitor)
+    errors = 0
+    try:
+        while not link.should_stop():
+            err = zed.grab(runtime_params)
+            if err == sl.ERROR_CODE.SUCCESS:
+                errors = 0
+                sidecar.grabbed()
+            else:
+                errors += 1
+                if errors >= max_grab_errors:
+                    raise RuntimeError(f"camera {serial}: {errors} failed grabs in a row ({err!r})")
+            link.stats(sidecar.frames, sidecar.dropped)
+    finally:
+        sidecar.close()
+        zed.disable_recording()
+        zed.close()
+        monitor.write_report(health_path(rec_path))
+    link.stopped(sidecar.frames, sidecar.dropped)
+
+
+def supervise(serials, rec_path):
+    global supervisor
+    supervisor = Supervisor(record_camera, [(serial, rec_path) for serial in serials],
+                            cpus=pin_cpus)
+    # Files recorded together, a new group each time a camera is restarted
+    attempts = [0] * len(serials)
+    groups = [[camera_path(rec_path, i) for i in range(len(serials))]]
+    write_session(rec_path, groups)
+    print("[INFO] OPENING CAMERAS")
+    if not supervisor.start():
+        print("[ERROR] A CAMERA FAILED TO START")
+        exit(1)
+    print("[INFO] RECORDING, use Ctrl-C to stop")
+    while not stop_requested and any(w.state != 'failed' for w in supervisor.workers):
+        supervisor.poll(0.5)
+        if [w.attempt for w in supervisor.workers] != attempts:
+            attempts = [w.attempt for w in supervisor.workers]
+            groups.append([camera_path(rec_path, w.index, w.attempt)
+                           for w in supervisor.workers if w.state != 'failed'])
+            write_session(rec_path, groups)
+        print(supervisor.format(), end="\r")
+    supervisor.stop()
+    print("\n[INFO] " + supervisor.format())
+
+
 def main():	
     global zeds
     
@@ -39,13 +177,14 @@ def main():
 
     print("[INFO] SETTING INIT PARAMETERS")
     # configuration parameters
-    init_params = sl.InitParameters(camera_resolution=sl.RESOLUTION.HD720,
-                    camera_fps=60,
-                    depth_mode=sl.DEPTH_MODE.NONE)
+    init_params = init_parameters()
 #	init_params.depth_mode = sl.DEPTH_MODE.PERFORMANCE
         
     # Obtain available devices' serial numbers
     available_devices = sl.Camera.get_device_list()	
+    if process_per_camera:
+        supervise([dev.serial_number for dev in available_devices], rec_path)
+        return
     
     serials = [] 	# Serial number of each camera
     for i, dev in enumerate(available_devices): 
@@ -60,14 +199,17 @@ def main():
             exit(1)
         
         print("[INFO] SETTING REC PARAMETERS")
-        rec_params = sl.RecordingParameters(rec_path.replace('.svo', f'_{i}.svo'),
-                            sl.SVO_COMPRESSION_MODE.H265)
+        cam_path = camera_path(rec_path, i)
+        rec_params = sl.RecordingParameters(cam_path, sl.SVO_COMPRESSION_MODE.H265)
         print("[INFO] ENABLING RECORDING")
         err = zeds[i].enable_recording(rec_params)
         if err != sl.ERROR_CODE.SUCCESS:
             print(repr(err))
             exit(1)
+        monitors.append(HealthMonitor(init_params.camera_fps, f'cam{i}', cam_path))
+        timestamps.append(CameraTimestamps(zeds[i], sidecar_path(cam_path), monitor=monitors[i]))
         
+    write_session(rec_path, [[camera_path(rec_path, i) for i in range(len(zeds))]])
     runtime_params = sl.RuntimeParameters(enable_depth=False)
     frames = 0
 
@@ -75,6 +217,7 @@ def main():
         for i in range(len(zeds)):
             if zeds[i].grab(runtime_params) == sl.ERROR_CODE.SUCCESS: 	# If success: image is available
                 frames+=1
+                timestamps[i].grabbed()
             print("Frame count: " + str(frames), end="\r")
 
 
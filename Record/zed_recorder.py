@@ -6,12 +6,21 @@ import time
 import threading
 import csv
 import pyzed.sl as sl
+from timestamp_sidecar import CameraTimestamps, sidecar_path
+from segmented_recording import SegmentedRecorder
+from health_monitor import HealthMonitor, health_path
 
 
 # ========== Global Variables ========== # 
 zed = sl.Camera()  # Holder for Cameras	
-# out_dict = []
+timestamps = None  # Per-frame timestamp sidecar (<name>_ts.bin)
+monitor = None     # Live drop/health alerts, report in <name>_health.json
 rec_path = ""
+# Segmented mode: roll over to a new SVO (<name>_000.svo, <name>_001.svo, ...)
+# ... every segment_seconds or segment_bytes, listed in <name>_manifest.json.
+# ... None for both: one SVO for the whole session.
+segment_seconds = None
+segment_bytes = None
 # stop_signal = False
 
 # ========== Ctrl-C Handler ========== #
@@ -21,6 +30,14 @@ def handler(sig, stack_frame):
     # global stop_signal
     # global th
     
+    # Write the last timestamps
+    if timestamps is not None:
+        timestamps.close()
+        print(f"[INFO] {timestamps.frames} FRAMES RECORDED")
+    if monitor is not None:
+        monitor.write_report(health_path(rec_path))
+        print(f"[INFO] {monitor.missing} FRAMES DROPPED, {len(monitor.alerts)} ALERTS")
+
     # Close ZED
     zed.disable_recording()
     zed.close()
@@ -43,6 +60,8 @@ def path_check():
 def main():
     global zed
     global rec_path
+    global timestamps
+    global monitor
 
     # arg-parse and output path setting
     print("\n[INFO] SETTING PATH")
@@ -81,37 +100,35 @@ def main():
     print("\n[INFO] SETTING RUNTIME PARAMETERS")
     runtime_params = sl.RuntimeParameters(enable_depth=False)
 
-    print("\n[INFO] SETTING RECORDING PARAMETERS")
-    rec_params = sl.RecordingParameters(rec_path, sl.SVO_COMPRESSION_MODE.H265)
-    
-    print("\n[INFO] ENABLING RECORDING")
-    err = zed.enable_recording(rec_params)
-    if err != sl.ERROR_CODE.SUCCESS:
-        print(repr(err))
-        exit(1)
-    
-    # frames = -1
-    # dropped_frames = 0	
+    monitor = HealthMonitor(init_params.camera_fps, path=rec_path)
+    if segment_seconds is not None or segment_bytes is not None:
+        print("\n[INFO] ENABLING SEGMENTED RECORDING")
+        try:
+            timestamps = SegmentedRecorder(zed, rec_path, segment_seconds, segment_bytes,
+                                           monitor=monitor).start()
+        except RuntimeError as e:
+            print(e)
+            exit(1)
+        print("\n[INFO] SEGMENTS LISTED IN: ", timestamps.manifest_path)
+    else:
+        print("\n[INFO] SETTING RECORDING PARAMETERS")
+        rec_params = sl.RecordingParameters(rec_path, sl.SVO_COMPRESSION_MODE.H265)
+        
+        print("\n[INFO] ENABLING RECORDING")
+        err = zed.enable_recording(rec_params)
+        if err != sl.ERROR_CODE.SUCCESS:
+            print(repr(err))
+            exit(1)
+        
+        # Frame index, image timestamp and dropped count of every recorded frame
+        # ... are written next to the SVO, no extraction pass needed afterwards
+        timestamps = CameraTimestamps(zed, sidecar_path(rec_path), monitor=monitor)
+        print("\n[INFO] TIMESTAMPS WRITTEN TO: ", timestamps.writer.path)
 
     # Start main loop
     while True:
-        zed.grab(runtime_params)
-        # if zed.grab(runtime_params) == sl.ERROR_CODE.SUCCESS:
-            # Record timestamp
-            # ts = zed.get_timestamp(sl.TIME_REFERENCE.IMAGE).get_milliseconds()
-
-            # Increament frames
-            # frames+=1
-            
-            # Record if there was dropped frames before this one and how many are dropped
-            # dropped = zed.get_frame_dropped_count()-dropped_frames
-            # dropped_frames+=dropped
-            
-            # Update output dictionary
-            # out_dict.append({'id': frames, 'ts': ts, 'dropped': dropped})
-            
-            # Show output on terminal
-            # print(f"Frame: {frames}\tTime Stamp: {ts}\tDropped: {dropped}", end="\r")
+        if zed.grab(runtime_params) == sl.ERROR_CODE.SUCCESS:
+            timestamps.grabbed()
 
 
 if __name__=="__main__":
@@ -0,0 +1,202 @@
+# This script is not related to ZED camera. It benchmarks the transfer of
+# arrays (skeleton windows, model outputs, raw payloads) through the transports
+# of array_sender.py / array_receiver.py, with both ends on this machine.
+#
+# Every combination of transport x serializer x shape x in-flight window is
+# run against a fresh server process over loopback (or shared memory). Each
+# run is warmed up first, then latencies are recorded into a LatencyHistogram
+# and summarized as percentiles and throughput. Results are written as JSON so
+# runs can be compared across releases and devices. Nothing is plotted.
+#
+# Usage:
+#   python3 Stream/array_benchmark.py -o bench.json
+#   python3 Stream/array_benchmark.py --shapes 1,40,3,18,1 --sizes 1048576 \
+#           --transports tcp shm --serializers frame pickle zlib --in-flight 1 8
+
+# =========================================================================== #
+import os
+import sys
+import json
+import time
+import pickle
+import socket
+import platform
+import argparse
+import itertools
+import subprocess
+from datetime import datetime
+import numpy as np
+from array_protocol import SocketChannel
+from array_codecs import CODECS, CODEC_RAW
+from array_pipeline import PipelinedSender
+from latency_stats import LatencyHistogram
+from shm_transport import ShmChannel
+
+
+# Serializers: (encode, decode, codec) ===================================== #
+def pickle_encode(array):
+    return np.frombuffer(pickle.dumps(array, protocol=pickle.HIGHEST_PROTOCOL), np.uint8)
+
+def pickle_decode(payload):
+    return pickle.loads(payload)
+
+SERIALIZERS = {
+    'frame': (None, None, CODEC_RAW),                   # np.frombuffer view
+    'pickle': (pickle_encode, pickle_decode, CODEC_RAW), # The old pickle path
+}
+# Frames compressed by one of the codecs of array_codecs.py (zlib, lz4, ...)
+SERIALIZERS.update({name: (None, None, codec.id) for name, codec in CODECS.items()
+                    if codec.id != CODEC_RAW})
+
+
+# Server side (runs in its own process) ===================================== #
+def serve(case):
+    """ Serve one benchmark client: decode every message then reply to it """
+    decode = SERIALIZERS[case['serializer']][1]   # Codecs are decoded by recv()
+    ack = np.zeros((), np.uint8)
+    if case['transport'] == 'shm':
+        chan = ShmChannel(case['name'], create=True, slot_size=case['slot_size'])
+        print(case['name'], flush=True)      # Tell the client we are ready
+    else:
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        s.listen(1)
+        print(s.getsockname()[1], flush=True)
+        conn, _ = s.accept()
+        s.close()
+        chan = SocketChannel(conn)
+
+    while True:
+        frame = chan.recv()
+        if frame is None:
+            break
+        seq, flags, payload = frame
+        if decode is not None:
+            decode(payload)
+        if case['reply'] == 'echo':
+            chan.send(payload, seq, flags)
+        else:
+            chan.send(ack, seq)
+    frame = payload = None
+    chan.close()
+
+
+def start_server(case):
+    """ Start a server process for case, return (process, address) """
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                             '--serve', json.dumps(case)],
+                            stdout=subprocess.PIPE, text=True)
+    address = proc.stdout.readline().strip()
+    if not address:
+        proc.wait()
+        raise RuntimeError(f"benchmark server failed to start for {case}")
+    return proc, address
+
+
+# Client side =============================================================== #
+def run_case(case, messages, warmup):
+    """ Run one benchmark case, return its result dict """
+    encode, decode, codec = SERIALIZERS[case['serializer']]
+    array = np.random.random(case['shape'])
+    proc, address = start_server(case)
+    if case['transport'] == 'shm':
+        chan = ShmChannel(address)
+    else:
+        chan = SocketChannel(socket.create_connection(('127.0.0.1', int(address))))
+
+    hist = LatencyHistogram()
+
+    def on_reply(seq, flags, send_time, recv_time, reply):
+        if case['reply'] == 'echo' and decode is not None:
+            decode(reply)
+            recv_time = time.perf_counter()
+        if seq >= warmup:
+            hist.record(recv_time - send_time)
+
+    pipeline = PipelinedSender(chan, case['in_flight'], on_reply, clock=time.perf_counter)
+    for seq in range(warmup):
+        pipeline.send(array, seq, encode=encode, codec=codec)
+    pipeline.flush()
+
+    start = time.perf_counter()
+    for seq in range(warmup, warmup + messages):
+        pipeline.send(array, seq, encode=encode, codec=codec)
+    pipeline.flush()
+    elapsed = time.perf_counter() - start
+
+    pipeline.close()
+    proc.wait()
+
+    result = {k: v for k, v in case.items() if k not in ('name', 'slot_size')}
+    result['dtype'] = str(array.dtype)
+    result['payload_bytes'] = array.nbytes
+    result['messages'] = messages
+    result['warmup'] = warmup
+    result['latency_us'] = hist.summary()
+    result['throughput_msg_s'] = messages / elapsed
+    result['throughput_mb_s'] = messages * array.nbytes / elapsed / 1e6
+    return result, hist
+
+
+def parse_shape(text):
+    return tuple(int(d) for d in text.split(','))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark array transfers between two '
+                                                 'processes on this machine')
+    parser.add_argument('--shapes', nargs='*', type=parse_shape,
+                        default=[(1, 40, 3, 18, 1), (2, 1, 10)],
+                        help='Array shapes, e.g. 1,40,3,18,1 (skeleton) 2,1,10 (model output)')
+    parser.add_argument('--sizes', nargs='*', type=int, default=[],
+                        help='Extra payload sizes in bytes (sent as float64 vectors)')
+    parser.add_argument('--transports', nargs='*', choices=['tcp', 'shm'], default=['tcp', 'shm'])
+    parser.add_argument('--serializers', nargs='*', choices=list(SERIALIZERS),
+                        default=['frame', 'pickle'],
+                        help='frame, pickle, or a frame codec: ' + ', '.join(CODECS))
+    parser.add_argument('--in-flight', nargs='*', type=int, default=[1, 8],
+                        help='Number of messages in flight (1 = lockstep)')
+    parser.add_argument('--reply', choices=['ack', 'echo'], default='ack',
+                        help='Server replies with a 1 byte ack or echoes the payload back')
+    parser.add_argument('-n', '--messages', type=int, default=5000,
+                        help='Measured messages per case')
+    parser.add_argument('-w', '--warmup', type=int, default=500,
+                        help='Messages sent before measuring, per case')
+    parser.add_argument('-o', '--output', default=None, help='Output JSON file')
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(json.loads(args.serve))
+        return
+
+    shapes = list(args.shapes) + [(max(size // 8, 1),) for size in args.sizes]
+    slot_size = max(int(np.prod(shape)) * 8 for shape in shapes) + 4096  # + pickle overhead
+
+    results = []
+    cases = itertools.product(args.transports, args.serializers, shapes, args.in_flight)
+    for i, (transport, serializer, shape, in_flight) in enumerate(cases):
+        case = {'transport': transport, 'serializer': serializer, 'shape': shape,
+                'in_flight': in_flight, 'reply': args.reply,
+                'name': f'zed_bench_{os.getpid()}_{i}', 'slot_size': slot_size}
+        result, hist = run_case(case, args.messages, args.warmup)
+        results.append(result)
+        print(f"{transport:4s} {serializer:7s} {str(shape):18s} in_flight={in_flight:<3d} "
+              f"{result['throughput_msg_s']:10.0f} msg/s  {hist.format()}")
+
+    output = args.output or datetime.now().strftime(
+        f"array_benchmark_{platform.node()}_%Y_%m_%d-%H_%M_%S.json")
+    with open(output, 'w') as f:
+        json.dump({'host': platform.node(),
+                   'platform': platform.platform(),
+                   'machine': platform.machine(),
+                   'python': platform.python_version(),
+                   'numpy': np.__version__,
+                   'date': datetime.now().isoformat(timespec='seconds'),
+                   'args': {k: v for k, v in vars(args).items() if k not in ('serve', 'output')},
+                   'results': results}, f, indent=2)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == '__main__':
+    main()
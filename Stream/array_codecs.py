@@ -0,0 +1,173 @@
+# Per-message payload codecs for the array_protocol wire format.
+#
+# The codec id is stored in the frame header; dtype and shape in the header
+# always describe the decoded array, nbytes the bytes actually on the wire.
+#
+#   raw      0  the array buffer as is (np.frombuffer view on the receiver)
+#   zlib     1  lossless, zlib level 1
+#   lz4      2  lossless, only if the lz4 package is installed
+#   float16  3  lossy, values cast to float16 (~3 significant digits)
+#   int16    4  lossy, fixed point with one float32 scale per message,
+#               NaN (ZED keypoints that were not detected) is preserved
+#
+# AdaptiveCodec picks the codec per message for the "auto" mode: on a
+# congested link the bytes dominate and compressing pays off, on Ethernet
+# the CPU time dominates and raw wins. It keeps the measured latency of every
+# candidate (compress + transfer of the compressed bytes + decompress + reply)
+# and uses the fastest one, retrying the others now and then as the link
+# conditions change.
+
+# =========================================================================== #
+import zlib
+import struct
+import numpy as np
+
+try:
+    import lz4.block
+except ImportError:         # Optional, the lz4 codec is simply not available
+    lz4 = None
+
+
+# Codecs ==================================================================== #
+class Codec:
+    """ Base codec: raw buffer, no transformation """
+    id = 0
+    name = 'raw'
+    lossy = False
+
+    def check(self, array):
+        """ Raise ValueError if array can not be encoded by this codec """
+        if self.lossy and array.dtype.kind != 'f':
+            raise ValueError(f"{self.name} codec only encodes float arrays")
+
+    def encode(self, array):
+        """ Return the wire payload (bytes-like) of a little-endian array """
+        return array.reshape(-1).view(np.uint8)
+
+    def decode(self, payload, dtype, shape):
+        """ Rebuild the array from the wire payload """
+        return np.frombuffer(payload, dtype).reshape(shape)
+
+
+class ZlibCodec(Codec):
+    id = 1
+    name = 'zlib'
+
+    def __init__(self, level=1):
+        self.level = level
+
+    def encode(self, array):
+        return zlib.compress(array, self.level)
+
+    def decode(self, payload, dtype, shape):
+        return np.frombuffer(zlib.decompress(payload), dtype).reshape(shape)
+
+
+class Lz4Codec(Codec):
+    id = 2
+    name = 'lz4'
+
+    def encode(self, array):
+        return lz4.block.compress(array, store_size=True)
+
+    def decode(self, payload, dtype, shape):
+        return np.frombuffer(lz4.block.decompress(payload), dtype).reshape(shape)
+
+
+class Float16Codec(Codec):
+    id = 3
+    name = 'float16'
+    lossy = True
+
+    def encode(self, array):
+        return array.astype('<f2')
+
+    def decode(self, payload, dtype, shape):
+        return np.frombuffer(payload, '<f2').astype(dtype).reshape(shape)
+
+
+class Int16Codec(Codec):
+    id = 4
+    name = 'int16'
+    lossy = True
+    SCALE = struct.Struct('<f')
+    NAN = -32768                # Reserved for NaN, values use +/-32767
+
+    def encode(self, array):
+        finite = np.isfinite(array)
+        peak = float(np.max(np.abs(array[finite]))) if finite.any() else 0.0
+        scale = peak / 32767 if peak > 0 else 1.0
+        values = np.zeros(array.shape, '<i2')
+        np.rint(array / scale, out=values, where=finite, casting='unsafe')
+        values[~finite] = self.NAN
+        return self.SCALE.pack(scale) + values.tobytes()
+
+    def decode(self, payload, dtype, shape):
+        scale, = self.SCALE.unpack_from(payload)
+        values = np.frombuffer(payload, '<i2', offset=self.SCALE.size)
+        array = values.astype(dtype) * dtype.type(scale)
+        array[values == self.NAN] = np.nan
+        return array.reshape(shape)
+
+
+CODECS = {c.name: c for c in (Codec(), ZlibCodec(), Float16Codec(), Int16Codec())}
+if lz4 is not None:
+    CODECS['lz4'] = Lz4Codec()
+CODECS_BY_ID = {c.id: c for c in CODECS.values()}
+CODEC_RAW = Codec.id
+
+
+# Adaptive selection ======================================================== #
+class AdaptiveCodec:
+    """
+        Chooses the codec of each message from measured latencies.
+
+        Parameters
+        ----------
+        candidates: iterable of str
+            Codec names to choose from. Lossy codecs are only used if listed.
+            Codecs that are not available (lz4 not installed) are ignored.
+        explore_every: int
+            Every this many messages, one codec other than the best one is
+            tried again so its latency estimate follows the link.
+        alpha: float
+            Weight of a new sample in the moving average of the latency.
+    """
+
+    def __init__(self, candidates=('raw', 'zlib', 'lz4'), explore_every=50, alpha=0.1):
+        self.codecs = [CODECS[name] for name in candidates if name in CODECS]
+        self.explore_every = explore_every
+        self.alpha = alpha
+        self.latency = {c.id: None for c in self.codecs}   # Moving averages (s)
+        self.chosen = {c.id: 0 for c in self.codecs}       # Messages per codec
+        self._pending = {}      # seq -> codec id of messages in flight
+        self._count = 0
+
+    def choose(self, seq):
+        """ Return the codec id to use for message seq """
+        self._count += 1
+        untried = [cid for cid, lat in self.latency.items() if lat is None]
+        if untried:
+            cid = untried[0]
+        elif self._count % self.explore_every == 0:
+            cid = self.codecs[(self._count // self.explore_every) % len(self.codecs)].id
+        else:
+            cid = min(self.latency, key=self.latency.get)
+        self._pending[seq] = cid
+        self.chosen[cid] += 1
+        return cid
+
+    def observe(self, seq, latency):
+        """ Feed back the measured latency (s) of message seq """
+        cid = self._pending.pop(seq, None)
+        if cid is None:
+            return
+        old = self.latency[cid]
+        self.latency[cid] = latency if old is None else old + self.alpha * (latency - old)
+
+    def format(self):
+        """ One-line human readable summary """
+        return "  ".join(f"{CODECS_BY_ID[cid].name}: "
+                         f"{'-' if lat is None else '%.1f us' % (lat * 1e6)} "
+                         f"({self.chosen[cid]} msgs)"
+                         for cid, lat in self.latency.items())
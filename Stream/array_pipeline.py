@@ -0,0 +1,117 @@
+# Pipelined sending for array_sender.py.
+#
+# In lockstep mode the sender waits for the reply of a message before sending
+# the next one, so throughput is capped at 1/RTT. PipelinedSender keeps up to
+# <window> messages in flight instead: a reader thread receives the replies,
+# matches each one to its send by the sequence number in the frame header and
+# frees a slot of the window. A window of 1 is the old lockstep behavior.
+
+# =========================================================================== #
+import threading
+import time
+from array_codecs import CODEC_RAW
+
+
+class PipelinedSender:
+    """
+        Sends frames over a channel with a bounded number of messages in flight.
+
+        Parameters
+        ----------
+        chan: SocketChannel | ShmChannel
+            Connected channel. Replies must carry the sequence number of the
+            message they answer (array_receiver.py does).
+        window: int
+            Maximum number of messages sent but not yet answered.
+        on_reply: callable
+            Called from the reader thread as on_reply(seq, flags, send_time,
+            recv_time, reply) for every reply. reply is only valid during
+            the call (it is a view of the channel's receive buffer).
+        clock: callable
+            Time source for send_time/recv_time (time.time by default, use
+            time.perf_counter when both ends are on the same machine).
+        on_trace: callable
+            Called from the reader thread as on_trace(seq, trace) for every
+            reply that carries a trace (see stage_trace.py), once its
+            'result' stage has been stamped.
+    """
+
+    def __init__(self, chan, window=8, on_reply=None, clock=time.time, on_trace=None):
+        self.chan = chan
+        self.clock = clock
+        self.window = window
+        self.on_reply = on_reply
+        self.on_trace = on_trace
+        self.error = None            # Exception raised in the reader thread
+        self._sent = {}              # seq -> send time of messages in flight
+        self._free = threading.Semaphore(window)
+        self._reader = threading.Thread(target=self._read_replies, daemon=True)
+        self._reader.start()
+
+    def send(self, array, seq, flags=0, encode=None, codec=CODEC_RAW, trace=None):
+        """
+            Send array, blocks only while the window is full. encode, if
+            given, is applied to array once a window slot is free and its
+            cost is part of the measured latency (e.g. a serializer), and
+            so is the cost of the codec (see array_codecs.py). trace, if
+            given, gets its 'send' stage stamped and goes with the frame.
+        """
+        self._free.acquire()
+        if self.error is not None:
+            raise RuntimeError("reply reader stopped") from self.error
+        self._sent[seq] = self.clock()
+        if encode is not None:
+            array = encode(array)
+        if trace is not None:
+            trace.stamp('send')
+        self.chan.send(array, seq, flags, codec, trace)
+
+    def in_flight(self):
+        """ Number of messages sent but not yet answered """
+        return len(self._sent)
+
+    def flush(self):
+        """ Block until every message in flight has been answered """
+        for _ in range(self.window):
+            self._free.acquire()
+        for _ in range(self.window):
+            self._free.release()
+        if self.error is not None:
+            raise RuntimeError("reply reader stopped") from self.error
+
+    def close(self):
+        """ Wait for the outstanding replies, then close the channel """
+        self.flush()
+        self.chan.shutdown()          # The peer closes its side on EOF ...
+        self._reader.join()           # ... which ends the reader thread
+        self.chan.close()
+
+    def _read_replies(self):
+        """ Reader thread: match replies to sends and free window slots """
+        try:
+            while True:
+                frame = self.chan.recv()
+                recv_time = self.clock()
+                if frame is None:
+                    break
+                seq, flags, reply = frame
+                trace = self.chan.trace
+                if trace is not None:
+                    trace.stamp('result')
+                send_time = self._sent.pop(seq, None)
+                if send_time is None:
+                    print(f"[WARNING] Reply to unknown message {seq} ignored")
+                    continue
+                if self.on_reply is not None:
+                    self.on_reply(seq, flags, send_time, recv_time, reply)
+                if trace is not None and self.on_trace is not None:
+                    self.on_trace(seq, trace)
+                self._free.release()
+        except Exception as e:
+            self.error = e
+        finally:
+            # Unblock send()/flush() if the connection went away
+            if self.error is None and self._sent:
+                self.error = ConnectionError("connection closed with messages in flight")
+            for _ in range(self.window):
+                self._free.release()
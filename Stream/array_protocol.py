@@ -0,0 +1,292 @@
+# Wire format shared by array_sender.py and array_receiver.py.
+#
+# Every message is a fixed size header followed by the raw array buffer
+# (little-endian, C order), or by its encoding with one of the codecs of
+# array_codecs.py. No pickling is involved on either side:
+#
+#   magic | dtype | ndim | flags | codec | seq | nbytes | shape[0 .. MAX_DIMS-1]
+#    2s   |   B   |  B   |   B   |   B   |  Q  |   I    |     MAX_DIMS x I
+#
+# dtype and shape describe the decoded array, nbytes the payload on the wire.
+# A frame flagged FLAG_TRACE has a stage_trace.py trace block between its
+# header and its payload.
+# The receiver reads the header and the payload with recv_into() into buffers
+# that are allocated once and reused, and gets back an np.frombuffer() view.
+# SocketChannel wraps both ends of a connected socket; shm_transport.py has a
+# shared memory ShmChannel with the same API for same-host exchange, and
+# AsyncSocketChannel is the asyncio flavour used by the multi-client server.
+
+# =========================================================================== #
+import asyncio
+import math
+import socket
+import struct
+import numpy as np
+from array_codecs import CODECS_BY_ID, CODEC_RAW
+from stage_trace import TRACE, Trace
+
+
+MAGIC = b'ZA'                                        # Start of every frame
+MAX_DIMS = 6                                         # (1, 40, 3, 18, 1) fits
+HEADER = struct.Struct('!2sBBBBQI%dI' % MAX_DIMS)    # Fixed size frame header
+MAX_ARRAY_BYTES = 1 << 30                            # Larger arrays are refused
+
+# Supported dtypes, the index in this list is the dtype code on the wire ---- #
+DTYPES = [np.dtype(t).newbyteorder('<') for t in
+          ('f8', 'f4', 'f2', 'i8', 'i4', 'i2', 'i1', 'u8', 'u4', 'u2', 'u1', '?')]
+DTYPE_CODES = {dt.str: code for code, dt in enumerate(DTYPES)}
+
+# Frame flags (bit mask) ---------------------------------------------------- #
+FLAG_SYNC = 0x01       # Clock sync request/reply, see clock_sync.py
+FLAG_KEYFRAME = 0x02   # Full sliding window, see window_delta.py
+FLAG_DELTA = 0x04      # Newest frame(s) of a sliding window only
+FLAG_TRACE = 0x08      # A trace block follows the header, see stage_trace.py
+FLAG_RESYNC = 0x10     # Reply: the sliding window has a gap, send a keyframe
+
+
+# Helper functions ========================================================== #
+def set_nodelay(sock):
+    """ Disable Nagle's algorithm, small frames must not wait for an ACK """
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def recv_into(sock, view):
+    """ Helper function to fill view from sock, return False if EOF is hit """
+    received = 0                                     # Number of bytes received
+    while received < len(view):                      # While view is not full
+        n = sock.recv_into(view[received:])          # Receive some more data
+        if n == 0:                                   # Socket connection broken
+            return False
+        received += n                                # Update bytes received
+    return True
+
+
+async def recv_into_async(loop, sock, view):
+    """ Same as recv_into() for a non-blocking socket, inside an event loop """
+    received = 0
+    while received < len(view):
+        n = await loop.sock_recv_into(sock, view[received:])
+        if n == 0:
+            return False
+        received += n
+    return True
+
+
+def as_wire_array(array):
+    """ Return array as a contiguous little-endian array of a supported dtype """
+    array = np.asarray(array)
+    array = np.asarray(array, dtype=array.dtype.newbyteorder('<'), order='C')
+    if array.dtype.str not in DTYPE_CODES:
+        raise ValueError(f"unsupported dtype on the wire: {array.dtype}")
+    if array.ndim > MAX_DIMS:
+        raise ValueError(f"arrays with more than {MAX_DIMS} dims are not supported")
+    return array
+
+
+def encode_payload(array, codec=CODEC_RAW):
+    """ Return the wire payload of a wire array as a uint8 array """
+    if codec == CODEC_RAW:
+        return array.reshape(-1).view(np.uint8)
+    CODECS_BY_ID[codec].check(array)
+    return np.frombuffer(CODECS_BY_ID[codec].encode(array), np.uint8)
+
+
+def decode_payload(payload, dtype, shape, codec=CODEC_RAW):
+    """ Rebuild an array from its wire payload (a view for raw payloads) """
+    if codec == CODEC_RAW:
+        return np.frombuffer(payload, dtype).reshape(shape)
+    try:
+        return CODECS_BY_ID[codec].decode(payload, dtype, shape)
+    except Exception as e:      # zlib.error, lz4 errors, bad sizes...
+        raise ConnectionError(f"corrupted {CODECS_BY_ID[codec].name} payload: {e!r}") from e
+
+
+def header_fields(array, seq, flags=0, codec=CODEC_RAW, nbytes=None, trace=None):
+    """ Return the frame header fields of a wire array (see as_wire_array) """
+    shape = tuple(array.shape) + (0,) * (MAX_DIMS - array.ndim)
+    nbytes = array.nbytes if nbytes is None else nbytes
+    flags = flags | FLAG_TRACE if trace is not None else flags & ~FLAG_TRACE
+    return (MAGIC, DTYPE_CODES[array.dtype.str], array.ndim,
+            flags, codec, seq, nbytes) + shape
+
+
+def trace_size(trace):
+    """ Size of the trace block of a frame (0 without trace) """
+    return 0 if trace is None else TRACE.size
+
+
+def max_payload(size, codec):
+    """ Largest wire payload of a size bytes array (raw: exactly size, codecs: with overhead) """
+    return size if codec == CODEC_RAW else size + size // 64 + 64
+
+
+def unpack_header(header):
+    """ Parse a frame header, return (dtype, shape, flags, codec, seq, nbytes) """
+    magic, code, ndim, flags, codec, seq, nbytes, *shape = HEADER.unpack(header)
+    if (magic != MAGIC or code >= len(DTYPES) or ndim > MAX_DIMS
+            or codec not in CODECS_BY_ID):
+        raise ConnectionError("corrupted frame header")
+    shape = tuple(shape[:ndim])
+    size = math.prod(shape) * DTYPES[code].itemsize
+    if size > MAX_ARRAY_BYTES:
+        raise ConnectionError(f"frame header: {size} bytes array is too large")
+    if nbytes > max_payload(size, codec) or (codec == CODEC_RAW and nbytes != size):
+        raise ConnectionError(f"frame header: {nbytes} bytes payload for a {size} bytes array")
+    return DTYPES[code], shape, flags, codec, seq, nbytes
+
+
+# Frame writer ============================================================== #
+class FrameWriter:
+    """
+        Serializes arrays into frames.
+
+        The header and the array bytes are copied into one buffer that is
+        reused for every message, so a frame goes out with a single send
+        call and without allocating a new bytes object each time.
+    """
+
+    def __init__(self, capacity=4096):
+        self._buf = bytearray(HEADER.size + capacity)
+
+    def pack(self, array, seq, flags=0, codec=CODEC_RAW, trace=None):
+        """ Write a frame into the internal buffer and return a view of it """
+        array = as_wire_array(array)
+        payload = encode_payload(array, codec)
+        start = HEADER.size + trace_size(trace)
+        size = start + payload.nbytes
+        if size > len(self._buf):                    # Grow the buffer if needed
+            self._buf = bytearray(size)
+        HEADER.pack_into(self._buf, 0, *header_fields(array, seq, flags, codec,
+                                                      payload.nbytes, trace))
+        if trace is not None:
+            trace.pack_into(self._buf, HEADER.size)
+        np.frombuffer(self._buf, np.uint8, payload.nbytes, start)[:] = payload
+        return memoryview(self._buf)[:size]
+
+    def send(self, sock, array, seq, flags=0, codec=CODEC_RAW, trace=None):
+        """ Send array as one frame """
+        sock.sendall(self.pack(array, seq, flags, codec, trace))
+
+
+# Frame reader ============================================================== #
+class FrameReader:
+    """
+        Reads frames from a socket.
+
+        The payload is received straight into a preallocated buffer with
+        recv_into(). The returned array is a view of that buffer (unless it
+        was compressed), so it is only valid until the next call to read();
+        copy it to keep it. The trace of the last frame read, if it had one,
+        is in .trace.
+    """
+
+    def __init__(self, capacity=4096):
+        self._header = bytearray(HEADER.size)
+        self._trace = bytearray(TRACE.size)
+        self._buf = bytearray(capacity)
+        self.trace = None
+
+    def read(self, sock):
+        """ Read one frame, return (seq, flags, array) or None if EOF is hit """
+        if not recv_into(sock, memoryview(self._header)):
+            return None
+        dtype, shape, flags, codec, seq, nbytes = unpack_header(self._header)
+        self.trace = None
+        if flags & FLAG_TRACE:
+            if not recv_into(sock, memoryview(self._trace)):
+                return None
+            self.trace = Trace.unpack_from(self._trace)
+        if nbytes > len(self._buf):                  # Grow the buffer if needed
+            self._buf = bytearray(nbytes)
+        if not recv_into(sock, memoryview(self._buf)[:nbytes]):
+            return None
+        return seq, flags, decode_payload(memoryview(self._buf)[:nbytes], dtype, shape, codec)
+
+    async def read_async(self, loop, sock):
+        """ Same as read() for a non-blocking socket, inside an event loop """
+        if not await recv_into_async(loop, sock, memoryview(self._header)):
+            return None
+        dtype, shape, flags, codec, seq, nbytes = unpack_header(self._header)
+        self.trace = None
+        if flags & FLAG_TRACE:
+            if not await recv_into_async(loop, sock, memoryview(self._trace)):
+                return None
+            self.trace = Trace.unpack_from(self._trace)
+        if nbytes > len(self._buf):
+            self._buf = bytearray(nbytes)
+        if not await recv_into_async(loop, sock, memoryview(self._buf)[:nbytes]):
+            return None
+        return seq, flags, decode_payload(memoryview(self._buf)[:nbytes], dtype, shape, codec)
+
+
+# Socket channel ============================================================ #
+class SocketChannel:
+    """
+        Two-way frame channel over a connected TCP socket.
+
+        Same API as ShmChannel in shm_transport.py: send(), recv(), shutdown()
+        and close(), and .trace, the trace of the last frame received.
+    """
+
+    def __init__(self, sock):
+        set_nodelay(sock)
+        self.sock = sock
+        self._writer = FrameWriter()
+        self._reader = FrameReader()
+
+    def send(self, array, seq, flags=0, codec=CODEC_RAW, trace=None):
+        """ Send array as one frame, with trace if given """
+        self._writer.send(self.sock, array, seq, flags, codec, trace)
+
+    def recv(self):
+        """ Receive one frame, return (seq, flags, array) or None if EOF is hit """
+        return self._reader.read(self.sock)
+
+    @property
+    def trace(self):
+        """ Trace of the last frame received, or None """
+        return self._reader.trace
+
+    def shutdown(self):
+        """ Tell the peer that no more frames will be sent, replies still arrive """
+        self.sock.shutdown(socket.SHUT_WR)
+
+    def close(self):
+        self.sock.close()
+
+
+class AsyncSocketChannel:
+    """
+        Two-way frame channel over a connected socket, for asyncio servers.
+
+        Same API as SocketChannel, except that send() and recv() are
+        coroutines. The socket is switched to non-blocking mode. send() may
+        be awaited from several tasks at once, frames are not interleaved.
+    """
+
+    def __init__(self, sock, loop=None):
+        set_nodelay(sock)
+        sock.setblocking(False)
+        self.sock = sock
+        self._loop = loop or asyncio.get_running_loop()
+        self._writer = FrameWriter()
+        self._reader = FrameReader()
+        self._send_lock = asyncio.Lock()   # The writer's buffer is reused
+
+    async def send(self, array, seq, flags=0, codec=CODEC_RAW, trace=None):
+        """ Send array as one frame, with trace if given """
+        async with self._send_lock:
+            await self._loop.sock_sendall(
+                self.sock, self._writer.pack(array, seq, flags, codec, trace))
+
+    async def recv(self):
+        """ Receive one frame, return (seq, flags, array) or None if EOF is hit """
+        return await self._reader.read_async(self._loop, self.sock)
+
+    @property
+    def trace(self):
+        """ Trace of the last frame received, or None """
+        return self._reader.trace
+
+    def close(self):
+        self.sock.close()
@@ -1,103 +1,284 @@
 # This script is not related to ZED camera, but we use it to calculate required
-# time to transfer an array of shape (1, <win_size>, <n_dims>, <n_joints>, 1) 
+# time to transfer an array of shape (1, <win_size>, <n_dims>, <n_joints>, 1)
 # or any other shape, between two devices.
+#
+# Over TCP the receiver is an asyncio server: any number of senders (e.g. one
+# per camera station) can be connected at the same time, each one keeps its
+# own statistics, and a sender can send as many messages as it wants.
+#
+# With inference = True the receiver is a model server: the windows of all
+# clients are batched (see batch_inference.py) and each client gets back the
+# model output (n_people, 1, n_classes) of each of its windows, under the same
+# sequence number. Run array_sender.py with round_trip_behavior = True.
 
 # =========================================================================== #
 # Receiver Side ============================================================= #
+import asyncio
 import socket
 import numpy as np
-import pickle
 import time
-import struct
-import signal 
+import signal
 import sys
+from array_protocol import AsyncSocketChannel, FLAG_SYNC, FLAG_KEYFRAME, FLAG_DELTA, FLAG_RESYNC
+from clock_sync import sync_reply
+from window_delta import WindowDecoder
+from shm_transport import ShmChannel
+from latency_stats import LatencyHistogram
+from stage_trace import TraceStats
+from batch_inference import DynamicBatcher, numpy_model
 
 
-def recvall(sock, n):
-    # Helper function to recv n bytes or return None if EOF is hit
-    data = b''
-    while len(data) < n:
-        packet = sock.recv(n - len(data))
-        if not packet:
-            return None
-        data += packet
-    return data
-
 def signal_handler(sig, frame):
     print('You pressed Ctrl+C!')
     sys.exit(0)
 
-# Add a Ctrl-C handler
-signal.signal(signal.SIGINT, signal_handler)
-
 # A flag to determine the behavior:
-#   If True: calculate round trip time (send received data back to the client) 
+#   If True: calculate round trip time (send received data back to the client)
 #   If False: send back timestamp of receiving time
 round_trip_behavior = False
 
-# Create a socket object
-s = socket.socket()
+# A flag to choose the transport:
+#   'tcp': frames go through a TCP socket (works between two devices)
+#   'shm': frames go through shared memory (both ends on the same device)
+transport = 'tcp'
+
+# A flag to run the model on the received windows:
+#   If True: reply with the model output instead (overrides the flag above),
+#            the windows of all clients are batched, a batch is run when it
+#            holds <max_batch> people or after <max_wait> seconds
+#   If False: no model
+inference = False
+max_batch = 32
+max_wait = 0.005
+model = numpy_model() # Replace by the real model: (N, ...) -> (N, 1, n_classes)
+NO_OUTPUT = np.zeros(0) # Reply to a message the model could not run on
 
-# Define the port on which you want to connect
+# Define the port on which you want to connect, or the shared memory name
 port = 12345
+shm_name = 'zed_array_stream'
+
+# Number of first messages of each client left out of the statistics
+warmup = 10
+
+
+# Per-client statistics ===================================================== #
+class ClientStats:
+    """
+        Statistics of one connected client.
+
+        Parameters
+        ----------
+        addr: str | tuple
+            Address of the client (or shared memory name), used when printing.
+    """
+
+    def __init__(self, addr):
+        self.addr = addr
+        self.connected_at = time.time()
+        self.n_messages = 0
+        self.n_bytes = 0
+        self.round_trip_times = LatencyHistogram()  # Only with round_trip_behavior
+        self.windows = WindowDecoder()  # Sliding window rebuilt from deltas
+        self.traces = TraceStats()  # Stage latencies of traced messages
+
+    def update(self, seq, flags, array, start_time):
+        """ Account one message, start_time is when we started waiting for it """
+        self.n_messages += 1
+        self.n_bytes += array.nbytes
+        window = array
+        if flags & (FLAG_KEYFRAME | FLAG_DELTA):
+            # Rebuild the full window (the model runs on it)
+            window = self.windows.decode(seq, flags, array)
+        if round_trip_behavior and self.n_messages > warmup:
+            self.round_trip_times.record(time.time() - start_time)
+        return window
+
+    def resync(self, flags):
+        """ FLAG_RESYNC if the window of a window message waits for a keyframe, else 0 """
+        if flags & (FLAG_KEYFRAME | FLAG_DELTA) and self.windows.need_keyframe:
+            return FLAG_RESYNC
+        return 0
+
+    def record_trace(self, trace):
+        """ Account the stages of a trace once its reply is stamped """
+        if trace is not None and self.n_messages > warmup:
+            self.traces.record(trace)
 
-# Bind to the port
-s.bind(('', port))
+    def report(self):
+        """ Print the statistics of this client """
+        duration = time.time() - self.connected_at
+        print(f"[{self.addr}] messages: {self.n_messages}, bytes: {self.n_bytes}, "
+              f"duration: {duration:.2f} s")
+        window = self.windows.window
+        if window is not None or self.windows.skipped:
+            shape = window.shape if window is not None else None
+            print(f"[{self.addr}] sliding window: {shape}, gaps: {self.windows.gaps}, "
+                  f"deltas skipped before a keyframe: {self.windows.skipped}")
+        if self.round_trip_times.count:
+            print(f"[{self.addr}] round trip time: ", self.round_trip_times.format())
+        if self.traces.count:
+            # Sender stages are in the sender's clock: the 'receive' stage
+            # includes the clock offset between the two hosts
+            print(f"[{self.addr}] stage latencies:\n" + self.traces.format())
 
-# Put the socket into listening mode
-s.listen(5)
 
-# To store round-trip times
-print("Waiting for connection ... \n")
-while True:
-    round_trip_times = [] # Reset every time a new connection is established
-    # Establish a connection with the client
-    c, addr = s.accept()
+# TCP server (asyncio) ====================================================== #
+async def reply_inference(c, stats, seq, flags, output, trace):
+    """ Send the model output of message seq once its batch has run """
+    try:
+        output = await output
+        if trace is not None:
+            trace.stamp('inference')
+            trace.stamp('reply')
+        await c.send(output, seq, flags, trace=trace)
+        stats.record_trace(trace)
+    except (ConnectionError, OSError, asyncio.CancelledError):
+        pass                       # The client went away meanwhile
+    except Exception as e:
+        print(f"[WARNING] Inference failed for message {seq}: {e!r}")
+
+
+async def serve_client(conn, addr, batcher=None):
+    """ Serve one connected client until it disconnects """
+    c = AsyncSocketChannel(conn)
+    stats = ClientStats(addr)
+    replies = set()  # Replies waiting for their batch
     print('Got connection from', addr)
-    print("Receiving ... \n")
-
-    for _ in range(5000):
-        # Start the timer
-        start_time = time.time()
-
-        # Receive the length of the data from the client first
-        data_length = recvall(c, 4)
-        print("Data length received: ", data_length, "\n")
-        # data_length = struct.unpack('!I', data_length)[0]
-        data_length = int.from_bytes(data_length, 'big')
-        print("Data length unpacked: ", data_length, "\n")
-  
-        # Now receive the actual data
-        print("Receiving data ... \n")
-        data = recvall(c, data_length)
-        print("Data received", "\n")
-        # Unpickle the data to get the numpy array
-        array = pickle.loads(data)
-
-        if round_trip_behavior:
-            # Send the data back to the client
-            c.sendall(struct.pack('!I', data_length) + data)
-            # Stop the timer
-            end_time = time.time()
-            # Calculate the round trip time
-            round_trip_time = end_time - start_time
-            # Store the round trip time
-            round_trip_times.append(round_trip_time)
-        else:
-            # Send the timestamp back to the client
-            c.sendall(struct.pack('!d', time.time()))
-        
-
-    # print time statistics
-    if round_trip_behavior:
-        print('Average round trip time: ', np.mean(round_trip_times[10:]))
-        print('max round trip time: ', np.max(round_trip_times[10:]))
-
-        for i, rtt in enumerate(round_trip_times):
-            print("Round trip time ", i, ": ", rtt, "\n")
-            if i == 6: break
-
-    print("Done! \n")
-
-    # Close the connection with the client
-    c.close()
+    try:
+        while True:
+            start_time = time.time()
+            # Receive one frame, array is a view of this client's buffer
+            frame = await c.recv()
+            recv_time = time.time()
+            if frame is None:
+                print(f"[{addr}] Connection closed by the client")
+                break
+            seq, flags, array = frame
+            trace = c.trace
+            if trace is not None:
+                trace.stamp('receive', recv_time)
+            if flags & FLAG_SYNC:
+                # Clock sync request: answer with our receive/reply times
+                await c.send(sync_reply(recv_time), seq, FLAG_SYNC)
+                continue
+            if batcher is not None:
+                window = stats.update(seq, flags, array, start_time)
+                if window is None or window.ndim == 0:
+                    # Delta before a keyframe: nothing to run the model on
+                    await c.send(NO_OUTPUT, seq, stats.resync(flags), trace=trace)
+                    continue
+                # Queue the window, keep receiving while its batch fills up
+                task = asyncio.create_task(
+                    reply_inference(c, stats, seq, flags & ~(FLAG_KEYFRAME | FLAG_DELTA),
+                                    batcher.submit(window), trace))
+                replies.add(task)
+                task.add_done_callback(replies.discard)
+                continue
+            # Apply a window message first, its reply may ask for a keyframe
+            stats.update(seq, flags, array, start_time)
+            if trace is not None:
+                trace.stamp('reply')
+            if round_trip_behavior:
+                # Send the data back to the client
+                await c.send(array, seq, flags | stats.resync(flags), trace=trace)
+            else:
+                # Send the timestamp back to the client
+                await c.send(np.array(recv_time), seq, stats.resync(flags), trace=trace)
+            stats.record_trace(trace)
+    except ConnectionError as e:
+        # Reset by the peer, or a corrupted frame: drop this client only
+        print(f"[{addr}] Connection lost: {e!r}")
+    finally:
+        if replies:
+            await asyncio.wait(replies)  # Answer what was already received
+        c.close()
+        stats.report()
+        if batcher is not None:
+            print("Batching: ", batcher.format())
+
+
+async def serve_tcp():
+    """ Accept clients forever, each one is served by its own task """
+    loop = asyncio.get_running_loop()
+    s = socket.socket()
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind(('', port))
+    s.listen(16)
+    s.setblocking(False)
+    clients = set()  # Keep a reference to running tasks
+    # One batcher shared by all clients, so their windows share model calls
+    batcher = DynamicBatcher(model, max_batch, max_wait) if inference else None
+    print("Waiting for connections ... \n")
+    while True:
+        conn, addr = await loop.sock_accept(s)
+        task = asyncio.create_task(serve_client(conn, addr, batcher))
+        clients.add(task)
+        task.add_done_callback(clients.discard)
+
+
+# Shared memory server ====================================================== #
+def serve_shm():
+    """ Serve one client at a time through a shared memory channel """
+    print("Waiting for connection ... \n")
+    while True:
+        # Create the channel, the client attaches to it by name
+        c = ShmChannel(shm_name, create=True)
+        stats = ClientStats(shm_name)
+        try:
+            while True:
+                start_time = time.time()
+                frame = c.recv()
+                recv_time = time.time()
+                if frame is None:
+                    print(f"[{shm_name}] Connection closed by the client")
+                    break
+                seq, flags, array = frame
+                trace = c.trace
+                if trace is not None:
+                    trace.stamp('receive', recv_time)
+                if flags & FLAG_SYNC:
+                    c.send(sync_reply(recv_time), seq, FLAG_SYNC)
+                    continue
+                if inference:
+                    # Only one client here: nothing to batch with, run it now
+                    window = stats.update(seq, flags, array, start_time)
+                    if window is None or window.ndim == 0:
+                        c.send(NO_OUTPUT, seq, stats.resync(flags), trace=trace)
+                        continue
+                    output = model(window)
+                    if trace is not None:
+                        trace.stamp('inference')
+                        trace.stamp('reply')
+                    c.send(output, seq, flags & ~(FLAG_KEYFRAME | FLAG_DELTA), trace=trace)
+                    stats.record_trace(trace)
+                    continue
+                stats.update(seq, flags, array, start_time)
+                if trace is not None:
+                    trace.stamp('reply')
+                if round_trip_behavior:
+                    c.send(array, seq, flags | stats.resync(flags), trace=trace)
+                else:
+                    c.send(np.array(recv_time), seq, stats.resync(flags), trace=trace)
+                stats.record_trace(trace)
+        except ConnectionError as e:
+            # The client died with the ring full, or a corrupted frame
+            print(f"[{shm_name}] Connection lost: {e!r}")
+        finally:
+            # Also on Ctrl+C (sys.exit), so the client is told the channel closed
+            frame = array = window = None  # Release the last slot view before closing
+            c.close()
+            stats.report()
+
+
+def main():
+    # Add a Ctrl-C handler
+    signal.signal(signal.SIGINT, signal_handler)
+
+    if transport == 'shm':
+        serve_shm()
+    else:
+        asyncio.run(serve_tcp())
+
+
+if __name__ == "__main__":
+    main()
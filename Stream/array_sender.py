@@ -6,34 +6,21 @@
 # Sender Side =============================================================== #
 import socket
 import numpy as np
-import pickle
-import struct
-import time
 import signal
 import sys
 import matplotlib.pyplot as plt
+from array_protocol import SocketChannel, FLAG_SYNC, FLAG_RESYNC
+from shm_transport import ShmChannel
+from array_pipeline import PipelinedSender
+from latency_stats import LatencyHistogram
+from clock_sync import ClockSync, SYNC_REQUEST, SYNC_SEQ
+from window_delta import WindowEncoder
+from array_codecs import CODECS, AdaptiveCodec
+from stage_trace import Trace, TraceStats
+from frame_source import SyntheticSource, ZedSource
 
 
 # Helper functions ========================================================== #
-def sendall(sock, data):
-    """ Helper function to send all the data """
-    bytes_sent = 0                                   # Number of bytes sent
-    while bytes_sent < len(data):                    # While not all data sent
-        sent = sock.send(data[bytes_sent:])          # Send some more data
-        if sent == 0:                                # Socket connection broken
-            raise RuntimeError("socket connection broken")
-        bytes_sent += sent                           # Update bytes sent          
-
-def recvall(sock, n):
-    """ Helper function to recv n bytes or return None if EOF is hit """
-    data = b''                                      # Empty byte string
-    while len(data) < n:                            # while not all data received 
-        packet = sock.recv(n - len(data))           # Receive some more data
-        if not packet:                              # Socket connection broken
-            return None                             
-        data += packet                              # Update data
-    return data
-
 def signal_handler(sig, frame):
     """ Ctrl-C handler """
     print('You pressed Ctrl+C!')
@@ -47,68 +34,176 @@ signal.signal(signal.SIGINT, signal_handler)
 #   If False: send back timestamp of receiving time
 round_trip_behavior = False
 
-# socket -------------------------------------------------------------------- #
-s = socket.socket()
+# A flag to choose the transport: ------------------------------------------ #
+#   'tcp': frames go through a TCP socket (works between two devices)
+#   'shm': frames go through shared memory (both ends on the same device)
+transport = 'tcp'
+
+# Number of messages in flight: --------------------------------------------- #
+#   1: lockstep, wait for the reply of each message before sending the next
+#   N: keep up to N unanswered messages, replies are matched by sequence number
+in_flight = 1
+
+# Number of first replies left out of the statistics (connection warm-up) --- #
+warmup = 10
+
+# Clock sync (only used for one-way transfer times): ------------------------ #
+#   a burst of sync round trips is sent at connection start, then again every
+#   <sync_every> messages, to estimate the receiver's clock offset and drift
+sync_every = 500
+
+# A flag to send skeleton windows as deltas: -------------------------------- #
+#   If True: keep a sliding (1, 40, 3, 18, 1) window on both ends and only send
+#            its newest frame each time (plus a full keyframe now and then,
+#            and whenever the receiver found a gap in the window messages)
+#   If False: send the whole array every time
+delta_windows = False
+
+# Payload codec (see array_codecs.py): -------------------------------------- #
+#   'raw': the array buffer as is
+#   'zlib' / 'lz4': lossless compression (lz4 needs the lz4 package)
+#   'float16' / 'int16': lossy quantization of float arrays
+#   'auto': per message, the codec with the lowest measured latency among
+#           raw, zlib and lz4 (compressing only pays off on slow links)
+codec = 'raw'
+
+# A flag to trace every message end to end (see stage_trace.py): ----------- #
+#   If True: each frame carries the time of every stage (image, window, send,
+#            receive, inference, reply, result), the receiver stamps its own
+#            stages and sends the trace back, per-stage latencies are printed
+#   If False: no trace
+trace_stages = False
+
+# Camera the messages are taken from (see frame_source.py): --------------- #
+#   None: the array creation stands in for the camera image
+#   SyntheticSource(fps=60) or ZedSource(zed, runtime_params): each message
+#        waits for a grab, its trace starts at the IMAGE timestamp and stamps
+#        'grab' and 'retrieve' (the image retrieve stands in for the skeletons)
+frame_source = None
+
+# socket / shared memory channel -------------------------------------------- #
 port = 12345
-s.connect(('localhost', port)) # Connect to the server on the local computer
-# s.connect(('192.168.100.59', port)) # Jetson
-
-# prepare the length of the data to send ------------------------------------ #
+shm_name = 'zed_array_stream'
+if transport == 'shm':
+    chan = ShmChannel(shm_name) # Attach to the channel created by the server
+else:
+    s = socket.socket()
+    s.connect(('localhost', port)) # Connect to the server on the local computer
+    # s.connect(('192.168.100.59', port)) # Jetson
+    chan = SocketChannel(s)
 
 round_trip_times = [] # To store round-trip times --------------------------- #
 transfer_time = [] # To store one-direction transfer times ------------------ #
+received_times = [] # (send time, receiver's timestamp) of each message ----- #
+histogram = LatencyHistogram() # Percentiles of whichever of the two is measured
+clock_sync = ClockSync() # Receiver clock offset/drift estimation ----------- #
+traces = [] # Traces of the replies, corrected once the run is over ------- #
+adaptive = AdaptiveCodec() if codec == 'auto' else None # Codec selection -- #
+
+def on_reply(seq, flags, send_time, recv_time, reply):
+    """ Called by the pipeline for each reply, matched to its send by seq """
+    if flags & FLAG_SYNC:
+        # Clock sync reply: [receiver's receive time, receiver's reply time]
+        clock_sync.add_sample(send_time, reply[0], reply[1], recv_time)
+        return
+    if flags & FLAG_RESYNC:
+        # The receiver's window misses frames, it drops the deltas until a keyframe
+        encoder.request_keyframe(seq)
+    if adaptive is not None:
+        adaptive.observe(seq, recv_time - send_time)
+    if round_trip_behavior:
+        # The reply is the echoed array
+        round_trip_times.append(recv_time - send_time)
+    else:
+        # The reply is the timestamp of receiving time (a 0-d float64 frame),
+        # ... in the receiver's clock, it is corrected once the run is over
+        received_times.append((send_time, float(reply)))
+
+def on_trace(seq, trace):
+    """ Called by the pipeline for each reply carrying a trace """
+    traces.append(trace)
+
+def send_sync_burst(seq):
+    """ Send a burst of clock sync requests, return the next free sync seq """
+    clock_sync.new_burst()
+    for _ in range(clock_sync.burst):
+        pipeline.send(SYNC_REQUEST, seq, FLAG_SYNC)
+        seq += 1
+    return seq
+
+pipeline = PipelinedSender(chan, window=in_flight, on_reply=on_reply, on_trace=on_trace)
+encoder = WindowEncoder((1, 40, 3, 18, 1)) # Sender copy of the sliding window
 
 # Send the data ------------------------------------------------------------- #
 print("Start Sending ... \n")
-for _ in range(5000):
-    # Start the timer ....................................................... #
-    start_time = time.time()
-    # Create a numpy array to send ------------------------------------------ #
-    # array = np.random.random((1, 40, 3, 18, 1))  # Skeleton
-    array = np.random.random((2,1,10)) # model output (n_people, 1, n_classes)
-    # Pickle the numpy array to send it as a byte stream -------------------- #
-    data = pickle.dumps(array)
-    # data_length = struct.pack('!I', len(data))
-    # print("Data length: ", len(data), "\n")
-    # print("Data length in bytes: ", len(data).to_bytes(4, 'big'), "\n")
-    data_length = len(data).to_bytes(4, 'big')
-
-    # Send 
-    sendall(s, data_length + data)
-    print("Data Sent! \n")
-
-    if round_trip_behavior: # ............................................... #
-        # First receive the length of the data 
-        print("Receiving the length of the data ... \n")
-        # received_data_length = struct.unpack('!I', s.recv(4))[0]
-        received_data_length = int.from_bytes(recvall(s, 4), 'big')
-        print("Data length received: ", received_data_length, "\n")
-
-        # Now receive the actual data
-        data = recvall(s, received_data_length)
-        print("data received! \n")
-        # Unpickle the data to get the numpy array
-        array = pickle.loads(data)
-        # stop the timer
-        end_time = time.time()
-        # Calculate the round-trip time
-        round_trip_time = end_time - start_time
-        round_trip_times.append(round_trip_time)
-
-    else: # ................................................................. #
-        # Receive the timestamp of receiving time
-        print("Receiving the timestamp of receiving time ... \n")
-        received_time = struct.unpack('!d', s.recv(8))[0]
-        print("Received time: ", received_time, "\n")
-        transfer_time.append(received_time - start_time)
-
-# Close the connection
-s.close()
+sync_seq = SYNC_SEQ # Clock sync requests are numbered apart from the data messages
+clock_sync_enabled = not round_trip_behavior or trace_stages
+if clock_sync_enabled:
+    sync_seq = send_sync_burst(sync_seq)
+    pipeline.flush()
+    print("Clock sync: ", clock_sync.format())
+for i in range(5000):
+    if clock_sync_enabled and i > 0 and i % sync_every == 0:
+        sync_seq = send_sync_burst(sync_seq)
+    if frame_source is not None:
+        # Grab loop: wait for the next frame, its trace goes with the message
+        while not frame_source.grab():
+            pass
+        trace = Trace(frame_source.image_timestamp_ns() / 1e9) if trace_stages else None
+        if trace is not None:
+            trace.stamp('grab')
+        frame_source.retrieve()
+        if trace is not None:
+            trace.stamp('retrieve')
+    else:
+        # The array creation stands in for the camera image
+        trace = Trace() if trace_stages else None
+    if delta_windows:
+        # Append a new skeleton frame to the window, send what changed, ---- #
+        # ... numbered by the window so the receiver can tell a gap
+        array, flags, seq = encoder.push(np.random.random((1, 1, 3, 18, 1)))
+    else:
+        # Create a numpy array to send -------------------------------------- #
+        # array = np.random.random((1, 40, 3, 18, 1))  # Skeleton
+        array = np.random.random((2,1,10)) # model output (n_people, 1, n_classes)
+        flags = 0
+        seq = i
+    if trace is not None:
+        trace.stamp('window')
+
+    # Send the array as one frame (header + raw buffer, no pickling), the
+    # ... send time is taken by the pipeline right before the frame goes out
+    codec_id = adaptive.choose(seq) if adaptive is not None else CODECS[codec].id
+    pipeline.send(array, seq, flags, codec=codec_id, trace=trace)
+
+# Wait for the last replies and close the connection
+pipeline.close()
+if frame_source is not None:
+    frame_source.close()
+if adaptive is not None:
+    print("Codecs: ", adaptive.format())
+if traces:
+    # Receiver stages are in its clock, bring them to ours
+    trace_stats = TraceStats()
+    for trace in traces[warmup:]:
+        trace_stats.record(trace.shifted(clock_sync.offset(trace['send'])))
+    print("Clock sync: ", clock_sync.format())
+    print("Stage latencies:\n" + trace_stats.format())
+
+if round_trip_behavior:
+    for rtt in round_trip_times[warmup:]:
+        histogram.record(rtt)
+else:
+    # Bring the receiver's timestamps to our clock with the final estimate
+    print("Clock sync: ", clock_sync.format())
+    for send_time, received_time in received_times:
+        transfer_time.append(clock_sync.to_local(received_time, send_time) - send_time)
+    for tt in transfer_time[warmup:]:
+        histogram.record(tt)
 
 if round_trip_behavior: # --------------------------------------------------- #
     # Print time statistics
-    print('Average round trip time: ', np.mean(round_trip_times))
-    print('max round trip time: ', np.max(round_trip_times))
+    print('Round trip time: ', histogram.format())
     # Print the first few round-trip times
     for i, rtt in enumerate(round_trip_times):
         print("Round trip time ", i, ": ", rtt, "\n")
@@ -122,8 +217,7 @@ if round_trip_behavior: # --------------------------------------------------- #
     np.savetxt('round_trip_times.txt', round_trip_times)
 else: # --------------------------------------------------------------------- #
     # Print time statistics
-    print('Average transfer time: ', np.mean(transfer_time))
-    print('max transfer time: ', np.max(transfer_time))
+    print('Transfer time: ', histogram.format())
     # Print the first few transfer times
     for i, tt in enumerate(transfer_time):
         print("Transfer time ", i, ": ", tt, "\n")
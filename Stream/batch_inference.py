@@ -0,0 +1,155 @@
+# Dynamic batching of model calls for array_receiver.py.
+#
+# Every connected sender (e.g. one per camera station) sends skeleton windows
+# of shape (n_people, 40, 3, 18, 1) and expects the model output of shape
+# (n_people, 1, n_classes) back. Calling the model once per window pays the
+# per-call overhead (Python, kernel launches, ...) for every request; instead
+# the windows of all clients are queued and the model is called once per
+# batch. A batch is closed when it holds <max_batch> people, or when the
+# oldest window has waited <max_wait> seconds, whichever comes first, so the
+# latency added by batching is bounded.
+#
+# The model runs in a worker thread: the event loop keeps receiving the next
+# windows (and filling the next batch) while a batch is being computed.
+
+# =========================================================================== #
+import asyncio
+import numpy as np
+
+
+# Models ==================================================================== #
+def numpy_model(n_classes=10, seed=0):
+    """
+        Stand-in for the real classifier: a fixed random linear layer and a
+        softmax, (N, 40, 3, 18, 1) windows -> (N, 1, n_classes) scores.
+    """
+    rng = np.random.default_rng(seed)
+    weights = {}
+
+    def model(batch):
+        features = batch.reshape(len(batch), -1)
+        w = weights.get(features.shape[1])
+        if w is None:
+            w = weights[features.shape[1]] = rng.standard_normal(
+                (features.shape[1], n_classes)) / np.sqrt(features.shape[1])
+        logits = np.nan_to_num(features) @ w
+        scores = np.exp(logits - logits.max(axis=1, keepdims=True))
+        scores /= scores.sum(axis=1, keepdims=True)
+        return scores[:, None, :]
+
+    return model
+
+
+# Batcher =================================================================== #
+class DynamicBatcher:
+    """
+        Collects windows from many clients into batches for one model.
+
+        Parameters
+        ----------
+        model: callable
+            model(batch) -> outputs, batch is the windows concatenated along
+            axis 0 (people), outputs has one row per person in the same order.
+        max_batch: int
+            A batch is closed as soon as it holds this many people (rows).
+        max_wait: float
+            Maximum time (s) a window waits for its batch to be closed.
+    """
+
+    def __init__(self, model, max_batch=32, max_wait=0.005):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.n_batches = 0
+        self.n_windows = 0
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        """ Start the batching task in the running event loop """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """ Stop the batching task, windows still queued are cancelled """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            future.cancel()
+
+    def submit(self, window):
+        """
+            Queue one window (n_people first), return a future of its output
+            rows. window is copied, so it may be a view of a receive buffer.
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((np.array(window), future))
+        return future
+
+    async def _collect(self):
+        """ Wait for the first window, then for more until full or deadline """
+        loop = asyncio.get_running_loop()
+        items = [await self._queue.get()]
+        rows = len(items[0][0])
+        deadline = loop.time() + self.max_wait
+        while rows < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            items.append(item)
+            rows += len(item[0])
+        # Windows that arrived meanwhile join this batch while there is room
+        while rows < self.max_batch and not self._queue.empty():
+            item = self._queue.get_nowait()
+            items.append(item)
+            rows += len(item[0])
+        return items
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self._collect()
+            # Windows of different shapes or types can not be stacked, each
+            # group is its own model call
+            groups = {}
+            for item in items:
+                window = item[0]
+                groups.setdefault((window.shape[1:], window.dtype), []).append(item)
+            for group in groups.values():
+                await self._infer_group(loop, group)
+
+    async def _infer_group(self, loop, group):
+        """ Run the model on one group of windows, resolve their futures """
+        windows = [window for window, _ in group]
+        try:
+            outputs = await loop.run_in_executor(None, self.model, np.concatenate(windows))
+        except Exception as e:
+            for _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.n_batches += 1
+        self.n_windows += len(group)
+        start = 0
+        for window, future in group:
+            stop = start + len(window)
+            if not future.done():           # The client may have gone away
+                future.set_result(outputs[start:stop])
+            start = stop
+
+    def format(self):
+        """ One-line human readable summary """
+        mean = self.n_windows / self.n_batches if self.n_batches else 0.0
+        return (f"{self.n_windows} windows in {self.n_batches} batches "
+                f"({mean:.1f} windows per model call)")
@@ -0,0 +1,291 @@
+# Adaptive bitrate control for zed_sender.py.
+#
+# Each receiver (zed_receiver.py) reports, about once per second, how the
+# stream is doing on its side: the 90th percentile receive latency and the
+# number of frames received and dropped since its previous report. Reports
+# are small UDP datagrams sent back to the sender:
+#
+#   magic | receiver id | seq | latency (s) | frames | dropped
+#    2s   |      H      |  I  |      f      |   I    |    I
+#
+# The sender feeds them to an AIMD controller: while every receiver is fine
+# the bitrate grows by a fixed step, as soon as one of them sees too much
+# latency or drops the bitrate is cut by a factor, always within bounds. The
+# encoder needs fewer bits for a smaller image or frame rate, so an optional
+# quality ladder of (resolution, fps, lowest bitrate) levels extends the range:
+# when the bitrate is at the floor of the current level and the link is still
+# congested, the next level down is used, with its lower floor. Once the link
+# has been clean for a while with the bitrate well above the floor of the level
+# above, the ladder is climbed back.
+#
+# Nothing here touches the camera: run this file to watch the controller on a
+# simulated link whose capacity drops and recovers.
+
+# =========================================================================== #
+import collections
+import socket
+import struct
+import time
+import numpy as np
+
+
+FEEDBACK_MAGIC = b'ZF'
+FEEDBACK = struct.Struct('!2sHIfII')
+FEEDBACK_PORT = 30010           # Next to the ZED streaming port (30000)
+
+Feedback = collections.namedtuple('Feedback', 'receiver seq latency frames dropped time')
+
+
+# Feedback protocol ========================================================= #
+def pack_feedback(receiver, seq, latency, frames, dropped):
+    """ Return the datagram of one report """
+    return FEEDBACK.pack(FEEDBACK_MAGIC, receiver, seq, latency, frames, dropped)
+
+
+def unpack_feedback(data, now=None):
+    """ Parse a report datagram, return a Feedback or None if malformed """
+    if len(data) != FEEDBACK.size:
+        return None
+    magic, receiver, seq, latency, frames, dropped = FEEDBACK.unpack(data)
+    if magic != FEEDBACK_MAGIC:
+        return None
+    return Feedback(receiver, seq, latency, frames, dropped,
+                    time.monotonic() if now is None else now)
+
+
+class FeedbackReporter:
+    """
+        Receiver side: turns StreamTelemetry summaries into reports.
+
+        Pass its report method as StreamTelemetry(on_summary=...).
+
+        Parameters
+        ----------
+        address: tuple
+            (host, port) of the sender's feedback socket.
+        receiver: int
+            Id of this receiver, unique among the receivers of one sender.
+    """
+
+    def __init__(self, address, receiver=0):
+        self.address = address
+        self.receiver = receiver
+        self.seq = 0
+        self._dropped = 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def report(self, summary):
+        """ Send the report of one telemetry summary """
+        recent = summary['recent_latency_ms']
+        latency = recent['p90'] / 1e3 if recent else 0.0
+        dropped = summary['dropped_total'] - self._dropped
+        self._dropped = summary['dropped_total']
+        self.seq += 1
+        try:
+            self._sock.sendto(pack_feedback(self.receiver, self.seq, latency,
+                                            summary['new_frames'], dropped), self.address)
+        except OSError:
+            pass                        # Sender unreachable, report the next one
+
+    def close(self):
+        self._sock.close()
+
+
+class FeedbackListener:
+    """
+        Sender side: non-blocking UDP socket collecting the reports.
+
+        Parameters
+        ----------
+        port: int
+            UDP port to listen on.
+    """
+
+    def __init__(self, port=FEEDBACK_PORT):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(('', port))
+        self._sock.setblocking(False)
+
+    def poll(self):
+        """ Return the reports received since the last call (never blocks) """
+        reports = []
+        while True:
+            try:
+                data, _ = self._sock.recvfrom(64)
+            except BlockingIOError:
+                return reports
+            feedback = unpack_feedback(data)
+            if feedback is not None:
+                reports.append(feedback)
+
+    def close(self):
+        self._sock.close()
+
+
+# Controller ================================================================ #
+class AimdController:
+    """
+        Additive-increase/multiplicative-decrease bitrate controller.
+
+        Parameters
+        ----------
+        bitrate: float
+            Starting bitrate (Kbits/s, as sl.StreamingParameters.bitrate).
+        min_bitrate, max_bitrate: float
+            Bounds of the bitrate (min_bitrate is unused with levels).
+        increase: float
+            Bitrate added per update while no receiver is congested.
+        decrease: float
+            Factor applied to the bitrate when a receiver is congested.
+        max_latency: float
+            Receive latency (s) above which a receiver is congested.
+        max_drop_rate: float
+            Fraction of dropped frames above which a receiver is congested.
+        timeout: float
+            Reports older than this (s) are ignored (receiver gone).
+        levels: list
+            Optional quality ladder, best first, of (resolution, fps, lowest
+            bitrate), e.g. [('HD720', 30, 2000), ('HD720', 15, 1000),
+            ('VGA', 15, 500)]. Empty: the bitrate only.
+        hold: int
+            Number of consecutive updates, congested at the floor or clean
+            at twice the floor above, before the quality level changes.
+    """
+
+    def __init__(self, bitrate=4000, min_bitrate=1000, max_bitrate=12000, increase=250,
+                 decrease=0.7, max_latency=0.150, max_drop_rate=0.02, timeout=5.0,
+                 levels=(), hold=3):
+        self.bitrate = float(bitrate)
+        self.min_bitrate = min_bitrate
+        self.max_bitrate = max_bitrate
+        self.increase = increase
+        self.decrease = decrease
+        self.max_latency = max_latency
+        self.max_drop_rate = max_drop_rate
+        self.timeout = timeout
+        self.levels = list(levels)
+        self.level = 0
+        self.hold = hold
+        self._last_seq = {}         # receiver -> seq of its last report
+        self._pending = {}          # receiver -> reports not used yet
+        self._last_seen = {}        # receiver -> time of its last report
+        self._streak = 0            # Updates congested at the floor (> 0) or
+                                    # ... clean above the floor above (< 0)
+
+    def feedback(self, report):
+        """ Add one receiver report (stale or repeated reports are ignored) """
+        last_seen = self._last_seen.get(report.receiver)
+        if last_seen is not None and report.time - last_seen > self.timeout:
+            self._last_seq.pop(report.receiver, None)   # Receiver restarted
+        if report.seq <= self._last_seq.get(report.receiver, -1):
+            return
+        self._last_seq[report.receiver] = report.seq
+        self._last_seen[report.receiver] = report.time
+        self._pending.setdefault(report.receiver, []).append(report)
+
+    def congested(self, report):
+        """ True if report shows too much latency or too many drops """
+        total = report.frames + report.dropped
+        drop_rate = report.dropped / total if total else 0.0
+        return report.latency > self.max_latency or drop_rate > self.max_drop_rate
+
+    def update(self, now=None):
+        """
+            Apply the reports received since the last update, return
+            (bitrate, level). Without any fresh report nothing changes.
+        """
+        now = time.monotonic() if now is None else now
+        reports = [r for receiver, pending in self._pending.items()
+                   if now - self._last_seen[receiver] < self.timeout for r in pending]
+        self._pending.clear()
+        if not reports:
+            return self.setting()
+        if any(self.congested(r) for r in reports):
+            at_floor = self.bitrate <= self.floor()
+            self.bitrate = max(self.bitrate * self.decrease, self.floor())
+            self._streak = self._streak + 1 if at_floor and self._streak >= 0 else 0
+            if self._streak >= self.hold and self.level < len(self.levels) - 1:
+                self.level += 1             # Lower quality, lower floor
+                self._streak = 0
+        else:
+            self.bitrate = min(self.bitrate + self.increase, self.max_bitrate)
+            above = self.level > 0 and self.bitrate >= 2 * self.floor(self.level - 1)
+            self._streak = self._streak - 1 if above and self._streak <= 0 else 0
+            if -self._streak >= self.hold:
+                self.level -= 1             # Higher quality, same bitrate
+                self._streak = 0
+        return self.setting()
+
+    def floor(self, level=None):
+        """ Lowest bitrate of a quality level (the current one by default) """
+        if not self.levels:
+            return self.min_bitrate
+        return self.levels[self.level if level is None else level][2]
+
+    def setting(self):
+        """ Current (bitrate, level) """
+        return int(self.bitrate), self.level
+
+
+# Simulation ================================================================ #
+class SimulatedLink:
+    """
+        Link with a capacity, a queue and a drop-tail buffer, for testing the
+        controller without a camera.
+
+        Parameters
+        ----------
+        capacity: float
+            Link capacity (Kbits/s), can be changed while running.
+        base_latency: float
+            Latency (s) of a frame on an empty link.
+        buffer: float
+            Queue length (s of capacity) above which frames are dropped.
+        seed: int
+            Random seed of the latency noise.
+    """
+
+    def __init__(self, capacity=6000, base_latency=0.040, buffer=0.5, seed=0):
+        self.capacity = capacity
+        self.base_latency = base_latency
+        self.buffer = buffer
+        self.backlog = 0.0          # Kbits waiting in the queue
+        self._rng = np.random.default_rng(seed)
+
+    def run(self, bitrate, fps, duration=1.0):
+        """ Stream for duration seconds, return (p90 latency, frames, dropped) """
+        frame = bitrate / fps                       # Kbits per frame
+        frames = dropped = 0
+        latencies = []
+        for _ in range(int(fps * duration)):
+            self.backlog = max(self.backlog - self.capacity / fps, 0.0)
+            if self.backlog + frame > self.buffer * self.capacity:
+                dropped += 1
+                continue
+            self.backlog += frame
+            frames += 1
+            latencies.append(self.base_latency + self.backlog / self.capacity
+                             + abs(self._rng.normal(0, 0.003)))
+        latency = float(np.percentile(latencies, 90)) if latencies else 0.0
+        return latency, frames, dropped
+
+
+def simulate(controller, link, capacities, fps=30, receiver=0):
+    """ Run one controller update per second against link, print each step """
+    for t, capacity in enumerate(capacities):
+        link.capacity = capacity
+        bitrate, level = controller.setting()
+        if controller.levels:
+            fps = controller.levels[level][1]
+        latency, frames, dropped = link.run(bitrate, fps)
+        controller.feedback(Feedback(receiver, t, latency, frames, dropped, t))
+        controller.update(now=t)
+        print(f"t={t:3d} s  capacity={capacity:6.0f}  bitrate={bitrate:6d}  level={level}  "
+              f"latency={latency * 1e3:6.1f} ms  dropped={dropped:2d}/{frames + dropped}")
+
+
+if __name__ == '__main__':
+    # Capacity drops from 8 Mbit/s to 2.5 then 800 Kbit/s, then recovers
+    capacities = [8000] * 20 + [2500] * 20 + [800] * 20 + [8000] * 40
+    simulate(AimdController(levels=[('HD720', 30, 2000), ('HD720', 15, 1000), ('VGA', 15, 500)]),
+             SimulatedLink(), capacities)
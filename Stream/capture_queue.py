@@ -0,0 +1,162 @@
+# Capture stage decoupled from processing.
+#
+# When grab and processing share one loop, a slow consumer (rendering,
+# skeleton retrieval, ...) delays the next grab and the SDK drops frames.
+# CaptureThread grabs on its own thread and hands each frame to the consumers
+# through a FrameQueue, a bounded queue whose overflow policy decides what
+# happens when the consumers fall behind:
+#
+#   'drop_oldest'  the oldest queued frame is discarded (live view: always
+#                  process the freshest frame)
+#   'drop_newest'  the new frame is discarded (keep a contiguous backlog)
+#   'block'        capture waits for room (no frame is lost in the queue, the
+#                  camera may drop frames instead)
+#
+# Every policy has its counter, so the cost of a slow consumer is visible.
+
+# =========================================================================== #
+import collections
+import threading
+import time
+
+
+POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+Frame = collections.namedtuple('Frame', 'seq image_ns current_ns data')
+
+
+class FrameQueue:
+    """
+        Bounded frame queue between one producer and its consumers.
+
+        Parameters
+        ----------
+        maxsize: int
+            Number of frames the queue holds.
+        policy: str
+            One of POLICIES, applied when a frame is put in a full queue.
+    """
+
+    def __init__(self, maxsize=4, policy='drop_oldest'):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown overflow policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self._frames = collections.deque()
+        self._cond = threading.Condition()
+        self.closed = False
+        self.put_count = 0           # Frames offered by the producer
+        self.dropped_oldest = 0      # Queued frames discarded for a new one
+        self.dropped_newest = 0      # New frames discarded, queue full
+        self.blocked = 0             # Puts that had to wait for room
+        self.blocked_time = 0.0      # Total time (s) spent waiting for room
+
+    def put(self, frame):
+        """ Add a frame, return False if it was discarded """
+        with self._cond:
+            self.put_count += 1
+            if len(self._frames) >= self.maxsize:
+                if self.policy == 'drop_oldest':
+                    self._frames.popleft()
+                    self.dropped_oldest += 1
+                elif self.policy == 'drop_newest':
+                    self.dropped_newest += 1
+                    return False
+                else:
+                    self.blocked += 1
+                    start = time.monotonic()
+                    while len(self._frames) >= self.maxsize and not self.closed:
+                        self._cond.wait()
+                    self.blocked_time += time.monotonic() - start
+                    if self.closed:
+                        return False
+            self._frames.append(frame)
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """
+            Return the oldest queued frame, or None on timeout or once the
+            queue is closed and empty.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._frames or self.closed, timeout):
+                return None
+            if not self._frames:
+                return None
+            frame = self._frames.popleft()
+            self._cond.notify_all()      # Room for a blocked put
+            return frame
+
+    def close(self):
+        """ No more frames: wake up everyone waiting on the queue """
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def format(self):
+        """ One-line human readable summary of the counters """
+        text = f"{self.put_count} frames, queue {len(self)}/{self.maxsize} ({self.policy})"
+        if self.policy == 'drop_oldest':
+            return text + f", dropped oldest: {self.dropped_oldest}"
+        if self.policy == 'drop_newest':
+            return text + f", dropped newest: {self.dropped_newest}"
+        return text + f", blocked: {self.blocked} ({self.blocked_time:.2f} s)"
+
+
+class CaptureThread:
+    """
+        Grabs frames from a FrameSource on a dedicated thread.
+
+        Parameters
+        ----------
+        source: FrameSource
+            Source to grab from (ZedSource, SyntheticSource, ...).
+        queue: FrameQueue
+            Queue the frames are put in.
+        retrieve: bool
+            Put a copy of each image (source.retrieve()) in the frames, else
+            the frames only carry their timestamps.
+        on_grab: callable
+            Called on the capture thread with the source after every grab,
+            before the frame is queued (e.g. StreamTelemetry.record_frame).
+    """
+
+    def __init__(self, source, queue, retrieve=True, on_grab=None):
+        self.source = source
+        self.queue = queue
+        self.retrieve = retrieve
+        self.on_grab = on_grab
+        self.grabbed = 0
+        self.error = None            # Exception that stopped the capture
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stop grabbing, the queue is closed once the thread is done """
+        self._stop.set()
+        self.queue.close()           # Unblock a put() waiting for room
+        self._thread.join()
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                if not self.source.grab():
+                    continue
+                if self.on_grab is not None:
+                    self.on_grab(self.source)
+                data = self.source.retrieve() if self.retrieve else None
+                self.queue.put(Frame(self.grabbed, self.source.image_timestamp_ns(),
+                                     self.source.current_timestamp_ns(), data))
+                self.grabbed += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            self.queue.close()
@@ -0,0 +1,99 @@
+# NTP-style clock offset estimation between array_sender.py and
+# array_receiver.py, so one-way transfer times can be computed from two
+# different hosts' time.time() clocks.
+#
+# The sender sends a frame flagged FLAG_SYNC at local time t0. The receiver
+# stamps it on arrival (t1, its clock) and replies with [t1, t2] where t2 is
+# its clock when replying. The reply arrives back at local time t3:
+#
+#   offset = ((t1 - t0) + (t2 - t3)) / 2      (remote clock - local clock)
+#   delay  = (t3 - t0) - (t2 - t1)            (network round trip)
+#
+# A sample's offset is exact only if both directions took the same time, so
+# its error is bounded by delay / 2. Samples are sent in bursts (at connection
+# start and periodically); the lowest-delay sample of each burst is kept, and a
+# line offset(t) = offset + drift * t is fitted through them.
+
+# =========================================================================== #
+import math
+import time
+import numpy as np
+
+
+SYNC_REQUEST = np.zeros(0)      # Payload of a sync request (t0 is kept locally)
+SYNC_SEQ = 1 << 63              # Sync requests are numbered from here, apart from the data
+
+
+def sync_reply(recv_time):
+    """ Receiver side: payload answering a sync request received at recv_time """
+    return np.array([recv_time, time.time()])
+
+
+class ClockSync:
+    """
+        Estimates the offset and drift of a remote clock from sync round trips.
+
+        Parameters
+        ----------
+        burst: int
+            Number of sync requests sent in one burst, only the one with the
+            lowest delay is used.
+    """
+
+    def __init__(self, burst=8):
+        self.burst = burst
+        self._bursts = []           # Per burst: list of (t_mid, offset, delay)
+        self._model = None          # (t_ref, offset, drift, uncertainty)
+
+    def new_burst(self):
+        """ Start a new burst of samples (call before sending a burst) """
+        self._bursts.append([])
+
+    def add_sample(self, t0, t1, t2, t3):
+        """ Add one round trip: t0/t3 local send/receive, t1/t2 remote """
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+        delay = (t3 - t0) - (t2 - t1)
+        if not self._bursts:
+            self.new_burst()
+        self._bursts[-1].append(((t0 + t3) / 2, offset, delay))
+        self._model = None
+
+    def estimate(self):
+        """ Return (t_ref, offset, drift, uncertainty) of the fitted model """
+        if self._model is not None:
+            return self._model
+        best = [min(b, key=lambda s: s[2]) for b in self._bursts if b]
+        if not best:
+            raise RuntimeError("no clock sync samples")
+        t, offset, delay = (np.array(c) for c in zip(*best))
+        t_ref = t[0]
+        if len(best) >= 2 and t[-1] - t[0] > 1.0:
+            # Enough spread in time to see a drift
+            drift, offset_ref = np.polyfit(t - t_ref, offset, 1)
+            residual = offset - (offset_ref + drift * (t - t_ref))
+            spread = float(np.sqrt(np.mean(residual ** 2)))
+        else:
+            i = int(np.argmin(delay))
+            t_ref, offset_ref, drift, spread = t[i], offset[i], 0.0, 0.0
+        # Half the delay bounds the error of a sample, combined with how far
+        # the samples sit from the fitted line
+        uncertainty = math.hypot(float(np.median(delay)) / 2, spread)
+        self._model = (float(t_ref), float(offset_ref), float(drift), uncertainty)
+        return self._model
+
+    def offset(self, local_time):
+        """ Remote clock minus local clock at local_time """
+        t_ref, offset, drift, _ = self.estimate()
+        return offset + drift * (local_time - t_ref)
+
+    def to_local(self, remote_time, local_time):
+        """ Convert a remote timestamp to the local clock (local_time ~ when) """
+        return remote_time - self.offset(local_time)
+
+    def format(self):
+        """ One-line human readable summary """
+        _, offset, drift, uncertainty = self.estimate()
+        n = sum(len(b) for b in self._bursts)
+        return (f"offset={offset * 1e3:.3f} ms  drift={drift * 1e6:.2f} ppm  "
+                f"uncertainty=+/-{uncertainty * 1e6:.1f} us  ({n} samples, "
+                f"{len(self._bursts)} bursts)")
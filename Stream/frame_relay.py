@@ -0,0 +1,369 @@
+# Shared memory frame pool: one process decodes a stream, any number of local
+# processes (viewer, recorder, skeleton extraction, ...) read its frames.
+#
+# The publisher (zed_relay.py) writes each frame once into a slot of the pool;
+# a subscriber always gets the newest frame and reads it in place. A slot is
+# reference counted: every subscriber has a row of hold marks (one per slot)
+# that only it writes, and the number of subscribers holding a slot is its
+# reference count. The publisher only reuses slots nobody holds, and a
+# subscriber holds at most one slot at a time, so with more slots than
+# subscribers there is always a free slot: the publisher never waits, and a
+# slow subscriber skips frames instead of stalling the others.
+#
+#   control (8 x int64)                 latest seq/slot, pool geometry, closed
+#   slot meta (slots x 3 x int64)       seq, IMAGE and CURRENT timestamps (ns)
+#   subscribers (max_subs x 2 x int64)  pid, waiting flag
+#   holds (max_subs x slots x int64)    seq of the frame held, 0 if none
+#   data (slots x slot_size)            array_protocol header + raw array
+#
+# Like shm_transport.py, waiting subscribers block on a named pipe and the
+# publisher only writes to it when their waiting flag is set. Subscribers
+# register under a file lock; rows of subscribers that died are reclaimed.
+
+# =========================================================================== #
+import os
+import errno
+import fcntl
+import select
+import tempfile
+import time
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from array_protocol import HEADER, as_wire_array, header_fields, unpack_header
+from frame_source import FrameSource
+
+
+# Control block (int64 indices) ============================================= #
+LATEST_SEQ = 0     # Seq of the newest published frame (frames start at 1)
+LATEST_SLOT = 1    # Slot of the newest published frame
+SLOTS = 2
+SLOT_SIZE = 3      # Bytes per data slot (header included)
+MAX_SUBS = 4
+CLOSED = 5         # Set by the publisher when it stops
+CONTROL = 8
+
+SEQ, IMAGE_NS, CURRENT_NS = range(3)   # Slot meta columns
+PID, WAITING = range(2)                # Subscriber columns
+WRITING = -1                           # Slot seq while being written
+
+WAIT_TIMEOUT = 0.1
+
+
+def _path(name, suffix):
+    return os.path.join(tempfile.gettempdir(), f'{name}.{suffix}')
+
+
+class FramePool:
+    """
+        Shared memory frame pool, see the top of this file.
+
+        Parameters
+        ----------
+        name: str
+            Name of the pool, subscribers attach to it by name.
+        create: bool
+            Create the pool (publisher) or attach to it (subscriber).
+        slots: int
+            Number of frame slots, at least max_subscribers + 2. Only used
+            with create=True.
+        slot_size: int
+            Largest array in bytes a slot holds. Only used with create=True.
+        max_subscribers: int
+            Number of subscribers that can be attached at the same time.
+    """
+
+    def __init__(self, name, create=False, slots=8, slot_size=1280 * 720 * 4,
+                 max_subscribers=6):
+        self.name = name
+        self._owner = create
+        if create:
+            if slots < max_subscribers + 2:
+                raise ValueError("the pool needs at least max_subscribers + 2 slots")
+            sizes = self._sizes(slots, HEADER.size + slot_size, max_subscribers)
+            try:
+                self._shm = shared_memory.SharedMemory(name, create=True, size=sum(sizes))
+            except FileExistsError:
+                # Left over by a relay that crashed
+                shared_memory.SharedMemory(name).unlink()
+                self._shm = shared_memory.SharedMemory(name, create=True, size=sum(sizes))
+            self._map(slots, HEADER.size + slot_size, max_subscribers)
+            self._ctrl[:] = 0
+            self._meta[:] = 0
+            self._subs[:] = 0
+            self._holds[:] = 0
+            self._ctrl[SLOTS] = slots
+            self._ctrl[SLOT_SIZE] = HEADER.size + slot_size
+            self._ctrl[MAX_SUBS] = max_subscribers
+        else:
+            self._shm = shared_memory.SharedMemory(name)
+            resource_tracker.unregister(self._shm._name, 'shared_memory')
+            ctrl = np.ndarray(CONTROL, np.int64, self._shm.buf)
+            geometry = int(ctrl[SLOTS]), int(ctrl[SLOT_SIZE]), int(ctrl[MAX_SUBS])
+            del ctrl
+            self._map(*geometry)
+        self._fifos = {}       # Subscriber row -> wake-up pipe (publisher side)
+
+    @staticmethod
+    def _sizes(slots, slot_size, max_subs):
+        return (CONTROL * 8, slots * 3 * 8, max_subs * 2 * 8, max_subs * slots * 8,
+                slots * slot_size)
+
+    def _map(self, slots, slot_size, max_subs):
+        self.slots, self.slot_size, self.max_subscribers = slots, slot_size, max_subs
+        sizes = self._sizes(slots, slot_size, max_subs)
+        offsets = np.cumsum((0,) + sizes)
+        buf = self._shm.buf
+        self._ctrl = np.ndarray(CONTROL, np.int64, buf, offsets[0])
+        self._meta = np.ndarray((slots, 3), np.int64, buf, offsets[1])
+        self._subs = np.ndarray((max_subs, 2), np.int64, buf, offsets[2])
+        self._holds = np.ndarray((max_subs, slots), np.int64, buf, offsets[3])
+        self._data = np.ndarray(sizes[4], np.uint8, buf, offsets[4])
+
+    # Publisher side -------------------------------------------------------- #
+    def publish(self, array, image_ns=0, current_ns=0):
+        """ Copy array into a free slot and make it the newest frame """
+        array = as_wire_array(array)
+        if HEADER.size + array.nbytes > self.slot_size:
+            raise ValueError(f"frame of {array.nbytes} bytes does not fit a "
+                             f"{self.slot_size - HEADER.size} bytes slot")
+        seq = int(self._ctrl[LATEST_SEQ]) + 1
+        slot = self._free_slot()
+        offset = slot * self.slot_size
+        HEADER.pack_into(self._data, offset, *header_fields(array, seq))
+        start = offset + HEADER.size
+        self._data[start:start + array.nbytes] = array.reshape(-1).view(np.uint8)
+        self._meta[slot, IMAGE_NS] = image_ns
+        self._meta[slot, CURRENT_NS] = current_ns
+        self._meta[slot, SEQ] = seq
+        self._ctrl[LATEST_SLOT] = slot
+        self._ctrl[LATEST_SEQ] = seq                    # Publish the frame
+        self._wake()
+        return seq
+
+    def _free_slot(self):
+        """
+            Claim the oldest slot that no subscriber holds, other than the
+            newest one, and mark it WRITING.
+        """
+        latest = int(self._ctrl[LATEST_SLOT]) if self._ctrl[LATEST_SEQ] else -1
+        while True:
+            refcount = np.count_nonzero(self._holds, axis=0)
+            free = [s for s in range(self.slots) if refcount[s] == 0 and s != latest]
+            for slot in sorted(free, key=lambda s: self._meta[s, SEQ]):
+                previous = int(self._meta[slot, SEQ])
+                self._meta[slot, SEQ] = WRITING
+                # A subscriber that read an older LATEST_SLOT may have taken
+                # the slot meanwhile: it either sees WRITING and retries, or
+                # its hold is visible here and the slot is left to it
+                if not self._holds[:, slot].any():
+                    return slot
+                self._meta[slot, SEQ] = previous
+            # Only possible if dead subscribers still hold slots
+            self.reclaim()
+            time.sleep(1e-3)
+
+    def reclaim(self):
+        """ Release the rows (and holds) of subscribers that are gone """
+        for row in range(self.max_subscribers):
+            pid = int(self._subs[row, PID])
+            if pid and not _alive(pid):
+                self._holds[row] = 0
+                self._subs[row] = 0
+                fifo = self._fifos.pop(row, None)
+                if fifo is not None:
+                    os.close(fifo)
+                try:
+                    os.unlink(_path(f'{self.name}_{row}', 'fifo'))
+                except FileNotFoundError:
+                    pass
+
+    def _wake(self):
+        """ Wake up the subscribers blocked on their pipe """
+        for row in np.flatnonzero(self._subs[:, WAITING]):
+            row = int(row)
+            try:
+                if row not in self._fifos:
+                    self._fifos[row] = os.open(_path(f'{self.name}_{row}', 'fifo'),
+                                               os.O_WRONLY | os.O_NONBLOCK)
+                os.write(self._fifos[row], b'\0')
+            except OSError as e:
+                # Same cases as ShmRing._wake(): not opened yet, full, or gone
+                if e.errno not in (errno.ENXIO, errno.EAGAIN, errno.EPIPE, errno.ENOENT):
+                    raise
+                if e.errno == errno.EAGAIN:
+                    continue                    # Full of wake-ups already, keep it open
+                fifo = self._fifos.pop(row, None)
+                if fifo is not None:            # EPIPE: the subscriber is gone
+                    os.close(fifo)
+
+    def close(self):
+        """ Detach, and remove the pool if this side created it """
+        if self._owner and self._ctrl is not None:
+            self._ctrl[CLOSED] = 1
+            self._subs[:, WAITING] = 1          # Wake everyone up one last time
+            self._wake()
+        for fifo in self._fifos.values():
+            os.close(fifo)
+        self._fifos = {}
+        self._ctrl = self._meta = self._subs = self._holds = self._data = None
+        try:
+            self._shm.close()
+        except BufferError:
+            pass                    # A frame view is still alive, see ShmRing
+        if self._owner:
+            self._shm.unlink()
+            try:
+                os.unlink(_path(self.name, 'lock'))
+            except FileNotFoundError:
+                pass
+
+
+class Subscription:
+    """
+        Subscriber side of a FramePool.
+
+        Parameters
+        ----------
+        name: str
+            Name of the pool (see zed_relay.py).
+    """
+
+    def __init__(self, name):
+        self.pool = FramePool(name)
+        self.name = name
+        self.last_seq = 0
+        self.received = 0
+        self.skipped = 0            # Frames published while we were busy
+        self._held = None           # Slot held for the last returned frame
+        self.row = self._register()
+        self._fifo_path = _path(f'{name}_{self.row}', 'fifo')
+        if not os.path.exists(self._fifo_path):
+            os.mkfifo(self._fifo_path)
+        # O_RDWR keeps the pipe open for writing too, so it never hits EOF
+        self._fifo = os.open(self._fifo_path, os.O_RDWR | os.O_NONBLOCK)
+
+    def _register(self):
+        """ Claim a free subscriber row (under a lock, rows of dead pids are free) """
+        with open(_path(self.name, 'lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            subs = self.pool._subs
+            for row in range(self.pool.max_subscribers):
+                pid = int(subs[row, PID])
+                if pid == 0 or not _alive(pid):
+                    self.pool._holds[row] = 0
+                    subs[row, WAITING] = 0
+                    subs[row, PID] = os.getpid()
+                    return row
+        raise RuntimeError(f"{self.name} already has {self.pool.max_subscribers} subscribers")
+
+    def get(self, timeout=None):
+        """
+            Return (seq, image_ns, current_ns, array) of the newest frame not
+            returned yet, or None on timeout or once the publisher closed. The
+            array is a view of the slot, valid until the next call to get().
+        """
+        pool = self.pool
+        holds = pool._holds[self.row]
+        if self._held is not None:                       # Release previous slot
+            holds[self._held] = 0
+            self._held = None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            seq = int(pool._ctrl[LATEST_SEQ])
+            if seq > self.last_seq:
+                slot = int(pool._ctrl[LATEST_SLOT])
+                holds[slot] = seq
+                if pool._meta[slot, SEQ] == seq:
+                    break                                # Slot is ours to read
+                holds[slot] = 0                          # Reused meanwhile, retry
+                continue
+            if pool._ctrl[CLOSED]:
+                return None
+            if not self._wait(deadline):
+                return None
+        if self.last_seq:
+            self.skipped += seq - self.last_seq - 1
+        self.last_seq = seq
+        self.received += 1
+        self._held = slot
+        offset = slot * pool.slot_size
+        dtype, shape, _, _, _, nbytes = unpack_header(pool._data[offset:offset + HEADER.size])
+        start = offset + HEADER.size
+        array = pool._data[start:start + nbytes].view(dtype).reshape(shape)
+        return seq, int(pool._meta[slot, IMAGE_NS]), int(pool._meta[slot, CURRENT_NS]), array
+
+    def _wait(self, deadline):
+        """ Block until something is published, False on timeout """
+        subs = self.pool._subs
+        subs[self.row, WAITING] = 1
+        try:
+            if self.pool._ctrl[LATEST_SEQ] > self.last_seq:
+                return True                              # No lost wake-ups
+            wait = WAIT_TIMEOUT
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return False
+            if select.select([self._fifo], [], [], wait)[0]:
+                try:
+                    os.read(self._fifo, 4096)            # Drain wake-ups
+                except BlockingIOError:
+                    pass
+            return True
+        finally:
+            subs[self.row, WAITING] = 0
+
+    def close(self):
+        """ Release the held slot and the subscriber row """
+        if self.pool._holds is not None:
+            self.pool._holds[self.row] = 0
+            self.pool._subs[self.row] = 0
+        os.close(self._fifo)
+        try:
+            os.unlink(self._fifo_path)
+        except FileNotFoundError:
+            pass
+        self.pool.close()
+
+
+class RelaySource(FrameSource):
+    """
+        FrameSource reading the frames of a relay, so the acquisition loops
+        (zed_receiver.py, CaptureThread, ...) can run on it unchanged.
+    """
+
+    def __init__(self, name):
+        self.subscription = Subscription(name)
+        self._frame = None
+
+    def grab(self):
+        self._frame = self.subscription.get(timeout=WAIT_TIMEOUT)
+        if self._frame is None and self.subscription.pool._ctrl[CLOSED]:
+            raise EOFError("the relay stopped")
+        return self._frame is not None
+
+    def image_timestamp_ns(self):
+        return self._frame[1]
+
+    def current_timestamp_ns(self):
+        return self._frame[2]
+
+    def frames_dropped(self):
+        return self.subscription.skipped
+
+    def retrieve(self):
+        return self._frame[3].copy()
+
+    def close(self):
+        self._frame = None
+        self.subscription.close()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,156 @@
+# Frame sources for the streaming tools.
+#
+# The acquisition loops only need a few things from the camera: grab a frame,
+# its IMAGE and CURRENT timestamps, how many frames were dropped so far, and
+# a copy of the image when it is processed somewhere else (retrieve).
+# FrameSource is that small interface. ZedSource implements it on top of an
+# opened sl.Camera; SyntheticSource generates the same timestamps without a
+# camera (chosen frame rate, latency, jitter and drops), so the telemetry can
+# be tried out on any machine.
+
+# =========================================================================== #
+import time
+import numpy as np
+
+try:
+    import pyzed.sl as sl
+except ImportError:         # Only ZedSource needs the ZED SDK
+    sl = None
+
+
+class FrameSource:
+    """ Interface of a frame source, see ZedSource and SyntheticSource """
+
+    def grab(self):
+        """ Wait for the next frame, return True if one was grabbed """
+        raise NotImplementedError
+
+    def image_timestamp_ns(self):
+        """ Capture time of the last grabbed frame (ns, camera clock) """
+        raise NotImplementedError
+
+    def current_timestamp_ns(self):
+        """ Current time (ns, same clock as image_timestamp_ns) """
+        raise NotImplementedError
+
+    def frames_dropped(self):
+        """ Number of frames dropped since the source was opened """
+        return 0
+
+    def retrieve(self):
+        """ Image of the last grabbed frame, owned by the caller (or None) """
+        return None
+
+    def close(self):
+        pass
+
+
+class ZedSource(FrameSource):
+    """
+        Frame source on top of an opened ZED camera (or stream).
+
+        Parameters
+        ----------
+        zed: sl.Camera
+            Opened camera.
+        runtime_params: sl.RuntimeParameters
+            Parameters passed to every zed.grab().
+    """
+
+    def __init__(self, zed, runtime_params):
+        if sl is None:
+            raise ImportError("ZedSource needs the ZED SDK (pyzed)")
+        self.zed = zed
+        self.runtime_params = runtime_params
+        self._mat = sl.Mat()
+
+    def grab(self):
+        return self.zed.grab(self.runtime_params) == sl.ERROR_CODE.SUCCESS
+
+    def image_timestamp_ns(self):
+        return self.zed.get_timestamp(sl.TIME_REFERENCE.IMAGE).get_nanoseconds()
+
+    def current_timestamp_ns(self):
+        return self.zed.get_timestamp(sl.TIME_REFERENCE.CURRENT).get_nanoseconds()
+
+    def frames_dropped(self):
+        # Not available in older SDKs
+        count = getattr(self.zed, 'get_frame_dropped_count', None)
+        return count() if count is not None else 0
+
+    def retrieve(self, view=None):
+        # The Mat is reused by the next retrieve, hand out a copy
+        self.zed.retrieve_image(self._mat, sl.VIEW.LEFT if view is None else view)
+        return self._mat.get_data().copy()
+
+    def close(self):
+        self.zed.close()
+
+
+class SyntheticSource(FrameSource):
+    """
+        Camera-less frame source with a known timing behavior.
+
+        Parameters
+        ----------
+        fps: float
+            Nominal frame rate.
+        latency: float
+            Mean delay (s) between capture and reception.
+        jitter: float
+            Standard deviation (s) of the capture interval and of the latency.
+        drop_rate: float
+            Probability that a frame is dropped (skipped, counted as dropped).
+        real_time: bool
+            If True grab() sleeps until the frame is due, else it returns at
+            once (for fast tests).
+        seed: int
+            Random seed, the stream is reproducible.
+        image_shape: tuple
+            Shape of the (uint8) images returned by retrieve(), or None.
+    """
+
+    def __init__(self, fps=60.0, latency=0.030, jitter=0.001, drop_rate=0.0,
+                 real_time=True, seed=0, image_shape=None):
+        self.period = 1.0 / fps
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.real_time = real_time
+        self._rng = np.random.default_rng(seed)
+        self._next_capture = time.time()
+        self._image = self._current = None
+        self._dropped = 0
+        self._grabbed = 0
+        self.image_shape = image_shape
+
+    def grab(self):
+        while True:
+            capture = self._next_capture
+            self._next_capture += max(self.period + self._rng.normal(0, self.jitter), 0)
+            if self._rng.random() >= self.drop_rate:
+                break
+            self._dropped += 1
+        arrival = capture + max(self.latency + self._rng.normal(0, self.jitter), 0)
+        if self.real_time:
+            delay = arrival - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        self._image = int(capture * 1e9)
+        self._current = int(arrival * 1e9)
+        self._grabbed += 1
+        return True
+
+    def image_timestamp_ns(self):
+        return self._image
+
+    def current_timestamp_ns(self):
+        return self._current
+
+    def frames_dropped(self):
+        return self._dropped
+
+    def retrieve(self):
+        if self.image_shape is None:
+            return None
+        return np.full(self.image_shape, self._grabbed % 256, np.uint8)
@@ -0,0 +1,167 @@
+# Live synchronization of frames from several cameras.
+#
+# Each camera thread hands its frames to FrameSynchronizer.put() as (image
+# timestamp, frame handle) events; a consumer gets back bundles: one frame per
+# camera, all with image timestamps within <tolerance> of each other.
+#
+# Every camera has a bounded queue (the oldest frame is dropped when it is
+# full, a grab thread never blocks), and so do the bundles waiting for the
+# consumer: with a slow consumer the oldest bundle is dropped, its frames
+# counted in overflow. Whenever every queue has a frame, the
+# newest of the oldest frames sets the pace: older frames that can no longer
+# be matched to it are discarded, and once the oldest frames all sit within
+# the tolerance they are emitted together. If a camera stops delivering, the
+# oldest frame waits at most <max_wait> seconds, then the <missing> policy
+# applies:
+#
+#   'partial'  emit the frames that match the oldest one, None for the others
+#   'drop'     discard the oldest frame, only complete bundles are emitted
+
+# =========================================================================== #
+import collections
+import threading
+import time
+from latency_stats import LatencyHistogram
+
+
+Bundle = collections.namedtuple('Bundle', 'timestamp frames timestamps skew')
+Bundle.__doc__ = """
+    Frames taken at the same moment.
+
+    timestamp: int     oldest image timestamp of the bundle (ns)
+    frames: list       frame handle per camera, None if it is missing
+    timestamps: list   image timestamp (ns) per camera, None if it is missing
+    skew: float        newest minus oldest timestamp of the bundle (s)
+"""
+
+
+class FrameSynchronizer:
+    """
+        Pairs up frames of several cameras by image timestamp.
+
+        Parameters
+        ----------
+        n_cameras: int
+            Number of cameras, put() takes an index in range(n_cameras).
+        tolerance: float
+            Largest timestamp difference (s) between frames of a bundle,
+            typically half a frame period.
+        queue_size: int
+            Frames buffered per camera before the oldest one is dropped, and
+            bundles not yet consumed before the oldest one is dropped.
+        max_wait: float
+            Time (s) the oldest frame waits for a missing camera.
+        missing: str
+            'partial' or 'drop', what to do once max_wait is over.
+    """
+
+    def __init__(self, n_cameras, tolerance=0.5 / 30, queue_size=8, max_wait=0.2,
+                 missing='partial'):
+        if missing not in ('partial', 'drop'):
+            raise ValueError(f"unknown missing camera policy: {missing}")
+        self.n_cameras = n_cameras
+        self.tolerance = int(tolerance * 1e9)
+        self.max_wait = max_wait
+        self.missing = missing
+        self._queues = [collections.deque() for _ in range(n_cameras)]
+        self.queue_size = queue_size
+        self._ready = collections.deque()      # Bundles not yet consumed, up to queue_size
+        self._cond = threading.Condition()
+        self.skew = LatencyHistogram()          # Skew of the emitted bundles
+        self.n_bundles = 0
+        self.n_partial = 0
+        self.n_dropped = 0                      # Bundles dropped, consumer too slow
+        self.unmatched = [0] * n_cameras        # Frames discarded unmatched
+        self.overflow = [0] * n_cameras         # Frames dropped, queue full
+
+    # Camera side ----------------------------------------------------------- #
+    def put(self, index, timestamp_ns, frame):
+        """ Hand over one frame of camera index (image timestamp in ns) """
+        with self._cond:
+            queue = self._queues[index]
+            if len(queue) >= self.queue_size:
+                queue.popleft()
+                self.overflow[index] += 1
+            queue.append((timestamp_ns, frame, time.monotonic()))
+            if self._match():
+                self._cond.notify_all()
+
+    # Consumer side --------------------------------------------------------- #
+    def get(self, timeout=None):
+        """ Return the next Bundle, or None if there is none within timeout """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                self._match()
+                if self._ready:
+                    return self._ready.popleft()
+                wait = self.max_wait
+                if deadline is not None:
+                    wait = min(wait, deadline - time.monotonic())
+                    if wait <= 0:
+                        return None
+                # Wake up at least every max_wait to apply the missing policy
+                self._cond.wait(wait)
+
+    # Matching (called with the lock held) ---------------------------------- #
+    def _match(self):
+        """ Move every bundle that can be formed to the ready list """
+        emitted = False
+        while True:
+            heads = [q[0] if q else None for q in self._queues]
+            if all(h is not None for h in heads):
+                pace = max(h[0] for h in heads)
+                stale = [i for i, h in enumerate(heads) if h[0] < pace - self.tolerance]
+                if stale:
+                    # These can not match the pace frame nor anything later
+                    for i in stale:
+                        self._queues[i].popleft()
+                        self.unmatched[i] += 1
+                    continue
+                self._emit([q.popleft() for q in self._queues])
+                emitted = True
+                continue
+            present = [h for h in heads if h is not None]
+            if not present:
+                return emitted
+            oldest = min(present, key=lambda h: h[0])
+            if time.monotonic() - oldest[2] < self.max_wait:
+                return emitted
+            # A camera is missing and the oldest frame waited long enough
+            limit = oldest[0] + self.tolerance
+            members = [q.popleft() if q and q[0][0] <= limit else None
+                       for q in self._queues]
+            if self.missing == 'partial':
+                self._emit(members)
+                emitted = True
+            else:
+                for i, m in enumerate(members):
+                    if m is not None:
+                        self.unmatched[i] += 1
+
+    def _emit(self, members):
+        timestamps = [m[0] if m is not None else None for m in members]
+        present = [t for t in timestamps if t is not None]
+        skew = (max(present) - min(present)) * 1e-9
+        if len(self._ready) >= self.queue_size:
+            # The consumer falls behind: drop the oldest bundle, not the newest
+            dropped = self._ready.popleft()
+            self.n_dropped += 1
+            for i, t in enumerate(dropped.timestamps):
+                if t is not None:
+                    self.overflow[i] += 1
+        self._ready.append(Bundle(min(present),
+                                  [m[1] if m is not None else None for m in members],
+                                  timestamps, skew))
+        self.skew.record(skew)
+        self.n_bundles += 1
+        if len(present) < self.n_cameras:
+            self.n_partial += 1
+
+    def format(self):
+        """ One-line human readable summary """
+        with self._cond:
+            return (f"bundles: {self.n_bundles} ({self.n_partial} partial, "
+                    f"{self.n_dropped} dropped)  "
+                    f"unmatched: {self.unmatched}  overflow: {self.overflow}  "
+                    f"skew: {self.skew.format(scale=1e3, unit='ms')}")
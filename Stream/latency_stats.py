@@ -0,0 +1,108 @@
+# Low-overhead latency recording for the array transfer tools.
+#
+# LatencyHistogram keeps counts in log-spaced buckets (1% wide by default)
+# instead of storing every sample, so recording costs one log() and one list
+# increment, memory stays constant however long the run is, and percentiles
+# are accurate to the bucket width.
+
+# =========================================================================== #
+import math
+
+
+class LatencyHistogram:
+    """
+        Log-bucketed histogram of latencies in seconds.
+
+        Parameters
+        ----------
+        lowest: float
+            Smallest latency that gets its own bucket (s). Anything below
+            falls in the first bucket.
+        highest: float
+            Largest latency that gets its own bucket (s). Anything above
+            falls in the last bucket.
+        precision: float
+            Relative width of a bucket (0.01 = 1%).
+    """
+
+    PERCENTILES = (50, 90, 99, 99.9)
+
+    def __init__(self, lowest=1e-7, highest=100.0, precision=0.01):
+        self.lowest = lowest
+        self._log_base = math.log1p(precision)
+        self._n_buckets = int(math.log(highest / lowest) / self._log_base) + 2
+        self.reset()
+
+    def reset(self):
+        """ Drop every recorded sample """
+        self.counts = [0] * self._n_buckets
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def record(self, value):
+        """ Record one latency (s) """
+        self.count += 1
+        self.total += value
+        if value < self.min: self.min = value
+        if value > self.max: self.max = value
+        if value <= self.lowest:
+            index = 0
+        else:
+            index = min(int(math.log(value / self.lowest) / self._log_base) + 1,
+                        self._n_buckets - 1)
+        self.counts[index] += 1
+
+    def merge(self, other):
+        """ Add the samples of another histogram with the same buckets """
+        if other._n_buckets != self._n_buckets or other.lowest != self.lowest:
+            raise ValueError("histograms have different buckets")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def bucket_value(self, index):
+        """ Representative value of a bucket (its geometric middle) """
+        if index == 0:
+            return self.lowest
+        return self.lowest * math.exp((index - 0.5) * self._log_base)
+
+    def percentile(self, p):
+        """ Latency below which p percent of the samples are (s) """
+        if self.count == 0:
+            return math.nan
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= max(rank, 1):
+                # Never report outside of what was actually measured
+                return min(max(self.bucket_value(index), self.min), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else math.nan
+
+    def summary(self, scale=1e6):
+        """ Dict of count/min/mean/percentiles/max, scaled (default: us) """
+        out = {'count': self.count}
+        if self.count == 0:
+            return out
+        out['min'] = self.min * scale
+        out['mean'] = self.mean() * scale
+        for p in self.PERCENTILES:
+            out[f'p{p:g}'] = self.percentile(p) * scale
+        out['max'] = self.max * scale
+        return out
+
+    def format(self, scale=1e6, unit='us'):
+        """ One-line human readable summary """
+        s = self.summary(scale)
+        if s['count'] == 0:
+            return "no samples"
+        return ("n=%d  min=%.1f  mean=%.1f  " % (s['count'], s['min'], s['mean']) +
+                "  ".join(f"p{p:g}=%.1f" % s[f'p{p:g}'] for p in self.PERCENTILES) +
+                "  max=%.1f %s" % (s['max'], unit))
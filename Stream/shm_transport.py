@@ -0,0 +1,294 @@
+# Shared memory transport for array_sender.py and array_receiver.py when both
+# run on the same machine (e.g. the ZED edge process and the model process on
+# one Jetson). It has the same send()/recv()/shutdown()/close() API as
+# SocketChannel in array_protocol.py, so the scripts can switch between the
+# two with a flag.
+#
+# A channel is made of two single-producer/single-consumer rings, one per
+# direction. Each ring is a multiprocessing.shared_memory block:
+#
+#   control (8 x int64) | slot 0 | slot 1 | ... | slot <slots-1>
+#
+# and every slot holds one frame in the array_protocol layout (header, trace
+# block if any, payload). The producer only moves head and the consumer only
+# moves tail, so no lock is needed. A consumer with nothing to read sets a
+# waiting flag and blocks on a named pipe; the producer writes a wake-up byte
+# to the pipe only when that flag is set, so a busy stream costs a memcpy and
+# no syscalls.
+#
+# Each side writes its pid in the control block. A side waiting on the other
+# one (an empty ring for the consumer, a full one for the producer) checks
+# every WAIT_TIMEOUT that the peer is still alive, so a crashed peer ends the
+# stream like a reset TCP connection: get() returns None, put() raises
+# ConnectionError.
+
+# =========================================================================== #
+import os
+import errno
+import select
+import tempfile
+import time
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from array_protocol import (HEADER, CODEC_RAW, FLAG_TRACE, as_wire_array, header_fields,
+                            unpack_header, encode_payload, decode_payload, trace_size)
+from stage_trace import TRACE, Trace
+
+
+# Control block layout (int64 indices) ====================================== #
+HEAD = 0           # Number of frames published by the producer
+TAIL = 1           # Number of frames released by the consumer
+WAITING = 2        # Set by the consumer before it blocks on the wake-up pipe
+CLOSED = 3         # Set by the producer when it closes its end
+SLOTS = 4          # Number of slots in the ring
+SLOT_SIZE = 5      # Size of one slot in bytes (header and trace included)
+PRODUCER_PID = 6   # pid of the producer, 0 until it is known
+CONSUMER_PID = 7   # pid of the consumer, 0 until it is known
+CONTROL_SIZE = 64  # Bytes reserved for the control block
+
+FULL_BACKOFF = 50e-6   # Producer sleep (s) while the ring is full
+WAIT_TIMEOUT = 0.1     # Consumer re-checks the ring at least this often (s),
+                       # ... which also bounds a wake-up lost to CPU reordering
+
+
+# Helper functions ========================================================== #
+def fifo_path(name):
+    """ Path of the named pipe used to wake up the consumer of ring name """
+    return os.path.join(tempfile.gettempdir(), name + '.fifo')
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Shared memory ring ======================================================== #
+class ShmRing:
+    """
+        Fixed-slot ring buffer of frames in shared memory.
+
+        Parameters
+        ----------
+        name: str
+            Name of the shared memory block (and of its wake-up pipe).
+        create: bool
+            Create the ring (server side) or attach to an existing one.
+        slots: int
+            Number of frames the ring can hold. Only used with create=True.
+        slot_size: int
+            Largest payload in bytes a slot can hold. Only used with create=True.
+        side: str
+            'producer' or 'consumer': the side this process takes, its pid is
+            written in the control block at once (otherwise on the first
+            put() or get()).
+    """
+
+    def __init__(self, name, create=False, slots=64, slot_size=65536, side=None):
+        self.name = name
+        self._owner = create
+        if create:
+            size = CONTROL_SIZE + slots * (HEADER.size + TRACE.size + slot_size)
+            try:
+                self._shm = shared_memory.SharedMemory(name, create=True, size=size)
+            except FileExistsError:
+                # Left over from a process that did not exit cleanly
+                stale = shared_memory.SharedMemory(name)
+                stale.close()
+                stale.unlink()
+                self._shm = shared_memory.SharedMemory(name, create=True, size=size)
+            if hasattr(os, 'mkfifo') and not os.path.exists(fifo_path(name)):
+                os.mkfifo(fifo_path(name))
+        else:
+            self._shm = shared_memory.SharedMemory(name)
+            # The attaching side must not unlink the block when it exits
+            # (resource_tracker would otherwise do it behind the owner's back)
+            resource_tracker.unregister(self._shm._name, 'shared_memory')
+
+        self._ctrl = np.ndarray((CONTROL_SIZE // 8,), np.int64, self._shm.buf)
+        if create:
+            self._ctrl[:] = 0
+            self._ctrl[SLOTS] = slots
+            self._ctrl[SLOT_SIZE] = HEADER.size + TRACE.size + slot_size
+        self._bytes = np.ndarray((self._shm.size,), np.uint8, self._shm.buf)
+        self.slots = int(self._ctrl[SLOTS])
+        self.slot_size = int(self._ctrl[SLOT_SIZE])
+        self._fifo = None      # Wake-up pipe file descriptor, opened lazily
+        self._pending = False  # The consumer still holds the slot at tail
+        self.trace = None      # Trace of the last frame returned by get()
+        if side is not None:
+            self._ctrl[PRODUCER_PID if side == 'producer' else CONSUMER_PID] = os.getpid()
+
+    def _peer_gone(self, peer):
+        """ Whether the process at control index peer (a *_PID) has died """
+        pid = int(self._ctrl[peer])
+        return pid != 0 and not _alive(pid)
+
+    # Producer side --------------------------------------------------------- #
+    def put(self, array, seq, flags=0, codec=CODEC_RAW, trace=None):
+        """ Copy array into the next free slot and publish it """
+        array = as_wire_array(array)
+        payload = encode_payload(array, codec)
+        start = HEADER.size + trace_size(trace)
+        if start + payload.nbytes > self.slot_size:
+            raise ValueError(f"frame of {payload.nbytes} bytes does not fit a "
+                             f"{self.slot_size - start} bytes slot")
+        if self._ctrl[PRODUCER_PID] != os.getpid():
+            self._ctrl[PRODUCER_PID] = os.getpid()
+        head = int(self._ctrl[HEAD])
+        check = time.monotonic() + WAIT_TIMEOUT
+        while head - int(self._ctrl[TAIL]) >= self.slots:   # Ring is full
+            time.sleep(FULL_BACKOFF)
+            if time.monotonic() >= check:
+                if self._peer_gone(CONSUMER_PID):
+                    raise ConnectionError(f"{self.name}: consumer is gone")
+                check = time.monotonic() + WAIT_TIMEOUT
+        offset = CONTROL_SIZE + (head % self.slots) * self.slot_size
+        HEADER.pack_into(self._shm.buf, offset,
+                         *header_fields(array, seq, flags, codec, payload.nbytes, trace))
+        if trace is not None:
+            trace.pack_into(self._shm.buf, offset + HEADER.size)
+        start += offset
+        self._bytes[start:start + payload.nbytes] = payload
+        self._ctrl[HEAD] = head + 1                          # Publish the slot
+        if self._ctrl[WAITING]:
+            self._wake()
+
+    def close_writer(self):
+        """ Tell the consumer that no more frames will be published """
+        self._ctrl[CLOSED] = 1
+        self._wake()
+
+    def _wake(self):
+        """ Write a wake-up byte to the consumer's pipe (never blocks) """
+        if not hasattr(os, 'mkfifo'):
+            return                                       # Consumer is polling
+        try:
+            if self._fifo is None:
+                self._fifo = os.open(fifo_path(self.name), os.O_WRONLY | os.O_NONBLOCK)
+            os.write(self._fifo, b'\0')
+        except OSError as e:
+            # ENXIO: consumer has not opened the pipe yet, it checks the ring
+            # before blocking anyway. EAGAIN: pipe is full of wake-ups already.
+            # EPIPE: consumer is gone, nobody to wake up.
+            if e.errno not in (errno.ENXIO, errno.EAGAIN, errno.EPIPE):
+                raise
+
+    # Consumer side --------------------------------------------------------- #
+    def get(self):
+        """
+            Return (seq, flags, array) of the next frame, or None once the
+            producer has closed and the ring is drained. The array is a view
+            of the slot and is only valid until the next call to get().
+        """
+        if self._pending:                                # Release previous slot
+            self._ctrl[TAIL] += 1
+            self._pending = False
+        if not self._wait():
+            return None
+        offset = CONTROL_SIZE + (int(self._ctrl[TAIL]) % self.slots) * self.slot_size
+        dtype, shape, flags, codec, seq, nbytes = unpack_header(
+            self._shm.buf[offset:offset + HEADER.size])
+        start = offset + HEADER.size
+        self.trace = None
+        if flags & FLAG_TRACE:
+            self.trace = Trace.unpack_from(self._shm.buf, start)
+            start += trace_size(self.trace)
+        if codec == CODEC_RAW:
+            array = self._bytes[start:start + nbytes].view(dtype).reshape(shape)
+        else:
+            array = decode_payload(self._bytes[start:start + nbytes], dtype, shape, codec)
+        self._pending = True
+        return seq, flags, array
+
+    def _ready(self):
+        return self._ctrl[HEAD] != self._ctrl[TAIL]
+
+    def _wait(self):
+        """ Block until a frame is available, return False if closed or the producer died """
+        if self._fifo is None and hasattr(os, 'mkfifo'):
+            # O_RDWR keeps the pipe open for writing too, so it never hits EOF
+            self._fifo = os.open(fifo_path(self.name), os.O_RDWR | os.O_NONBLOCK)
+        if self._ctrl[CONSUMER_PID] != os.getpid():
+            self._ctrl[CONSUMER_PID] = os.getpid()
+        check = time.monotonic() + WAIT_TIMEOUT
+        while not self._ready():
+            if self._ctrl[CLOSED]:
+                return False
+            if time.monotonic() >= check:
+                if self._peer_gone(PRODUCER_PID):
+                    return False                         # Crashed without closing
+                check = time.monotonic() + WAIT_TIMEOUT
+            self._ctrl[WAITING] = 1
+            if not self._ready():                        # No lost wake-ups
+                if self._fifo is None:
+                    time.sleep(FULL_BACKOFF)
+                elif select.select([self._fifo], [], [], WAIT_TIMEOUT)[0]:
+                    try:
+                        os.read(self._fifo, 4096)        # Drain wake-ups
+                    except BlockingIOError:
+                        pass
+            self._ctrl[WAITING] = 0
+        return True
+
+    # Both sides ------------------------------------------------------------ #
+    def close(self):
+        """ Detach from the ring, and remove it if this side created it """
+        if self._fifo is not None:
+            os.close(self._fifo)
+            self._fifo = None
+        self._ctrl = self._bytes = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # A view returned by get() is still alive, the mapping is released
+            # together with it when it is garbage collected
+            pass
+        if self._owner:
+            self._shm.unlink()
+            if os.path.exists(fifo_path(self.name)):
+                os.unlink(fifo_path(self.name))
+
+
+# Shared memory channel ===================================================== #
+class ShmChannel:
+    """
+        Two-way frame channel over a pair of shared memory rings.
+
+        The server creates the channel (create=True), the client attaches to
+        it by name. Same API as SocketChannel: send(), recv(), shutdown(),
+        close() and .trace.
+    """
+
+    def __init__(self, name, create=False, slots=64, slot_size=65536):
+        c2s = ShmRing(name + '_c2s', create, slots, slot_size,
+                      'consumer' if create else 'producer')
+        s2c = ShmRing(name + '_s2c', create, slots, slot_size,
+                      'producer' if create else 'consumer')
+        self._out, self._in = (s2c, c2s) if create else (c2s, s2c)
+
+    def send(self, array, seq, flags=0, codec=CODEC_RAW, trace=None):
+        """ Send array as one frame, with trace if given """
+        self._out.put(array, seq, flags, codec, trace)
+
+    def recv(self):
+        """ Receive one frame, return (seq, flags, array) or None if closed """
+        return self._in.get()
+
+    @property
+    def trace(self):
+        """ Trace of the last frame received, or None """
+        return self._in.trace
+
+    def shutdown(self):
+        """ Tell the peer that no more frames will be sent, replies still arrive """
+        self._out.close_writer()
+
+    def close(self):
+        self._out.close_writer()
+        self._out.close()
+        self._in.close()
@@ -0,0 +1,127 @@
+# End-to-end latency tracing, from the camera image to the model result.
+#
+# A frame flagged FLAG_TRACE carries a trace block between its header and
+# its payload (see array_protocol.py): the camera image timestamp, then the
+# time at which each stage of the pipeline was done, as offsets from it:
+#
+#   image      camera image timestamp (ZED TIME_REFERENCE.IMAGE)
+#   grab       zed.grab() returned                        \
+#   retrieve   skeletons retrieved (retrieve_objects)      | sender clock
+#   window     sliding window built                        |
+#   send       frame handed to the socket                 /
+#   receive    frame received                             \
+#   inference  model output ready                          | receiver clock
+#   reply      reply handed to the socket                 /
+#   result     reply received back by the sender            sender clock
+#
+#   image (ns) | 8 stage offsets (us, MISSING if the stage was not stamped)
+#       Q      |        8 x i
+#
+# The receiver sends the trace back with its reply, so the sender ends up with
+# every stage. Receiver stamps are in the receiver's clock: shift them with
+# the ClockSync estimate (Trace.shifted) before comparing them across hosts.
+# TraceStats turns traces into one latency distribution per stage.
+
+# =========================================================================== #
+import math
+import struct
+import time
+import numpy as np
+from latency_stats import LatencyHistogram
+
+
+STAGES = ('image', 'grab', 'retrieve', 'window', 'send',
+          'receive', 'inference', 'reply', 'result')
+STAGE_INDEX = {stage: i for i, stage in enumerate(STAGES)}
+REMOTE_STAGES = ('receive', 'inference', 'reply')   # Stamped by the receiver
+
+TRACE = struct.Struct('!Q%di' % (len(STAGES) - 1))   # Trace block on the wire
+MISSING = -2 ** 31                                    # Offset of a missing stage
+
+
+class Trace:
+    """
+        Stage timestamps of one message.
+
+        Parameters
+        ----------
+        image_time: float
+            Camera image timestamp (s, same clock as time.time()), e.g.
+            zed.get_timestamp(sl.TIME_REFERENCE.IMAGE).get_nanoseconds() / 1e9.
+            Defaults to now.
+    """
+
+    def __init__(self, image_time=None):
+        self.times = np.full(len(STAGES), np.nan)
+        self.times[0] = time.time() if image_time is None else image_time
+
+    def stamp(self, stage, t=None):
+        """ Record that stage was done at t (now by default) """
+        self.times[STAGE_INDEX[stage]] = time.time() if t is None else t
+
+    def __getitem__(self, stage):
+        return self.times[STAGE_INDEX[stage]]
+
+    def shifted(self, offset, stages=REMOTE_STAGES):
+        """ Copy with offset subtracted from stages (remote -> local clock) """
+        trace = Trace(self.times[0])
+        trace.times[:] = self.times
+        for stage in stages:
+            trace.times[STAGE_INDEX[stage]] -= offset
+        return trace
+
+    def pack_into(self, buffer, offset=0):
+        """ Write the trace block into buffer at offset """
+        image = self.times[0]
+        offsets = [MISSING if math.isnan(t) else
+                   max(min(round((t - image) * 1e6), 2 ** 31 - 1), MISSING + 1)
+                   for t in self.times[1:]]
+        TRACE.pack_into(buffer, offset, round(image * 1e9), *offsets)
+
+    @classmethod
+    def unpack_from(cls, buffer, offset=0):
+        """ Read a trace block from buffer at offset """
+        image_ns, *offsets = TRACE.unpack_from(buffer, offset)
+        trace = cls(image_ns / 1e9)
+        for i, us in enumerate(offsets, 1):
+            if us != MISSING:
+                trace.times[i] = trace.times[0] + us / 1e6
+        return trace
+
+    def format(self):
+        """ One-line human readable summary (ms since the image) """
+        return "  ".join(f"{stage}=+{(t - self.times[0]) * 1e3:.2f}"
+                         for stage, t in zip(STAGES[1:], self.times[1:])
+                         if not math.isnan(t))
+
+
+class TraceStats:
+    """
+        Per-stage latency distributions of many traces.
+
+        The latency of a stage is the time from the previous stamped stage to
+        it, 'total' the time from the image to the last stamped stage.
+    """
+
+    def __init__(self):
+        self.stages = {stage: LatencyHistogram() for stage in STAGES[1:]}
+        self.total = LatencyHistogram()
+        self.count = 0
+
+    def record(self, trace):
+        """ Account the stage latencies of one trace """
+        self.count += 1
+        previous = trace.times[0]
+        for stage, t in zip(STAGES[1:], trace.times[1:]):
+            if math.isnan(t):
+                continue
+            self.stages[stage].record(t - previous)
+            previous = t
+        self.total.record(previous - trace.times[0])
+
+    def format(self):
+        """ Multi-line human readable summary, one line per stamped stage """
+        lines = [f"{stage:>9s}: {hist.format()}"
+                 for stage, hist in self.stages.items() if hist.count]
+        lines.append(f"{'total':>9s}: {self.total.format()}")
+        return "\n".join(lines)
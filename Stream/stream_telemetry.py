@@ -0,0 +1,185 @@
+# Rolling latency/jitter telemetry for the ZED stream receivers.
+#
+# Printing one line per grab costs time in the grab loop at 60 fps, and the
+# numbers scroll away. StreamTelemetry instead keeps the last <window> frames
+# in preallocated arrays: record() is a few array stores under a lock, called
+# from the grab loop. A background thread wakes up every <every> seconds,
+# copies the window and publishes a summary:
+#
+#   latency    CURRENT - IMAGE timestamp of each frame (receive latency)
+#   interval   IMAGE timestamp difference between consecutive frames
+#   jitter     standard deviation of the interval
+#   dropped    frames dropped by the camera/stream in the window, and in total
+#
+# The latency of the frames received since the previous summary is reported
+# too (recent_latency_ms), for feedback loops that must react within a period.
+# A summary is one JSON object, appended as a line to a file and/or sent as a
+# UDP datagram to a local endpoint (e.g. a dashboard), optionally printed as
+# one status line, and passed to the on_summary callback.
+
+# =========================================================================== #
+import json
+import socket
+import threading
+import time
+import numpy as np
+
+
+PERCENTILES = (50, 90, 99)
+
+
+class StreamTelemetry:
+    """
+        Rolling window of per-frame timings, published periodically.
+
+        Parameters
+        ----------
+        window: int
+            Number of most recent frames the statistics are computed on.
+        every: float
+            Publishing period (s).
+        path: str
+            File the summaries are appended to (JSON lines), or None.
+        endpoint: tuple
+            (host, port) the summaries are sent to over UDP, or None.
+        echo: bool
+            Also print each summary as one status line.
+        on_summary: callable
+            Called with each summary dict (from the publishing thread).
+    """
+
+    def __init__(self, window=600, every=1.0, path=None, endpoint=None, echo=True,
+                 on_summary=None):
+        self.window = window
+        self.every = every
+        self.endpoint = endpoint
+        self.echo = echo
+        self.on_summary = on_summary
+        self._image = np.zeros(window, np.int64)     # IMAGE timestamps (ns)
+        self._latency = np.zeros(window)            # CURRENT - IMAGE (s)
+        self._dropped = np.zeros(window, np.int64)   # Cumulative drop count
+        self._count = 0                              # Frames recorded so far
+        self._published = 0                          # ... at the last summary
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._file = open(path, 'a') if path else None
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) if endpoint else None
+        self._thread = None
+        self.last_summary = None
+
+    # Grab loop side -------------------------------------------------------- #
+    def record(self, image_ns, current_ns, dropped=0):
+        """ Record one grabbed frame (timestamps in ns, cumulative drops) """
+        with self._lock:
+            i = self._count % self.window
+            self._image[i] = image_ns
+            self._latency[i] = (current_ns - image_ns) * 1e-9
+            self._dropped[i] = dropped
+            self._count += 1
+
+    def record_frame(self, source):
+        """ Record the last frame grabbed by a FrameSource """
+        self.record(source.image_timestamp_ns(), source.current_timestamp_ns(),
+                    source.frames_dropped())
+
+    # Publisher side -------------------------------------------------------- #
+    def start(self):
+        """ Start publishing in a background thread """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        """ Stop publishing, publish a last summary """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.publish()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _run(self):
+        while not self._stop.wait(self.every):
+            self.publish()
+
+    def snapshot(self):
+        """
+            Return (image_ns, latency, dropped, count) of the window, oldest
+            first, count being the number of frames recorded so far.
+        """
+        with self._lock:
+            n = min(self._count, self.window)
+            start = self._count - n
+            order = np.arange(start, self._count) % self.window
+            return self._image[order], self._latency[order], self._dropped[order], self._count
+
+    def summary(self):
+        """ Statistics of the current window as a dict, or None if empty """
+        image, latency, dropped, count = self.snapshot()
+        if len(image) == 0:
+            return None
+        interval = np.diff(image) * 1e-9
+        span = interval.sum()
+        new = min(count - self._published, len(image))
+        return {
+            'time': time.time(),
+            'frames': int(count),
+            'window': len(image),
+            'new_frames': int(count - self._published),
+            'recent_latency_ms': _stats(latency[len(latency) - new:]),
+            'fps': len(interval) / span if span > 0 else 0.0,
+            'latency_ms': _stats(latency),
+            'interval_ms': _stats(interval),
+            'jitter_ms': float(interval.std() * 1e3) if len(interval) else 0.0,
+            'dropped': int(dropped[-1] - dropped[0]),
+            'dropped_total': int(dropped[-1]),
+        }
+
+    def publish(self):
+        """ Compute the summary and send it to every output """
+        summary = self.summary()
+        if summary is None:
+            return
+        self.last_summary = summary
+        self._published = summary['frames']
+        line = json.dumps(summary)
+        if self._file is not None:
+            self._file.write(line + '\n')
+            self._file.flush()
+        if self._sock is not None:
+            try:
+                self._sock.sendto(line.encode(), self.endpoint)
+            except OSError:
+                pass                    # Nobody listening, telemetry is best effort
+        if self.echo:
+            print(format_summary(summary))
+        if self.on_summary is not None:
+            self.on_summary(summary)
+
+
+def _stats(values):
+    """ Mean, percentiles and max of values (s) in ms """
+    if len(values) == 0:
+        return {}
+    ms = values * 1e3
+    stats = {'mean': float(ms.mean())}
+    stats.update({f'p{p}': float(v) for p, v in zip(PERCENTILES, np.percentile(ms, PERCENTILES))})
+    stats['max'] = float(ms.max())
+    return stats
+
+
+def format_summary(summary):
+    """ One-line human readable version of a summary """
+    lat, itv = summary['latency_ms'], summary['interval_ms']
+    text = (f"{summary['fps']:5.1f} fps  latency p50={lat['p50']:.1f} "
+            f"p99={lat['p99']:.1f} max={lat['max']:.1f} ms")
+    if itv:
+        text += f"  interval p50={itv['p50']:.1f} p99={itv['p99']:.1f} ms"
+    return (text + f"  jitter={summary['jitter_ms']:.2f} ms  "
+            f"dropped={summary['dropped']} ({summary['dropped_total']} total)")
@@ -0,0 +1,165 @@
+# Delta encoding of sliding windows (e.g. skeleton windows of shape
+# (1, 40, 3, 18, 1), time on axis 1) for array_sender.py / array_receiver.py.
+#
+# From one message to the next, a sliding window only gains its newest
+# frame(s): the other 39 of 40 frames were already sent. Both ends keep the
+# window, the sender only ships the new frame(s) (FLAG_DELTA), and the receiver
+# appends them to its copy. A full window (FLAG_KEYFRAME) is sent first, then
+# every <keyframe_every> frames, and whenever the receiver asks for one.
+#
+# The window messages are numbered by the encoder, apart from any other
+# message of the channel (clock sync, ...): a delta is only applied if it
+# follows the previous window message. After a gap, or before the first
+# keyframe, the decoder drops the deltas until the next keyframe and
+# .need_keyframe is set; the receiver then flags its replies FLAG_RESYNC, and
+# the sender calls request_keyframe() when it sees that flag.
+#
+# Windows live in a ring buffer twice as long as the window along the time
+# axis; every frame is written twice (at i and i + length) so the current
+# window is always one slice of it, without copying or np.roll.
+
+# =========================================================================== #
+import numpy as np
+from array_protocol import FLAG_KEYFRAME, FLAG_DELTA
+
+
+class SlidingWindow:
+    """
+        Fixed-length window along one axis, backed by a double-length ring.
+
+        Parameters
+        ----------
+        shape: tuple
+            Shape of the window, e.g. (1, 40, 3, 18, 1).
+        axis: int
+            Time axis of the window.
+        dtype: np.dtype
+            Element type of the window.
+    """
+
+    def __init__(self, shape, axis=1, dtype=np.float64):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.axis = axis
+        self.length = shape[axis]
+        ring_shape = list(shape)
+        ring_shape[axis] = 2 * self.length
+        self._ring = np.zeros(ring_shape, dtype)
+        self._start = 0         # Ring index of the oldest frame of the window
+
+    def _slice(self, start, stop):
+        index = [slice(None)] * len(self.shape)
+        index[self.axis] = slice(start, stop)
+        return tuple(index)
+
+    def push(self, frames):
+        """ Append frames (window shape with k along the time axis) """
+        k = frames.shape[self.axis]
+        if k >= self.length:                 # Replaces the whole window
+            self.load(frames[self._slice(k - self.length, k)])
+            return
+        for j in range(k):
+            i = self._start                  # Slot of the oldest frame
+            frame = frames[self._slice(j, j + 1)]
+            self._ring[self._slice(i, i + 1)] = frame
+            self._ring[self._slice(i + self.length, i + self.length + 1)] = frame
+            self._start = (i + 1) % self.length
+
+    def load(self, window):
+        """ Replace the whole window """
+        self._ring[self._slice(0, self.length)] = window
+        self._ring[self._slice(self.length, 2 * self.length)] = window
+        self._start = 0
+
+    def view(self):
+        """ The current window, oldest frame first (a view, not a copy) """
+        return self._ring[self._slice(self._start, self._start + self.length)]
+
+
+class WindowEncoder:
+    """
+        Sender side: keeps the window and decides what goes on the wire.
+
+        Parameters
+        ----------
+        shape, axis, dtype:
+            See SlidingWindow.
+        keyframe_every: int
+            Send a full window at least every this many frames. The default
+            (10 window lengths) keeps the bandwidth close to one frame per
+            message; over TCP or shared memory nothing is lost in between.
+    """
+
+    def __init__(self, shape, axis=1, dtype=np.float64, keyframe_every=None):
+        self.window = SlidingWindow(shape, axis, dtype)
+        self.keyframe_every = keyframe_every or 10 * self.window.length
+        self.seq = 0            # Sequence number of the next window message
+        self._keyframe_seq = -1 # Of the last keyframe sent
+        self._since_keyframe = 0
+        self._need_keyframe = True
+
+    def request_keyframe(self, seq=None):
+        """
+            Make the next push() send a full window. With seq (a FLAG_RESYNC
+            reply to window message seq), unless a keyframe was already sent
+            after that message: the replies in flight ask for one too.
+        """
+        if seq is None or seq >= self._keyframe_seq:
+            self._need_keyframe = True
+
+    def push(self, frames):
+        """
+            Append frames, return (payload, flags, seq) to send for them: seq
+            is the window's own sequence number, to send as the frame's seq.
+        """
+        self.window.push(frames)
+        self._since_keyframe += frames.shape[self.window.axis]
+        seq = self.seq
+        self.seq += 1
+        if self._need_keyframe or self._since_keyframe >= self.keyframe_every:
+            self._need_keyframe = False
+            self._since_keyframe = 0
+            self._keyframe_seq = seq
+            return self.window.view(), FLAG_KEYFRAME, seq
+        return frames, FLAG_DELTA, seq
+
+
+class WindowDecoder:
+    """
+        Receiver side: rebuilds the window from keyframes and deltas.
+
+        Parameters
+        ----------
+        axis: int
+            Time axis of the window. The shape and dtype are taken from the
+            first keyframe.
+    """
+
+    def __init__(self, axis=1):
+        self.axis = axis
+        self.window = None
+        self.last_seq = -1
+        self.need_keyframe = True   # No keyframe yet, or a gap since the last one
+        self.skipped = 0        # Deltas dropped while waiting for a keyframe
+        self.gaps = 0           # Window messages found missing
+
+    def decode(self, seq, flags, payload):
+        """ Apply a received frame (seq: the encoder's), return the window view or None """
+        if not flags & (FLAG_KEYFRAME | FLAG_DELTA) or seq <= self.last_seq:
+            return None                           # Not a window, stale or repeated frame
+        if seq != self.last_seq + 1 and self.last_seq >= 0:
+            self.gaps += 1
+            self.need_keyframe = True             # The window misses frames
+        self.last_seq = seq
+        if flags & FLAG_KEYFRAME:
+            if (self.window is None or self.window.shape != payload.shape
+                    or self.window.dtype != payload.dtype):
+                self.window = SlidingWindow(payload.shape, self.axis, payload.dtype)
+            self.window.load(payload)
+            self.need_keyframe = False
+        elif self.need_keyframe:
+            self.skipped += 1                     # Wait for the next keyframe
+            return None
+        else:
+            self.window.push(payload)
+        return self.window.view()
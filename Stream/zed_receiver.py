@@ -4,12 +4,46 @@ from signal import signal, SIGINT
 import cv2
 import time
 import pyzed.sl as sl
+from frame_source import ZedSource
+from stream_telemetry import StreamTelemetry
+from bitrate_control import FeedbackReporter, FEEDBACK_PORT
+from capture_queue import FrameQueue, CaptureThread
+from frame_relay import RelaySource
 
 # ZED Camera declaration
 zed = sl.Camera()
 
+# Rolling latency/jitter/drop statistics of the stream, published once per
+# second instead of printing every frame. Summaries are also appended to the
+# file given as second argument (JSON lines), if any. Each summary is also
+# reported back to the sender, whose bitrate controller adapts to it.
+telemetry = None
+receiver_id = 0 # Unique among the receivers of one sender
+
+# Frames are grabbed on their own thread and handed to the processing through
+# a bounded queue, so a slow display never delays the grab:
+#   display: show the left image with OpenCV (q to quit)
+#   queue_policy: 'drop_oldest' (show the freshest frame), 'drop_newest' or
+#                 'block' (no frame lost in the queue, the SDK may drop some)
+display = False
+queue_size = 2
+queue_policy = 'drop_oldest'
+capture = None
+
+# Read the frames of a local relay (zed_relay.py) instead of opening the
+# stream: name of its frame pool, or None.
+relay_name = None
+source = None
+
 # Create a callback function for handling Ctrl-C
 def handler(sig, frame):
+	if capture is not None:
+		capture.stop()
+		print("[INFO] CAPTURE QUEUE: " + capture.queue.format())
+	if telemetry is not None:
+		telemetry.close()
+	if isinstance(source, RelaySource):
+		source.close()
 	zed.disable_recording()
 	zed.disable_streaming()
 	zed.close()
@@ -20,12 +54,16 @@ signal(SIGINT, handler)
 
 
 def main():	
+	global telemetry
+	global capture
+	global source
 	# The IP address of the sender must be set.
 	if len(sys.argv) > 1:
 		ip = sys.argv[1]
 	else: 
 		print('Please Provide an IP address.')
 		exit(1)	
+	telemetry_path = sys.argv[2] if len(sys.argv) > 2 else None
 	
 	# configuration parameters
 	print("[INFO] SETTING INIT PARAMETERS")
@@ -37,29 +75,16 @@ def main():
 	# Set the source of the video to a video stream
 	init_params.set_from_stream(ip)
 	
-	print("[INFO] OPENING CAMERA")	
-	status = zed.open(init_params)
-	if status != sl.ERROR_CODE.SUCCESS:
-		print(repr(status))
-		exit(1)
+	if relay_name is None:
+		print("[INFO] OPENING CAMERA")	
+		status = zed.open(init_params)
+		if status != sl.ERROR_CODE.SUCCESS:
+			print(repr(status))
+			exit(1)
 	
 	print("[INFO] SETTING RUNTIME PARAMETERS")
 	runtime_params = sl.RuntimeParameters(enable_depth = False)
 	
-#	# Create an image object, Mat, then retrieve left image of each frame
-# 	# and display it with OpenCV.
-#	mat = sl.Mat()
-#	
-#	print("Use Q to exit, or Ctrl+C \n")
-#	key = ''
-#	while key != 113:
-#		err = zed.grab(runtime_params)
-#		if err == sl.ERROR_CODE.SUCCESS:
-#			zed.retrieve_image(mat, sl.VIEW.LEFT)
-#			cv2.imshow("ZED", mat.get_data())
-#		key = cv2.waitKey(1)
-#	cv2.destroyAllWindows()
-
 	# # We can also enable Recording if needed
 	# rec_path = "/home/smarttap2/Documents/ZED/stream1.svo"
 	# recording_param = sl.RecordingParameters(rec_path, sl.SVO_COMPRESSION_MODE.H264)
@@ -70,11 +95,33 @@ def main():
 	# print("SVO is Recording, use Ctrl-C to stop.")
 
 	# Frame aquistion
-	while True:
-		if zed.grab(runtime_params) == sl.ERROR_CODE.SUCCESS :
-			# printing the difference between time when the frame was captured
-			# ... and the time when the frame was received
-			print(zed.get_timestamp(sl.TIME_REFERENCE.CURRENT).get_milliseconds()-zed.get_timestamp(sl.TIME_REFERENCE.IMAGE).get_milliseconds())
+	if relay_name is None:
+		source = ZedSource(zed, runtime_params)
+	else:
+		print(f"[INFO] READING FRAMES FROM RELAY '{relay_name}'")
+		source = RelaySource(relay_name)
+	feedback = FeedbackReporter((ip, FEEDBACK_PORT), receiver_id)
+	telemetry = StreamTelemetry(window=600, every=1.0, path=telemetry_path,
+	                            on_summary=feedback.report).start()
+	# Record the difference between time when the frame was captured and the
+	# ... time when the frame was received (printed each second), on the
+	# ... capture thread right after each grab
+	capture = CaptureThread(source, FrameQueue(queue_size, queue_policy),
+	                        retrieve=display, on_grab=telemetry.record_frame).start()
+	if display:
+		print("Use Q to exit, or Ctrl+C \n")
+	key = ''
+	while key != 113:
+		frame = capture.queue.get(timeout=1.0)
+		if frame is None:
+			if capture.queue.closed:
+				break
+			continue
+		if display:
+			cv2.imshow("ZED", frame.data)
+			key = cv2.waitKey(1)
+	cv2.destroyAllWindows()
+	handler(None, None)
 
 
 if __name__=="__main__":
@@ -0,0 +1,85 @@
+import sys
+from signal import signal, SIGINT
+import time
+import pyzed.sl as sl
+from frame_relay import FramePool
+
+# Receives and decodes the stream of one sender once, and publishes the left
+# images to a shared memory frame pool. Any number of local processes attach
+# to the pool by name (RelaySource, or zed_receiver.py with relay_name set)
+# instead of each opening the stream: a slow subscriber skips frames, it never
+# stalls the relay or the other subscribers.
+#   pool_name: name the subscribers attach to (second argument overrides it)
+#   max_subscribers: subscribers attached at the same time
+#   reclaim_every: seconds between two scans for subscribers that died
+pool_name = 'zed_relay'
+max_subscribers = 6
+reclaim_every = 1.0
+pool = None
+
+# ZED Camera declaration
+zed = sl.Camera()
+
+# Create a callback function for handling Ctrl-C
+def handler(sig, frame):
+	if pool is not None:
+		pool.close()
+	zed.close()
+	sys.exit(0)
+
+# signal.signal is used to assign the handler function to SIGINT
+signal(SIGINT, handler)
+
+
+def main():
+	global pool
+	# The IP address of the sender must be set.
+	if len(sys.argv) > 1:
+		ip = sys.argv[1]
+	else:
+		print('Please Provide an IP address.')
+		exit(1)
+	name = sys.argv[2] if len(sys.argv) > 2 else pool_name
+
+	print("[INFO] SETTING INIT PARAMETERS")
+	init_params = sl.InitParameters()
+	init_params.camera_resolution = sl.RESOLUTION.HD720
+	init_params.camera_fps = 60
+	init_params.depth_mode = sl.DEPTH_MODE.NONE
+	# Set the source of the video to a video stream
+	init_params.set_from_stream(ip)
+
+	print("[INFO] OPENING CAMERA")
+	status = zed.open(init_params)
+	if status != sl.ERROR_CODE.SUCCESS:
+		print(repr(status))
+		exit(1)
+
+	print("[INFO] SETTING RUNTIME PARAMETERS")
+	runtime_params = sl.RuntimeParameters(enable_depth = False)
+
+	# One slot holds a BGRA image at the stream resolution. If the sender
+	# ... lowers its resolution (adaptive bitrate) the frames still fit.
+	resolution = zed.get_camera_information().camera_resolution
+	slot_size = resolution.width * resolution.height * 4 + 4096
+	pool = FramePool(name, create=True, slots=max_subscribers + 2,
+	                 slot_size=slot_size, max_subscribers=max_subscribers)
+	print(f"[INFO] RELAYING {ip} TO '{name}' ({resolution.width}x{resolution.height}), use Ctrl+C to exit\n")
+
+	image = sl.Mat()
+	next_reclaim = time.monotonic() + reclaim_every
+	while True:
+		if zed.grab(runtime_params) != sl.ERROR_CODE.SUCCESS:
+			continue
+		zed.retrieve_image(image, sl.VIEW.LEFT)
+		# Decoded once, copied once into the pool whatever the number of subscribers
+		pool.publish(image.get_data(),
+		             zed.get_timestamp(sl.TIME_REFERENCE.IMAGE).get_nanoseconds(),
+		             zed.get_timestamp(sl.TIME_REFERENCE.CURRENT).get_nanoseconds())
+		if time.monotonic() > next_reclaim:
+			pool.reclaim()
+			next_reclaim = time.monotonic() + reclaim_every
+
+
+if __name__=="__main__":
+	main()
@@ -4,10 +4,23 @@ from signal import signal, SIGINT
 import cv2
 import time
 import pyzed.sl as sl
+from bitrate_control import AimdController, FeedbackListener, FEEDBACK_PORT
 
 
 zed = sl.Camera()
 
+# Adaptive bitrate: receivers (zed_receiver.py) report their latency and drops
+# to FEEDBACK_PORT, an AIMD controller adjusts the bitrate within bounds and
+# steps through the quality ladder (resolution, fps, lowest bitrate) when the
+# bitrate alone is not enough. The stream has to be restarted to apply a new
+# setting, so small changes are batched: at most every <apply_every> seconds,
+# and only if the bitrate moved by more than <min_change>.
+adaptive_bitrate = True
+quality_levels = [('HD720', 30, 2000), ('HD720', 15, 1000), ('VGA', 15, 500)]
+control_every = 1.0
+apply_every = 5.0
+min_change = 0.15
+
 def handler(sig, frame):
 	zed.disable_recording()
 	zed.disable_streaming()
@@ -20,8 +33,9 @@ def main():
 	print("[INFO] SETTING INIT PARAMETERS")
 	# configuration parameters
 	init_params = sl.InitParameters()
-	init_params.camera_resolution = sl.RESOLUTION.HD720
-	init_params.camera_fps = 30
+	resolution, fps, _ = quality_levels[0]
+	init_params.camera_resolution = getattr(sl.RESOLUTION, resolution)
+	init_params.camera_fps = fps
 	init_params.depth_mode = sl.DEPTH_MODE.NONE
 #	init_params.depth_mode = sl.DEPTH_MODE.PERFORMANCE
 
@@ -49,8 +63,46 @@ def main():
 	
 	print("Use Ctrl+C to exit\n")
 
+	if not adaptive_bitrate:
+		while True:
+			err = zed.grab(runtime_params)
+
+	controller = AimdController(bitrate=stream_params.bitrate, levels=quality_levels)
+	feedback = FeedbackListener(FEEDBACK_PORT)
+	applied = controller.setting()
+	next_control = last_apply = time.monotonic()
 	while True:
 		err = zed.grab(runtime_params)
+		now = time.monotonic()
+		if now < next_control:
+			continue
+		# Control step: read the receivers' reports, never blocks the grab
+		next_control = now + control_every
+		for report in feedback.poll():
+			controller.feedback(report)
+		bitrate, level = controller.update()
+		if (bitrate, level) == applied or now - last_apply < apply_every:
+			continue
+		if level == applied[1] and abs(bitrate - applied[0]) < min_change * applied[0]:
+			continue
+		resolution, fps, _ = quality_levels[level]
+		print(f"[INFO] BITRATE {applied[0]} -> {bitrate} Kbits/s, {resolution} @ {fps} fps")
+		zed.disable_streaming()
+		if level != applied[1]:
+			# Resolution and frame rate are only set when opening the camera
+			zed.close()
+			init_params.camera_resolution = getattr(sl.RESOLUTION, resolution)
+			init_params.camera_fps = fps
+			status = zed.open(init_params)
+			if status != sl.ERROR_CODE.SUCCESS:
+				print(repr(status))
+				exit(1)
+		stream_params.bitrate = bitrate
+		status = zed.enable_streaming(stream_params)
+		if status != sl.ERROR_CODE.SUCCESS:
+			print(repr(status))
+			exit(1)
+		applied, last_apply = (bitrate, level), now
 
 if __name__=="__main__":
 	main()
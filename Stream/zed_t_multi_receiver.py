@@ -5,11 +5,32 @@ import time
 import threading
 import signal
 import os
+from frame_sync import FrameSynchronizer
+from frame_source import ZedSource
+from capture_queue import FrameQueue, CaptureThread
 
 zeds = []
-frames_recorded = 0
 stop_signal = False
 thread_list = []
+synchronizer = None
+
+# Each camera is grabbed by a CaptureThread (capture_queue.py); the frames go
+# ... through a bounded queue to a thread of their own that hands them to the
+# ... synchronizer, so the matching (and the image copy, with retrieve_images)
+# ... never delays the next grab:
+#   queue_policy: 'drop_oldest', 'drop_newest' or 'block', see capture_queue.py
+#   retrieve_images: also copy the left image of each frame into the bundles
+queue_size = 4
+queue_policy = 'drop_oldest'
+retrieve_images = False
+captures = []
+
+# Frames of the different cameras are paired up live by image timestamp:
+#   sync_tolerance: largest timestamp difference inside a bundle (s)
+#   sync_missing: 'partial' emits bundles without a camera that stopped
+#                 delivering, 'drop' only emits complete bundles
+sync_tolerance = 0.5 / 30
+sync_missing = 'partial'
 
 def signal_handler(sig, frame):
 	global stop_signal
@@ -17,8 +38,14 @@ def signal_handler(sig, frame):
 	print("[SIG HANDLER] RECEIVED INTERRUPT")
 	
 	stop_signal = True
+	for capture in captures:
+		capture.stop()
 	for th in thread_list:
 		th.join()
+	for i, capture in enumerate(captures):
+		print(f"\n[CAPTURE {i}] " + capture.queue.format())
+	if synchronizer is not None:
+		print("\n[SYNC] " + synchronizer.format())
 	
 	for i in range(len(zeds)):
 		zeds[i].disable_recording()
@@ -26,15 +53,20 @@ def signal_handler(sig, frame):
 	sys.exit(0)
 
 
-def get_frame(index, runtime_params):
+def feed_frames(index, capture):
 	print(f"[THREAD {index}] STARTING ...")
-	global stop_signal
-	global zeds
-	global frames_recorded	
 	
 	while not stop_signal:
-		if zeds[index].grab(runtime_params) == sl.ERROR_CODE.SUCCESS :
-			frames_recorded[index] += 1
+		frame = capture.queue.get(timeout=0.1)
+		if frame is None:
+			if capture.queue.closed:
+				break
+			continue
+		# The frame handle is the capture_queue Frame: frame.seq is the frame
+		# ... number in this camera's recording, frame.data the image (or None)
+		synchronizer.put(index, frame.image_ns, frame)
+	if capture.error is not None:
+		print(f"[THREAD {index}] CAPTURE FAILED: {capture.error!r}")
 		
 	print(f"[THREAD {index}] EXIT ...")
 
@@ -42,7 +74,8 @@ def get_frame(index, runtime_params):
 def main():
 	global zeds
 	global thread_list
-	global frames_recorded
+	global captures
+	global synchronizer
 	signal.signal(signal.SIGINT, signal_handler)
 	
 	if len(sys.argv) > 1:
@@ -94,15 +127,23 @@ def main():
 			exit(1)
 		
 	print("[INFO] Success! Press Ctrl+C to stop recording.\n\n")
-	frames_recorded=[]
+	synchronizer = FrameSynchronizer(len(zeds), tolerance=sync_tolerance, missing=sync_missing)
 	for i in range(len(zeds)):
-		frames_recorded.append(0)
-		thread_list.append(threading.Thread(target=get_frame, args=(i, runtime_params, ))) # Note: Must have a (,) when passing args to thread
+		captures.append(CaptureThread(ZedSource(zeds[i], runtime_params),
+		                              FrameQueue(queue_size, queue_policy),
+		                              retrieve=retrieve_images).start())
+		thread_list.append(threading.Thread(target=feed_frames, args=(i, captures[i], ))) # Note: Must have a (,) when passing args to thread
 		thread_list[i].start()
 	
+	bundles = 0
 	while True:
-		print("Frame count: " + str(sum(frames_recorded)), end="\r")
-		time.sleep(0.1)
+		# Bundles of frames taken at the same moment, one Frame per camera
+		# ... (None if it is missing), for the multi-view processing
+		bundle = synchronizer.get(timeout=0.1)
+		if bundle is not None:
+			bundles += 1
+			print(f"Frame count: {sum(c.grabbed for c in captures)}  bundles: {bundles}  "
+			      f"skew: {bundle.skew * 1e3:.1f} ms   ", end="\r")
 		
 	
 
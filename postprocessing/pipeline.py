@@ -0,0 +1,319 @@
+import sys
+import os
+import re
+import glob
+import json
+import hashlib
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# Runs timestamp_extract.py -> timestamp_align.py -> svo_cutter.py on the
+# ... sessions of one or more directories, only where something changed.
+#
+# The SVO files of a session are the cameras recorded together, as listed
+# ... by zed_multi_recorder.py in <session>_session.json: one group of files,
+# ... and one more each time a camera was restarted (to <session>_<i>_r<k>.svo).
+# ... Any other SVO is a session of its own, only extracted, unless
+# ... --group-by-name groups the <session>_<digits>.svo files of older
+# ... recordings (not the files of a segmented recording, listed in its
+# ... _manifest.json). Each group is a small dependency graph:
+#
+#   extract  <name>.svo                  -> ts/<name>_ts.bin      (each file)
+#   align    ts/<session>_<camera>_ts.bin -> aligned/..._aligned.bin (group)
+#   cut      <name>.svo + aligned/<name>_ts_aligned.bin -> cut_svo/<name>_cut.svo
+#
+# A group sharing files with a previous one (after a restart) writes to
+# ... aligned/<session>_g<k>/ and cut_svo/<session>_g<k>/ instead, the
+# ... cameras that kept recording being aligned and cut once per group.
+#
+# A task runs (in its own process, up to --workers at once) when its
+# ... dependencies are done and it is not up to date: the fingerprints of its
+# ... inputs and outputs are kept in <dir>/.pipeline.json once it succeeds.
+# ... A fingerprint is the size and mtime of a file, and a hash of its content
+# ... that is only computed when those changed: a file rewritten with the same
+# ... content (e.g. extracted again) does not rerun the tasks after it.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CACHE = '.pipeline.json'
+SESSION = '_session.json'		# Written by zed_multi_recorder.py
+HASH_ALL = 64 << 20		# Larger files are hashed on their first and last HASH_SAMPLE bytes
+HASH_SAMPLE = 4 << 20
+
+
+# =============================================================== #
+def digest(filepath):
+	""" Hash of a file (blake2b), of its size and both ends for large files """
+	h = hashlib.blake2b(digest_size=16)
+	size = os.path.getsize(filepath)
+	with open(filepath, 'rb') as f:
+		if size <= HASH_ALL:
+			for block in iter(lambda: f.read(1 << 20), b''):
+				h.update(block)
+		else:
+			h.update(str(size).encode())
+			h.update(f.read(HASH_SAMPLE))
+			f.seek(-HASH_SAMPLE, os.SEEK_END)
+			h.update(f.read(HASH_SAMPLE))
+	return h.hexdigest()
+
+
+def fingerprint(filepath, known=None):
+	"""
+		[size, mtime_ns, hash] of a file, None if it does not exist. The hash
+		of known (a previous fingerprint) is reused if size and mtime match.
+	"""
+	if not os.path.exists(filepath):
+		return None
+	stat = os.stat(filepath)
+	if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+		return known
+	return [stat.st_size, stat.st_mtime_ns, digest(filepath)]
+
+
+def same(known, current):
+	""" Whether two fingerprints are of the same content """
+	return known is not None and current is not None and known[2] == current[2]
+
+
+class Task:
+	"""
+		One step of the pipeline: a command reading inputs and writing outputs.
+
+		Parameters
+		----------
+		name: str
+			Unique name (the key of the task in the cache).
+		directory: str
+			Directory whose cache holds the task.
+		command: list
+			Command line of the step.
+		inputs, outputs: list
+			Paths read and written by the command.
+		deps: list
+			Tasks to run first.
+	"""
+
+	def __init__(self, name, directory, command, inputs, outputs, deps=()):
+		self.name = name
+		self.directory = directory
+		self.command = command
+		self.inputs = inputs
+		self.outputs = outputs
+		self.deps = list(deps)
+		self.state = 'pending'		# 'skipped' (up to date), 'done' or 'failed'
+
+
+def sessions(directory, by_name=False):
+	"""
+		SVO files of a directory, grouped into the files recorded together:
+		{group: [paths]}. The groups of a session file are named after the
+		session (<session>_g<k> after a restart). A file of its own is a
+		group named after it (with its extension).
+
+		by_name also groups the <session>_<digits>.svo files that are in no
+		session file, as zed_multi_recorder.py named them before writing
+		one. Two takes named exp_1.svo and exp_2.svo are grouped too.
+	"""
+	svos = sorted(glob.glob(os.path.join(directory, '*.svo')))
+	groups = {}
+	listed = set()
+	for session_file in sorted(glob.glob(os.path.join(directory, '*' + SESSION))):
+		with open(session_file) as f:
+			session = json.load(f)
+		for k, names in enumerate(session['groups']):
+			files = [os.path.join(directory, name) for name in names]
+			files = [svo for svo in files if os.path.exists(svo)]		# Cameras that never opened
+			listed.update(files)
+			if len(files) > 1:
+				groups[session['session'] + (f'_g{k}' if k else '')] = files
+	segmented = set()
+	for manifest in glob.glob(os.path.join(directory, '*_manifest.json')):
+		with open(manifest) as f:
+			segmented.update(os.path.join(directory, s['svo']) for s in json.load(f)['segments'])
+	by_session = {}
+	for svo in svos:
+		if svo in listed:
+			continue
+		name = os.path.splitext(os.path.basename(svo))[0]
+		match = re.fullmatch(r'(.+)_\d+', name) if by_name else None
+		session = match.group(1) if match and svo not in segmented else os.path.basename(svo)
+		by_session.setdefault(session, []).append(svo)
+	for session, files in by_session.items():
+		groups[session if len(files) > 1 else os.path.basename(files[0])] = files
+	# A file listed only in groups of a single camera has nothing to be aligned with
+	grouped = {svo for files in groups.values() for svo in files}
+	for svo in sorted(listed - grouped):
+		groups[os.path.basename(svo)] = [svo]
+	return groups
+
+
+def build(directories, align_options=(), by_name=False):
+	""" Tasks of all the sessions of the directories, in dependency order """
+	python = sys.executable
+	tasks = []
+	for directory in map(os.path.abspath, directories):
+		extracts = {}		# A camera that kept recording is in several groups, extracted once
+		aligned_once = set()
+		for session, svos in sessions(directory, by_name).items():
+			for svo in svos:
+				if svo not in extracts:
+					name = os.path.splitext(os.path.basename(svo))[0]
+					ts = os.path.join(directory, 'ts', name + '_ts.bin')
+					command = [python, os.path.join(HERE, 'timestamp_extract.py'), '-j', '1', svo]
+					extracts[svo] = Task(f'extract {name}', directory, command, [svo], [ts])
+					tasks.append(extracts[svo])
+			if len(svos) < 2:
+				continue
+			# The first group of a file writes to aligned/ and cut_svo/, the next ones to subdirectories
+			subdir = session if aligned_once.intersection(svos) else ''
+			aligned_once.update(svos)
+			aligned_dir = os.path.join(directory, 'aligned', subdir)
+			cut_dir = os.path.join(directory, 'cut_svo', subdir)
+			ts_files = [extracts[svo].outputs[0] for svo in svos]
+			aligned = [os.path.join(aligned_dir, os.path.basename(ts).replace('.bin', '_aligned.bin'))
+					   for ts in ts_files]
+			command = [python, os.path.join(HERE, 'timestamp_align.py'), *align_options,
+					   *(['-o', aligned_dir] if subdir else []), *ts_files]
+			align = Task(f'align {session}', directory, command, ts_files, aligned,
+						 [extracts[svo] for svo in svos])
+			tasks.append(align)
+			for svo, aligned_ts in zip(svos, aligned):
+				name = os.path.splitext(os.path.basename(svo))[0]
+				command = [python, os.path.join(HERE, 'svo_cutter.py'), '-v', svo, '-t', aligned_ts,
+						   *(['-o', cut_dir] if subdir else [])]
+				tasks.append(Task(f'cut {name}' + (f' ({session})' if subdir else ''), directory,
+								  command, [svo, aligned_ts],
+								  [os.path.join(cut_dir, name + '_cut.svo')], [align]))
+	return tasks
+
+
+class Cache:
+	""" Fingerprints of the tasks that succeeded, in <directory>/.pipeline.json """
+
+	def __init__(self, directory):
+		self.path = os.path.join(directory, CACHE)
+		try:
+			with open(self.path) as f:
+				self.tasks = json.load(f)
+		except (OSError, ValueError):
+			self.tasks = {}
+
+	def up_to_date(self, task):
+		entry = self.tasks.get(task.name)
+		if entry is None or entry['command'] != task.command[1:]:
+			return False
+		for files, known in ((task.inputs, entry['inputs']), (task.outputs, entry['outputs'])):
+			for filepath in files:
+				current = fingerprint(filepath, known.get(filepath))
+				if not same(known.get(filepath), current):
+					return False
+				known[filepath] = current		# Same content, new mtime: no need to hash it again
+		return True
+
+	def record(self, task):
+		self.tasks[task.name] = {
+			'command': task.command[1:],		# Not the interpreter
+			'inputs': {f: fingerprint(f) for f in task.inputs},
+			'outputs': {f: fingerprint(f) for f in task.outputs},
+		}
+
+	def save(self):
+		tmp_path = self.path + '.tmp'
+		with open(tmp_path, 'w') as f:
+			json.dump(self.tasks, f, indent=1)
+		os.replace(tmp_path, self.path)
+
+
+def _run(task):
+	result = subprocess.run(task.command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+							text=True)
+	if result.returncode != 0 or not all(os.path.exists(f) for f in task.outputs):
+		return False, result.stdout
+	return True, result.stdout
+
+
+def run(tasks, workers=None, dry_run=False, force=False, verbose=False):
+	"""
+		Runs the tasks that are not up to date, each as soon as its
+		dependencies are done, up to workers at once. The tasks after a
+		failed one are not run. Returns the number of failed tasks.
+	"""
+	caches = {}
+	for task in tasks:
+		if task.directory not in caches:
+			caches[task.directory] = Cache(task.directory)
+	pending = list(tasks)
+	running = {}
+	with ThreadPoolExecutor(workers or os.cpu_count()) as pool:
+		while pending or running:
+			for task in list(pending):
+				if any(dep.state == 'pending' for dep in task.deps):
+					continue
+				pending.remove(task)
+				cache = caches[task.directory]
+				# A dry run does not update the inputs, the steps after one that would run are listed too
+				upstream = dry_run and any(dep.state == 'done' for dep in task.deps)
+				if any(dep.state == 'failed' for dep in task.deps):
+					task.state = 'failed'
+					print(f"[SKIPPED] {task.name} (a previous step failed)")
+				elif not (force or upstream) and cache.up_to_date(task):
+					task.state = 'skipped'
+					if verbose:
+						print(f"[UP TO DATE] {task.name}")
+				elif dry_run:
+					task.state = 'done'
+					print(f"[WOULD RUN] {task.name}")
+				else:
+					print(f"[RUN] {task.name}")
+					running[pool.submit(_run, task)] = task
+			if not running:
+				continue
+			finished, _ = wait(running, return_when=FIRST_COMPLETED)
+			for future in finished:
+				task = running.pop(future)
+				ok, output = future.result()
+				if ok:
+					task.state = 'done'
+					caches[task.directory].record(task)
+					caches[task.directory].save()
+					print(f"[DONE] {task.name}")
+				else:
+					task.state = 'failed'
+					print(f"[ERROR] {task.name}\n{output}")
+	if not dry_run:
+		for cache in caches.values():
+			cache.save()		# Refreshed mtimes of the unchanged files
+	return sum(task.state == 'failed' for task in tasks)
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Extracts, aligns and cuts the SVO files of the '
+											'sessions of the directories, skipping what is up to date')
+	parser.add_argument('directories', nargs='+', help='Directories holding the .svo files')
+	parser.add_argument('-j', '--workers', type=int, help='Steps run at once (number of CPUs by default)')
+	parser.add_argument('-n', '--dry-run', action='store_true', help='Only print the steps to run')
+	parser.add_argument('--force', action='store_true', help='Run every step, up to date or not')
+	parser.add_argument('-v', '--verbose', action='store_true', help='Also list the up to date steps')
+	parser.add_argument('--group-by-name', action='store_true',
+						help='Also align the <session>_<digits>.svo files without a _session.json '
+							 'together (recordings of older versions)')
+	parser.add_argument('--align', nargs=argparse.REMAINDER, default=[],
+						help='Options passed on to timestamp_align.py (e.g. --align --legacy), last')
+	args = parser.parse_args()
+
+	for directory in args.directories:
+		if not os.path.isdir(directory):
+			print(f"[ERROR] Can't find directory {directory}")
+			exit(1)
+	tasks = build(args.directories, args.align, args.group_by_name)
+	failed = run(tasks, args.workers, args.dry_run, args.force, args.verbose)
+	ran = sum(task.state == 'done' for task in tasks)
+	print(f"\n{len(tasks)} steps: {ran} {'to run' if args.dry_run else 'run'}, "
+		  f"{sum(task.state == 'skipped' for task in tasks)} up to date, "
+		  f"{failed} failed")
+	exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+	main()
@@ -1,17 +1,19 @@
 import sys
 import os
 import argparse
-import csv
 import subprocess
+import timestamp_store
 
 '''
-This program takes in an svo file, and a csv file containing timestamps for each frame.
+This program takes in an svo file, and a timestamps file for its frames: a _ts.bin store
+(see timestamp_store.py, e.g. the _aligned.bin of timestamp_align.py) or a csv file.
 The csv file columns are assumed to be ["frame #", "timestamp", "dropped frames"],
-The svo file will then be cut, based on first and last frame number in the csv file.
-For inputting multiple files, the svo and csv files must be entered respectively (svo1, svo2, svo3, csv1, csv2, csv3)
+The svo file will then be cut, based on first and last frame number in the timestamps file
+(only those two rows are read).
+For inputting multiple files, the svo and timestamps files must be entered respectively (svo1, svo2, svo3, ts1, ts2, ts3)
 
 This program assumes the presence of /usr/local/zed/tools/ZED_SVO_EDITOR file. 
-The output is going to be saved in path-to-input-svo/cut_svo.
+The output is going to be saved in path-to-input-svo/cut_svo, or in the directory given with -o.
 '''
 
 def main():
@@ -19,7 +21,8 @@ def main():
                                             ' and will cut both ends of the svo based on the csv file')
 
     parser.add_argument('-v', '--video', nargs='*', help='Path to svo file')
-    parser.add_argument('-t', '--timestamps', nargs='*', help='Path to csv file corresponding to svo file')
+    parser.add_argument('-t', '--timestamps', nargs='*', help='Path to _ts.bin or csv file corresponding to svo file')
+    parser.add_argument('-o', '--output', help='Output directory, path-to-input-svo/cut_svo by default')
 
     # Arg parse
     args = parser.parse_args()
@@ -35,12 +38,8 @@ def main():
     # Loop over each input svo file
     for i in range(len(videospaths)):
         print("Reading SVO file: {0} \n".format(videospaths[i]))
-        # Read the csv file
-        with open(tspaths[i], 'r') as csv_file:
-            dict_reader = csv.DictReader(csv_file)
-            file_data = list(dict_reader)		# Convert the data into a list of dictionaries
-            keys = list(file_data[-1].keys())  	# All column names of the current csv file
-            id_column = keys[0]    	            # The name of the second column (contains timestamps)
+        # First and last frame numbers (first column) of the timestamps file
+        first_frame, last_frame = timestamp_store.first_last(tspaths[i])
 
         # File name (without path)
         filename = os.path.basename(videospaths[i])
@@ -49,18 +48,17 @@ def main():
         # The *parent* directory of the file was in
         basedire = os.path.dirname(videospaths[i])
         # Making a new directory to store output svo at
-        newdir = os.path.join(basedire, 'cut_svo')
-        if not os.path.exists(newdir):
-            os.mkdir(newdir)
+        newdir = args.output or os.path.join(basedire, 'cut_svo')
+        os.makedirs(newdir, exist_ok=True)  # Other steps may create it at the same time
 
         # Start a ZED_SVO_Editor process
         processes.append(subprocess.Popen(['/usr/local/zed/tools/ZED_SVO_Editor',
                                             '-cut',
                                             videospaths[i],
                                             '-s', 
-                                            file_data[0][id_column],
+                                            first_frame,
                                             '-e',
-                                            file_data[-1][id_column],
+                                            last_frame,
                                             os.path.join(newdir, newfilename)]))
         print(f'Started processing file {i}')
 
@@ -1,130 +1,497 @@
-import csv 
-import sys
+import csv
 import os
+import json
+import argparse
+from fractions import Fraction
 import numpy as np
-import pandas as pd
+import timestamp_store
+
+# Frame period (ms) and start matching tolerance (ms) of the legacy alignment
+# ... (--legacy), the default alignment estimates them from each file.
+PERIOD = 16.67
+TOLERANCE = 8
+
 
 # =============================================================== #
+def read_timestamps(filepath):
+	"""
+		Reads a timestamps file, as written by timestamp_extract.py: a store
+		(_ts.bin, see timestamp_store.py) or a csv file.
+
+		Parameters
+		----------
+		filepath: str
+			Path to the file. The second column of a csv holds the timestamps.
+
+		Returns
+		-------
+		header: list
+			Column names.
+		table: np.ndarray
+			(rows, columns) object array of the cells, as strings.
+		ts: np.ndarray
+			int64 timestamps in ms (truncated like int(float(cell))).
+		store: timestamp_store.Timestamps
+			Frame numbers, timestamps (ns) and dropped frames of the rows.
+	"""
+	if not filepath.endswith('.csv'):
+		store = timestamp_store.load(filepath)
+		ts = store.timestamp // 1000000
+		table = np.empty((len(ts), len(timestamp_store.FIELDS)), dtype=object)
+		for k, column in enumerate((store.frame, ts, store.dropped)):
+			table[:, k] = column.tolist()
+		return list(timestamp_store.FIELDS), table, ts, store
+	with open(filepath, 'r') as csv_file:
+		reader = csv.reader(csv_file)
+		header = next(reader)
+		rows = [row for row in reader if row]	# Blank lines are skipped, as csv.DictReader does
+	table = np.empty((len(rows), len(header)), dtype=object)
+	table[:] = rows
+	ts = np.array(table[:, 1], dtype=np.float64).astype(np.int64)
+	dropped = table[:, 2] if len(header) > 2 else np.zeros(len(rows), dtype=np.int64)
+	store = timestamp_store.Timestamps(
+		np.array(table[:, 0], dtype=np.int64),
+		(np.array(table[:, 1], dtype=np.float64) * 1e6).round().astype(np.int64),
+		np.array(dropped, dtype=np.int64), 0.0, 0)
+	return header, table, ts, store
+
+
+def fill_gaps(table, ts, period=PERIOD):
+	"""
+		Adds a placeholder row for each dropped frame.
+
+		Where two consecutive frames are round(diff / period) >= 2 periods
+		apart, round(diff / period) - 1 rows are inserted before the second
+		one: copies of it whose timestamp is period, 2 * period ... after the
+		first one, and whose diff is empty. Every frame gets its diff to the
+		previous one (0 for the first frame).
+
+		Parameters
+		----------
+		table: np.ndarray
+			(rows, columns) cells of the file, column 1 holds the timestamps.
+		ts: np.ndarray
+			int64 timestamps of the rows.
+		period: float
+			Frame period (ms).
+
+		Returns
+		-------
+		src: np.ndarray
+			Row of table each output row comes from.
+		real: np.ndarray
+			False for the placeholder rows.
+		ts_column: np.ndarray
+			Timestamp cells: the original strings, np.longdouble values for
+			the placeholders.
+		diff_column: np.ndarray
+			Diff cells: int for the frames, "" for the placeholders.
+		new_ts: np.ndarray
+			int64 timestamps of the output rows (placeholders truncated).
+	"""
+	diff = np.diff(ts, prepend=ts[:1])
+	ratio = np.rint(diff / period).astype(np.int64)	# round() of each ratio
+	fill = np.where(ratio >= 2, ratio - 1, 0)		# Placeholders before each row
+	group = fill + 1
+	src = np.repeat(np.arange(len(ts)), group)
+	# Position of each output row in its group: placeholders 0 .. fill-1, then the frame
+	pos = np.arange(len(src)) - np.repeat(np.cumsum(group) - group, group)
+	real = pos == fill[src]
+
+	ts_column = table[src, 1]
+	diff_column = np.empty(len(src), dtype=object)
+	diff_column[real] = diff.tolist()
+	diff_column[~real] = ""
+	new_ts = ts[src]
+	holes = np.flatnonzero(~real)
+	if len(holes):
+		# Placeholder j after frame i-1: float128(ts[i-1]) + period * (j + 1)
+		previous = np.array([np.longdouble(cell) for cell in table[src[holes] - 1, 1]])
+		values = previous + period * (pos[holes] + 1)
+		ts_column[holes] = list(values)
+		new_ts[holes] = values.astype(np.int64)
+	return src, real, ts_column, diff_column, new_ts
+
+
+def start_frame(new_ts, pivot_ts):
+	"""
+		First row (gaps filled) whose timestamp is at most TOLERANCE before
+		pivot_ts, the first timestamp of the file that started last.
+	"""
+	target = pivot_ts - TOLERANCE
+	if np.all(new_ts[1:] >= new_ts[:-1]):
+		j = np.searchsorted(new_ts, target)
+		return j if j < len(new_ts) else None
+	# Timestamps going backwards: first row closer than the tolerance and
+	# ... than the row before it
+	diff = pivot_ts - new_ts
+	previous = np.concatenate(([np.inf], diff[:-1]))
+	match = np.flatnonzero((diff <= TOLERANCE) & (diff < previous))
+	return match[0] if len(match) else None
+
+
+def frame_count(ts):
+	"""
+		Index of each frame in periods since the first one, drops included:
+		the median interval gives the number of periods between consecutive
+		frames.
+	"""
+	intervals = np.diff(ts)
+	median = np.median(intervals[intervals > 0])
+	steps = np.maximum(np.rint(intervals / median), 1).astype(np.int64)
+	return np.concatenate(([0], np.cumsum(steps)))
+
+
+def estimate_period(ts):
+	"""
+		Frame period (ms) of a file, robust to dropped frames: the slope of
+		the timestamps against their frame count.
+	"""
+	slope, _ = np.polyfit(frame_count(ts), (ts - ts[0]).astype(np.float64), 1)
+	return float(slope)
+
+
+def nearest(values, queries):
+	"""
+		Index of the value nearest to each query, and value - query.
+		values must be sorted (at least 2 of them).
+	"""
+	j = np.clip(np.searchsorted(values, queries), 1, len(values) - 1)
+	j -= queries - values[j - 1] < values[j] - queries
+	return j, values[j] - queries
+
+
+def fit_clock(ref_ts, ts, tolerance):
+	"""
+		Fits the clock of a file to the reference (pivot) clock.
+
+		ref ~ ts[0] + offset + scale * (ts - ts[0]), fitted on the frames
+		captured together: the frame counts of both files (frame_count) are
+		put on the same scale (their nominal frame rate ratio) and shifted so
+		that the first frame of the file faces the reference frame closest in
+		time (the clocks start less than half a period apart). Nearest-time
+		matching would slip to the neighbouring frame once the drift adds up
+		to half a period. The line is fitted again without the matches more
+		than tolerance off.
+
+		Parameters
+		----------
+		ref_ts: np.ndarray
+			Sorted timestamps (ms) of the reference file.
+		ts: np.ndarray
+			Timestamps (ms) of the file.
+		tolerance: float
+			Largest matching error (ms).
+
+		Returns
+		-------
+		offset: float
+			Clock offset (ms) at the first frame of the file.
+		scale: float
+			Reference time per unit of file time, the file's clock runs
+			1 / scale - 1 faster than the reference's.
+	"""
+	ref_count, count = frame_count(ref_ts), frame_count(ts)
+	ref_period = estimate_period(ref_ts)
+	ratio = Fraction(estimate_period(ts) / ref_period).limit_denominator(4)
+	# Frames of the file on the reference's count, those between two reference frames are left out
+	on_grid = count * ratio.numerator % ratio.denominator == 0
+	shift = np.rint((ts[0] - ref_ts[0]) / ref_period).astype(np.int64)
+	position = shift + count[on_grid] * ratio.numerator // ratio.denominator
+	j = np.clip(np.searchsorted(ref_count, position), 0, len(ref_count) - 1)
+	together = ref_count[j] == position
+	x = (ts[on_grid][together] - ts[0]).astype(np.float64)
+	ref = (ref_ts[j[together]] - ts[0]).astype(np.float64)
+	if len(x) < 2:
+		return 0.0, 1.0
+	scale, offset = np.polyfit(x, ref, 1)
+	inliers = np.abs(ref - offset - scale * x) <= tolerance
+	if inliers.sum() >= 2:
+		scale, offset = np.polyfit(x[inliers], ref[inliers], 1)
+	return float(offset), float(scale)
+
+
+def match_frames(slots, mapped, tolerance):
+	"""
+		Frame (index in mapped) nearest to each slot, -1 if none is within
+		tolerance or if the frame is nearer to another slot. Also returns
+		the matching errors (ms).
+	"""
+	order = np.argsort(mapped, kind='stable')
+	j, err = nearest(mapped[order], slots)
+	frame = np.where(np.abs(err) <= tolerance, order[j], -1)
+	# A frame matches one slot at most: the nearest one
+	matched = np.flatnonzero(frame >= 0)
+	matched = matched[np.argsort(np.abs(err[matched]), kind='stable')]
+	_, first = np.unique(frame[matched], return_index=True)
+	nearest_slot = np.zeros(len(slots), dtype=bool)
+	nearest_slot[matched[first]] = True
+	frame[~nearest_slot] = -1
+	return frame, err
+
+
+def align_first_frame(files, pivot):
+	"""
+		Legacy alignment: gaps filled with a PERIOD ms period, every file
+		starts at its frame closest (TOLERANCE) to the first frame of the
+		pivot file, and all are cut to the shortest one.
+
+		Returns, for each file, the output columns and the row of the file
+		each output row holds (-1 for placeholders).
+	"""
+	filled = []
+	starting_frames = []  # To hold the new starting frame of each file
+	for i, (header, table, ts) in enumerate(files):
+		filled.append(fill_gaps(table, ts))
+		if i == pivot: # The pivot file's frames won't be shifted
+			starting_frames.append(0)
+			continue
+		start = start_frame(filled[-1][4], files[pivot][2][0])
+		if start is None:
+			return None
+		starting_frames.append(int(start))
+
+	# Find the least sized file, and extract the size to be applied to all files (so all output files will have same size)
+	sizes = [len(f[0]) - starting_frames[i] for i, f in enumerate(filled)]
+	least_size = np.min(sizes)
+
+	outputs = []
+	for i, (header, table, ts) in enumerate(files):
+		src, real, ts_column, diff_column, _ = filled[i]
+		# New starting and ending point of the file
+		rows = slice(starting_frames[i], starting_frames[i] + least_size)
+		columns = [table[src[rows], k] for k in range(len(header))]
+		columns[1] = ts_column[rows]
+		columns = [column.tolist() for column in columns] + [diff_column[rows].tolist()]
+		outputs.append((columns, np.where(real[rows], src[rows], -1)))
+	return outputs
+
+
+def align_nearest(files, pivot, period=None, tolerance=None):
+	"""
+		Drift-aware alignment on the timeline of the pivot file.
+
+		The pivot's frames, with its gaps filled at its own period, are the
+		slots of the timeline. The clock of every other file is fitted to the
+		pivot's (offset and drift), then each slot gets the nearest frame of
+		each file, if within tolerance. The timeline is cut to the slots
+		where every file has a frame.
+
+		Returns the outputs (as align_first_frame), the slot timestamps and
+		a report of the clock fits and residual errors. The cameras are not
+		synchronized: the fitted offset includes the phase between their
+		frames (up to half a period), the capture time difference of the
+		matched frames is reported apart.
+	"""
+	periods = [period or estimate_period(ts) for _, _, ts in files]
+	tolerance = tolerance or 0.5 * periods[pivot]
+	header, table, ref_ts = files[pivot]
+	slots = fill_gaps(table, ref_ts, periods[pivot])[4].astype(np.float64)
+
+	clocks, frames, errors = [], [], []
+	for i, (header, table, ts) in enumerate(files):
+		offset, scale = (0.0, 1.0) if i == pivot else fit_clock(ref_ts, ts, tolerance)
+		mapped = ts[0] + offset + scale * (ts - ts[0])
+		frame, err = match_frames(slots, mapped, tolerance)
+		clocks.append((offset, scale))
+		frames.append(frame)
+		errors.append(err)
+	everywhere = np.flatnonzero(np.all(np.array(frames) >= 0, axis=0))
+	if not len(everywhere):
+		return None
+	rows = slice(everywhere[0], everywhere[-1] + 1)
+
+	outputs = []
+	report = {'pivot': pivot, 'tolerance_ms': tolerance, 'slots': rows.stop - rows.start,
+			  'files': []}
+	for i, (header, table, ts) in enumerate(files):
+		frame = frames[i][rows]
+		found = frame >= 0
+		offset, scale = clocks[i]
+		diff = np.diff(ts, prepend=ts[:1])
+		columns = [np.full(len(frame), "", dtype=object) for _ in range(len(header) + 1)]
+		for k in range(len(header)):
+			columns[k][found] = table[frame[found], k]
+		columns[-1][found] = diff[frame[found]].tolist()
+		# Missing frames: the time they were expected at, in the file's own clock
+		expected = (slots[rows][~found] - ts[0] - offset) / scale + ts[0]
+		columns[1][~found] = [f"{t:.2f}" for t in expected]
+		outputs.append(([column.tolist() for column in columns], frame))
+
+		err = np.abs(errors[i][rows][found])
+		# Capture time difference to the pivot's frame, before the clock fit
+		gap = np.abs(ts[frame[found]] - slots[rows][found])
+		report['files'].append({
+			'period_ms': periods[i],
+			'offset_ms': offset,
+			'drift_ppm': (1 / scale - 1) * 1e6,
+			'drift_over_file_ms': (1 - scale) * float(ts[-1] - ts[0]),
+			'matched': int(found.sum()),
+			'missing': int((~found).sum()),
+			'residual_ms': {
+				'mean': float(err.mean()),
+				'std': float(err.std()),
+				'p95': float(np.percentile(err, 95)),
+				'max': float(err.max()),
+			},
+			'difference_ms': {
+				'mean': float(gap.mean()),
+				'max': float(gap.max()),
+			},
+		})
+	return outputs, slots[rows], report
+
+
+def synthetic_timestamps(frames, period, drift_ppm=0.0, phase=0.0, drop_rate=0.0, seed=0):
+	"""
+		Timestamps (ms, truncated like the extracted ones) of a camera
+		capturing frames at the same instants as a reference starting at 0
+		with the given period, whose clock runs drift_ppm faster and phase ms
+		ahead, with a fraction drop_rate of the frames dropped.
+	"""
+	rng = np.random.default_rng(seed)
+	ts = phase + np.arange(frames) * period * (1 + drift_ppm * 1e-6) + rng.normal(0, 0.2, frames)
+	kept = rng.random(frames) >= drop_rate
+	kept[0] = True
+	return (1e6 + ts[kept]).astype(np.int64)
+
+
+def check(frames=200000, period=1000 / 60, drift_ppm=50.0):
+	"""
+		Fits the clocks of synthetic pairs of cameras with a known drift (and
+		without), for a few phases and drop rates. Returns False if a drift
+		estimate is off by more than 1 ppm.
+	"""
+	ok = True
+	for drift in (0.0, drift_ppm):
+		for phase in (2.0, 5.0, 7.0):
+			for drop_rate in (0.0, 0.02, 0.2):
+				ref_ts = synthetic_timestamps(frames, period, drop_rate=drop_rate, seed=1)
+				ts = synthetic_timestamps(frames, period, drift, phase, drop_rate, seed=2)
+				offset, scale = fit_clock(ref_ts, ts, period / 2)
+				estimate = (1 / scale - 1) * 1e6
+				ok &= abs(estimate - drift) <= 1.0
+				print(f"phase {phase} ms, {drop_rate:.0%} dropped: drift {estimate:+.2f} ppm "
+					  f"(true {drift:+.2f}), offset {offset:+.2f} ms")
+	return ok
+
+
+def write_rows(filepath, header, columns):
+	""" Writes the columns (lists of cells) as a csv file """
+	with open(filepath, 'w') as csv_file:
+		print(f'Writing {filepath}')
+		writer = csv.writer(csv_file)
+		writer.writerow(header)
+		writer.writerows(zip(*columns))
+
+
 def main():
+	parser = argparse.ArgumentParser(description='Aligns the timestamps files of cameras '
+											'recorded together (as written by timestamp_extract.py)')
+	parser.add_argument('files', nargs='*', help='Path to the _ts.bin (or csv) files')
+	parser.add_argument('--period', type=float,
+						help='Frame period (ms), estimated from each file by default')
+	parser.add_argument('--tolerance', type=float,
+						help='Largest matching error (ms), half the period by default')
+	parser.add_argument('--legacy', action='store_true',
+						help=f'Align on the first frame only, with a {PERIOD} ms period and a '
+							 f'{TOLERANCE} ms tolerance (previous behavior)')
+	parser.add_argument('-o', '--output',
+						help='Directory of the outputs, <dir>/aligned by default (<dir>: the directory '
+							 'holding the ts/ directory of the files)')
+	parser.add_argument('--check', action='store_true',
+						help='Check the clock fit on synthetic cameras with a known drift, and exit')
+	args = parser.parse_args()
+	if args.check:
+		exit(0 if check() else 1)
+	if not args.files:
+		parser.error('the files are required')
+
 	print("Starting ...")
-	# Process command line args
-	argc = len(sys.argv)
 	filespaths = []
 	# Extract file names from args
-	for i in range(1, argc):
-		filepath = sys.argv[i]
-		if not os.path.isfile(filepath): 
+	for filepath in args.files:
+		if not os.path.isfile(filepath):
 			print(f"[ERROR] Can't find file {filepath}\nPlease Enter a Correct Path")
 			exit(1)
 		filespaths.append(filepath)
 
 
 	# ---------------------------------------------------------------------------- #
-	# Read each file into a list of dictionaries, then put all of them into a list
-	# ... So, one file = [{frame #: x, ts: y}, {frame #: x, ts: y}, ... etc]
-	# ... And a list of files = [file1 data, file2 data ... etc]
+	# Read each file into a table of cells and an int64 array of timestamps
 	# ---------------------------------------------------------------------------- #
-	list_of_files = []
+	files = []
+	stores = []
 	first_ts = []  # Hold the timestamp of the first frame from each file
 	for f in filespaths:
 		print(f"Reading File {f}")
-		# Open CSV File 
-		with open(f, 'r') as csv_file:
-			dict_reader = csv.DictReader(csv_file)
-			file_data = list(dict_reader)		# Convert the data into a list of dictionaries
-			list_of_files.append(file_data)		# ... and append it to the list of files
-			keys = list(file_data[-1].keys())  	# All column names of the current csv file
-			timestamp_column_name = keys[1]    	# The name of the second column (contains timestamps)
-			first_ts.append(int(float(file_data[0][timestamp_column_name]))) # retrieve the timestamp of the first frame
+		header, table, ts, store = read_timestamps(f)
+		files.append((header, table, ts))
+		stores.append(store)
+		first_ts.append(ts[0]) # retrieve the timestamp of the first frame
 
 	# Order the files in terms of their starting point (which file started recording first)
 	order = np.argsort(first_ts) # ascending order
-	# Determine the file that started last (the one with largest first timestamp), this will be the pivot file
-	largest_ts_file = list_of_files[order[-1]]
-
-
-	# ---------------------------------------------------------------------------------------------------- #
-	# Calculate difference between each frame and previous frame. Add this as a seperate column called diff.
-	# If the difference divided by the mean difference (16.67) is higher than 2 (a frame dropped) then ...
-	# ... add an empty frame that is 16.67ms away from the previous one. 
-	# ... Do this multiple times as needed.
-	# ---------------------------------------------------------------------------------------------------- #
-	new_list_of_files = [] 					# holder of all files after modifications
-	for list_of_dict in list_of_files:		# loop over each list of dictionary in the list of files
-		new_list_of_dict = []				# create a new list of dictionaries for each file
-		
-		for i in range(len(list_of_dict)): 	# loop over each dictionary (each frame) in the list 
-			if i == 0: 						# first frame: zero difference (no frame before it)
-				diff = 0					
-			else: 							# otherwise: calc time diff between current and previous frame
-				diff = int(float(list_of_dict[i][timestamp_column_name])) - int(float(list_of_dict[i-1][timestamp_column_name])) 
-
-			ratio = diff / 16.67			# this should return how many frames were dropped, approxamatly
-
-			# Here we deal with each dropped frame by adding a spece holder for each of them.
-			# If round(ratio) = 2 then diff might have been between 26-41.
-			# ... On average, difference is 16.67,
-			# ... thus, we need to add only one frame,
-			# ... which is equal to round(ratio) - 1.
-			# ... This is applicable for any round(ratio) >= 2,
-			# ... which is why we will loop over range(round(ratio)-1)
-			if round(ratio) >= 2:
-				for j in range(round(ratio)-1):
-					row = list_of_dict[i].copy()	# Copy current list_of_dict row and modify it as a dropped frame
-					row[timestamp_column_name] = np.float128(list_of_dict[i-1][timestamp_column_name]) + (16.67*(j+1))
-					row['diff'] = ""
-					new_list_of_dict.append(row)	# Append the modified row into new_data_dict
-
-			# After adding dropped frames holders (if there was any)
-			list_of_dict[i]['diff'] = diff				# modify the current frame
-			new_list_of_dict.append(list_of_dict[i])	# and append it to new_data_dict
-		
-		new_list_of_files.append(new_list_of_dict) # Append the new list of dictionaries to the new list of files.
-	
-	
-	# for each file, find a frame corresponding to the first frame in the largest ts file.
-	starting_frames = []  # To hold the new starting frame of each file
-	for i, list_of_dict in enumerate(new_list_of_files):
-		# If the current file is the one that started last, append 0 (its frames won't be shifted)
-		if i == order[-1]: 
-			starting_frames.append(0)
-			continue
-		
-		# Otherwise, find the suitable corresponding frame by comparing each frame's timestamp with the pivot file timestamp
-		diff = np.inf
-		for j, frame in enumerate(list_of_dict):
-			old_diff = diff
-			diff = first_ts[order[-1]] - int(frame[keys[1]])
-			if  diff <= 8 and diff < old_diff:
-				starting_frames.append(j)
-				break
-	
-	# Find the least sized file, and extract the size to be applied to all files (so all output files will have same size)
-	sizes =[]
-	for i, list_of_dict in enumerate(new_list_of_files):
-		sizes.append(len(list_of_dict)-starting_frames[i])
-	least_size = np.min(sizes)
+	# The file that started last (largest first timestamp) is the pivot file
+	pivot = order[-1]
+
+	if args.legacy:
+		outputs = align_first_frame(files, pivot)
+		join_header = ['aligned']
+	else:
+		aligned = align_nearest(files, pivot, args.period, args.tolerance)
+		outputs = None if aligned is None else aligned[0]
+		join_header = ['aligned', 'timestamp']
+	if outputs is None:
+		print(f"[ERROR] No frame of some file matches the frames of {filespaths[pivot]}")
+		exit(1)
+	size = len(outputs[0][1])
+	join_columns = [list(range(size))]
+	if not args.legacy:
+		join_columns.append([f"{t:.2f}" for t in aligned[1]])
 
 	for i, filepath in enumerate(filespaths):
-		# File name (without path)
-		filename = os.path.basename(filepath)
+		header = files[i][0]
+		columns, source = outputs[i]
+		# File name (without path and extension)
+		filename = os.path.splitext(os.path.basename(filepath))[0]
 		# The name of the output file
-		newfilename = filename.replace('.csv', '_aligned.csv')
+		newfilename = filename + '_aligned.csv'
 		# The *parent* directory of the *parent* directory the file was in
 		basedire = os.path.dirname(os.path.dirname(filepath))
 		# Making a new directory to store output csv at
-		newdir = os.path.join(basedire, 'aligned')
-		if not os.path.exists(newdir):
-			os.mkdir(newdir)
-
+		newdir = args.output or os.path.join(basedire, 'aligned')
+		os.makedirs(newdir, exist_ok=True)		# Other steps may create it at the same time
 		# Writting output file
-		starting_frame = int(starting_frames[i])
-		new_list_of_dict = new_list_of_files[i][starting_frame:starting_frame+least_size] # New starting and ending point of the file
-		with open(os.path.join(newdir, newfilename), 'w') as csv_file: 
-			print(f'Writing {os.path.join(newdir, newfilename)}')
-			dict_writer = csv.DictWriter(csv_file, new_list_of_dict[-1].keys())
-			dict_writer.writeheader()
-			dict_writer.writerows(new_list_of_dict)
+		write_rows(os.path.join(newdir, newfilename), header + ['diff'], columns)
+		# The aligned frames of the file (no placeholders), for svo_cutter.py
+		kept = source[source >= 0]
+		store = stores[i]
+		timestamp_store.write(os.path.join(newdir, filename + '_aligned.bin'), store.frame[kept],
+							  store.timestamp[kept], store.dropped[kept], store.fps, store.serial)
+		# Join table: frame number (first column) of each file on each aligned row, -1 if missing
+		join_header.append(filename)
+		frames = np.full(len(source), -1, dtype=object)
+		frames[source >= 0] = files[i][1][kept, 0]
+		join_columns.append(frames.tolist())
+
+	# All files aligned: one row per aligned frame, one column per file
+	names = [os.path.basename(f) for f in filespaths]
+	prefix = os.path.commonprefix(names).rstrip('_-')
+	prefix = prefix + '_' if prefix else ''
+	write_rows(os.path.join(newdir, prefix + 'join.csv'), join_header, join_columns)
+
+	if not args.legacy:
+		report = aligned[2]
+		for name, entry in zip(names, report['files']):
+			entry['file'] = name
+			residual = entry['residual_ms']
+			print(f"{name}: period {entry['period_ms']:.3f} ms, offset {entry['offset_ms']:+.2f} ms, "
+				  f"drift {entry['drift_ppm']:+.1f} ppm, {entry['missing']} missing, residual "
+				  f"mean {residual['mean']:.2f} / p95 {residual['p95']:.2f} / max {residual['max']:.2f} ms, "
+				  f"capture difference mean {entry['difference_ms']['mean']:.2f} ms")
+		with open(os.path.join(newdir, prefix + 'alignment.json'), 'w') as f:
+			json.dump(report, f, indent=2, default=int)
 
 
 
@@ -1,80 +1,327 @@
-import sys
 import os
-import csv
-import pyzed.sl as sl
+import argparse
+import multiprocessing
+import queue
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+import timestamp_store
 
+try:
+	import pyzed.sl as sl
+except ImportError:		# Only SvoReader needs the ZED SDK
+	sl = None
+
+# The files (or frame ranges with --split) are extracted in parallel, each
+# ... by a process of its own, and merged back in frame order. The readers
+# ... only have to provide the SvoReader interface: extract_files(...,
+# ... reader=FakeSvoReader) runs the same scheduling and merge without the SDK.
 
-def main():
-	# Arg Parsing
-	if len(sys.argv) < 2:
-		print("Please specify path to .svo file.")
-		exit()
-	filepaths = []
-	for i in range(len(sys.argv)-1):
-		filepaths.append(sys.argv[i+1])
 
-	# Init camera
-	input_type = sl.InputType()
+# =============================================================== #
+class SvoReader:
+	"""
+		Frames of an SVO file, decoded by the ZED SDK.
 
-	for filepath in filepaths:
-		print("Reading SVO file: {0}".format(filepath))
+		Parameters
+		----------
+		filepath: str
+			Path to the .svo file.
+	"""
+
+	def __init__(self, filepath):
+		if sl is None:
+			raise ImportError("SvoReader needs the ZED SDK (pyzed)")
+		input_type = sl.InputType()
 		input_type.set_from_svo_file(filepath)
 		init = sl.InitParameters(input_t=input_type, svo_real_time_mode=False)
-		cam = sl.Camera()
-		status = cam.open(init)
+		self.cam = sl.Camera()
+		status = self.cam.open(init)
 		if status != sl.ERROR_CODE.SUCCESS:
-			print(repr(status))
-			exit()
+			raise RuntimeError(f"{filepath}: {status!r}")
+		self.runtime = sl.RuntimeParameters(enable_depth=False)
 
-		# Runtime parameters
-		runtime = sl.RuntimeParameters(enable_depth=False)
+	def __len__(self):
+		return self.cam.get_svo_number_of_frames()
 
-		# List to hold every {frame #, timestamp}
-		out_data = []
-		dropped_frames = 0	
+	def seek(self, position):
+		self.cam.set_svo_position(position)
 
-		while True:
-			# Grab a frame
-			err = cam.grab(runtime)
+	def dropped(self):
+		return self.cam.get_frame_dropped_count()
 
+	def grab(self):
+		""" (frame #, timestamp in ns) of the next frame, None at the end of the file """
+		while True:
+			err = self.cam.grab(self.runtime)
 			# Successful grab
 			if err == sl.ERROR_CODE.SUCCESS:
-				# Get timestamp
-				timestamp = cam.get_timestamp(sl.TIME_REFERENCE.IMAGE).get_milliseconds()
-				# Get frame number
-				fn = cam.get_svo_position()
-				# Record if there was dropped frames before this one and how many are dropped
-				dropped = cam.get_frame_dropped_count()-dropped_frames
-				dropped_frames+=dropped
-				# Record timestamp in list
-				out_data.append({'#': fn, 'timestamp': timestamp, 'dropped frames': dropped})
-
-				if fn % 1000 == 0:
-					print(fn)
-
+				return (self.cam.get_svo_position(),
+						self.cam.get_timestamp(sl.TIME_REFERENCE.IMAGE).get_nanoseconds())
 			# End of file reached
 			elif err == sl.ERROR_CODE.END_OF_SVOFILE_REACHED:
+				return None
+
+	def close(self):
+		self.cam.close()
+
+
+class FakeSvoReader:
+	"""
+		SvoReader of a made up recording: 60 fps, a few dropped frames, and a
+		number of frames derived from the file name (the file need not exist).
+	"""
+
+	def __init__(self, filepath, delay=0.0):
+		seed = zlib.crc32(os.path.basename(filepath).encode())
+		self.frames = 2000 + seed % 3000
+		self.drops = {frame for frame in range(self.frames) if (frame * 7919 + seed) % 97 == 0}
+		self.delay = delay		# Decoding time of a frame (s)
+		self.position = 0
+
+	def __len__(self):
+		return self.frames
+
+	def seek(self, position):
+		self.position = position
+
+	def dropped(self):
+		return sum(1 for frame in self.drops if frame < self.position)
+
+	def grab(self):
+		if self.position >= self.frames:
+			return None
+		time.sleep(self.delay)
+		frame = self.position
+		self.position += 1
+		return frame, 10**15 + round((frame + self.dropped()) * 1e9 / 60)
+
+	def close(self):
+		pass
+
+
+def extract_range(filepath, start=0, stop=None, reader=SvoReader, progress=None):
+	"""
+		Timestamps of the frames start <= # < stop of an SVO file.
+
+		Parameters
+		----------
+		filepath: str
+			Path to the .svo file.
+		start, stop: int
+			Frame range (stop=None: up to the end of the file).
+		reader: type
+			SvoReader, or any class with the same interface.
+		progress: callable
+			Called as progress(frames done, frames in the range) every 1000
+			frames.
+
+		Returns
+		-------
+		rows: list
+			(frame #, timestamp in ns, dropped frames before this one). The
+			dropped count is relative to the start of the range.
+	"""
+	svo = reader(filepath)
+	try:
+		total = len(svo)
+		stop = total if stop is None else min(stop, total)
+		if start:
+			svo.seek(start)
+		dropped_frames = svo.dropped()
+		rows = []
+		while True:
+			frame = svo.grab()
+			if frame is None:
+				break
+			fn, timestamp = frame
+			if fn >= stop:
 				break
+			if fn < start:		# Seeking is not exact on every SDK version
+				continue
+			# Record if there was dropped frames before this one and how many are dropped
+			dropped = svo.dropped() - dropped_frames
+			dropped_frames += dropped
+			rows.append((fn, timestamp, dropped))
+			if progress is not None and len(rows) % 1000 == 0:
+				progress(len(rows), stop - start)
+	finally:
+		svo.close()
+	if progress is not None:
+		progress(stop - start, stop - start)
+	return rows
+
+
+def plan(filepaths, split=None, reader=SvoReader):
+	"""
+		Ranges to extract, as (file index, start, stop), longest first.
+
+		Each file is one range, or with split consecutive ranges of split
+		frames (the files are opened to count their frames).
+	"""
+	ranges = []
+	for i, filepath in enumerate(filepaths):
+		if not split:
+			ranges.append((i, 0, None))
+			continue
+		svo = reader(filepath)
+		total = len(svo)
+		svo.close()
+		ranges.extend((i, start, min(start + split, total)) for start in range(0, total, split))
+	# Longest ranges first, the short ones fill the gaps at the end
+	if split:
+		ranges.sort(key=lambda r: r[1] - r[2])
+	return ranges
 
-		# Closing camera
-		cam.close()
-
-		# File name (without path)
-		filename = os.path.basename(filepath)
-		# The name of the output file
-		newfilename = filename.replace('.svo', '_ts.csv')
-		# The directory in which input file is
-		basedire = os.path.dirname(filepath)
-		# Making a new directory to store output csv at
-		newdir = os.path.join(basedire, 'ts')
-		if not os.path.exists(newdir):
-			os.mkdir(newdir)
-
-		# Write csv file
-		with open(os.path.join(newdir, newfilename), 'w', newline='') as csvfile:
-			writer = csv.DictWriter(csvfile, fieldnames=['#', 'timestamp', 'dropped frames'])
-			writer.writeheader()
-			writer.writerows(out_data)
+
+def merge(results):
+	"""
+		Rows of each file from the rows of its ranges.
+
+		results: {(file index, start): rows}. The ranges of a file are put
+		back in frame order, a frame read by two ranges is kept once.
+	"""
+	files = {}
+	for (i, start), rows in sorted(results.items()):
+		merged = files.setdefault(i, [])
+		last = merged[-1][0] if merged else -1
+		merged.extend(row for row in rows if row[0] > last)
+	return files
+
+
+_progress = None	# Queue of the pool workers, see _init_worker
+
+
+def _init_worker(progress):
+	global _progress
+	_progress = progress
+
+
+def _run_range(task, filepath, start, stop, reader):
+	def progress(done, total):
+		_progress.put((task, done, total))
+	return extract_range(filepath, start, stop, reader, progress)
+
+
+def extract_files(filepaths, workers=1, split=None, reader=SvoReader, on_progress=None):
+	"""
+		Timestamps of several SVO files, extracted in parallel.
+
+		Parameters
+		----------
+		filepaths: list
+			Paths to the .svo files.
+		workers: int
+			Number of processes (1: everything in this process, in order).
+		split: int
+			Frames per range if the files are split (set_svo_position), or
+			None to extract every file in one go.
+		reader: type
+			SvoReader, or any class with the same interface (FakeSvoReader).
+		on_progress: callable
+			Called with the list of (frames done, frames) of each file.
+
+		Returns
+		-------
+		rows: list
+			The rows of each file (see extract_range).
+	"""
+	ranges = plan(filepaths, split, reader)
+	# (frames done, frames) of each range, the whole files report their size once opened
+	done = {task: (0, 0 if stop is None else stop - start)
+			for task, (i, start, stop) in enumerate(ranges)}
+
+	def report(task, frames, total):
+		done[task] = (frames, total)
+		if on_progress is not None:
+			files = [[0, 0] for _ in filepaths]
+			for t, (frames, total) in done.items():
+				files[ranges[t][0]][0] += frames
+				files[ranges[t][0]][1] += total
+			on_progress([tuple(f) for f in files])
+
+	results = {}
+	if workers <= 1:
+		for task, (i, start, stop) in enumerate(ranges):
+			results[i, start] = extract_range(filepaths[i], start, stop, reader,
+											  lambda frames, total: report(task, frames, total))
+	else:
+		context = multiprocessing.get_context('spawn')	# No SDK state inherited
+		progress = context.Queue()
+		with ProcessPoolExecutor(workers, context, _init_worker, (progress,)) as pool:
+			futures = {pool.submit(_run_range, task, filepaths[i], start, stop, reader): (i, start)
+					   for task, (i, start, stop) in enumerate(ranges)}
+			pending = set(futures)
+			while pending:
+				finished, pending = wait(pending, 0.5, FIRST_COMPLETED)
+				while True:
+					try:
+						report(*progress.get_nowait())
+					except queue.Empty:
+						break
+				for future in finished:
+					results[futures[future]] = future.result()
+	files = merge(results)
+	return [files.get(i, []) for i in range(len(filepaths))]
+
+
+def write_timestamps(rows, filepath, as_csv=False):
+	"""
+		Writes the rows of a file to <dir>/ts/<name>_ts.bin (timestamp_store.py),
+		and to <dir>/ts/<name>_ts.csv (timestamps in ms) if as_csv. Returns the
+		path of the store.
+	"""
+	# File name (without path)
+	filename = os.path.basename(filepath)
+	# The name of the output file
+	newfilename = filename.replace('.svo', '_ts.bin')
+	# The directory in which input file is
+	basedire = os.path.dirname(filepath)
+	# Making a new directory to store output csv at
+	newdir = os.path.join(basedire, 'ts')
+	os.makedirs(newdir, exist_ok=True)		# Other steps may create it at the same time
+
+	path = os.path.join(newdir, newfilename)
+	columns = np.array(rows, dtype=np.int64).reshape(-1, 3).T
+	timestamp_store.write(path, *columns)
+	if as_csv:
+		timestamp_store.to_csv(timestamp_store.load(path), path.replace('_ts.bin', '_ts.csv'))
+	return path
+
+
+def main():
+	# Arg Parsing
+	parser = argparse.ArgumentParser(description='Extracts the timestamp of every frame of SVO '
+											'files into <dir>/ts/<name>_ts.bin')
+	parser.add_argument('files', nargs='+', help='Path to the .svo files')
+	parser.add_argument('-j', '--workers', type=int,
+						help='Number of processes, by default one per file (or range with '
+							 '--split) up to the number of CPUs')
+	parser.add_argument('--split', type=int, metavar='FRAMES',
+						help='Also split the files into ranges of FRAMES frames, extracted in '
+							 'parallel')
+	parser.add_argument('--csv', action='store_true',
+						help='Also write the timestamps (in ms) to <dir>/ts/<name>_ts.csv')
+	args = parser.parse_args()
+	workers = args.workers or (os.cpu_count() if args.split else min(len(args.files), os.cpu_count()))
+
+	names = [os.path.basename(f) for f in args.files]
+
+	def show(files):
+		print("  ".join(f"{name}: {frames / total:.0%}" if total else f"{name}: -"
+						for name, (frames, total) in zip(names, files)), end="\r")
+
+	print(f"Reading {len(args.files)} SVO file(s) with {workers} process(es)")
+	try:
+		results = extract_files(args.files, workers, args.split, on_progress=show)
+	except RuntimeError as e:
+		print(f"\n{e}")
+		exit()
+	print()
+	for filepath, rows in zip(args.files, results):
+		write_timestamps(rows, filepath, args.csv)
+		print(f"{filepath}: {len(rows)} frames")
 
 	print("\nFINISH")
 
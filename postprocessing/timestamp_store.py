@@ -0,0 +1,164 @@
+import sys
+import os
+import csv
+import struct
+import collections
+import numpy as np
+
+# Columnar binary store of the timestamps of an SVO file (<name>_ts.bin).
+#
+# Same layout as the sidecars the recorders write (Record/timestamp_sidecar.py),
+# ... so a sidecar is a store too: a small header, then fixed-width records
+#
+#   header   magic | version | record size | fps | camera serial
+#             4s   |    H    |      H      |  f  |      I
+#   records  frame # | IMAGE timestamp (ns) | dropped frames before this one
+#               I    |          q           |    I
+#
+# load() maps the file (np.memmap) and returns NumPy views of the columns,
+# ... nothing is read until it is used. The CSV files of the previous
+# ... versions (timestamps in ms) are still read, and written with --csv.
+#
+# Run this file to convert between the two:
+#   python timestamp_store.py exp1_0_ts.csv exp1_1_ts.bin ...
+
+MAGIC = b'ZTS1'
+VERSION = 1
+HEADER = struct.Struct('<4sHHfI')
+RECORD = np.dtype([('frame', '<u4'), ('timestamp', '<i8'), ('dropped', '<u4')])
+FIELDS = ['#', 'timestamp', 'dropped frames']
+
+Timestamps = collections.namedtuple('Timestamps', 'frame timestamp dropped fps serial')
+
+
+# =============================================================== #
+def write(filepath, frame, timestamp, dropped, fps=0.0, serial=0):
+	"""
+		Writes a store.
+
+		Parameters
+		----------
+		filepath: str
+			Path to the _ts.bin file, replaced if it exists.
+		frame, timestamp, dropped: array_like
+			Frame numbers, IMAGE timestamps (ns) and dropped frames.
+		fps: float
+			Frame rate of the camera, 0 if unknown.
+		serial: int
+			Serial number of the camera, 0 if unknown.
+	"""
+	records = np.empty(len(frame), RECORD)
+	records['frame'] = frame
+	records['timestamp'] = timestamp
+	records['dropped'] = dropped
+	tmp_path = filepath + '.tmp'
+	with open(tmp_path, 'wb') as f:
+		f.write(HEADER.pack(MAGIC, VERSION, RECORD.itemsize, fps, serial))
+		f.write(records.tobytes())
+	os.replace(tmp_path, filepath)
+
+
+def load(filepath, mmap=True):
+	"""
+		Loads a store, as Timestamps of NumPy arrays (views of the mapped
+		file if mmap, copies otherwise). A record cut short by a crash of
+		the recorder is ignored.
+	"""
+	with open(filepath, 'rb') as f:
+		header = f.read(HEADER.size)
+	if len(header) < HEADER.size:
+		raise ValueError(f"{filepath}: not a timestamps file")
+	magic, version, size, fps, serial = HEADER.unpack(header)
+	if magic != MAGIC or size != RECORD.itemsize:
+		raise ValueError(f"{filepath}: not a timestamps file")
+	count = (os.path.getsize(filepath) - HEADER.size) // RECORD.itemsize
+	if not count:
+		records = np.empty(0, RECORD)
+	elif mmap:
+		records = np.memmap(filepath, RECORD, 'r', HEADER.size, (count,))
+	else:
+		records = np.fromfile(filepath, RECORD, count, offset=HEADER.size)
+	return Timestamps(records['frame'], records['timestamp'], records['dropped'], fps, serial)
+
+
+def from_csv(filepath):
+	"""
+		Loads a timestamps csv file (#, timestamp in ms, dropped frames) as
+		Timestamps. Rows without a frame number (aligned placeholders) are
+		skipped, a missing dropped column reads as 0.
+	"""
+	with open(filepath, 'r') as csv_file:
+		reader = csv.reader(csv_file)
+		next(reader)
+		rows = [row for row in reader if row and row[0] != '']
+	frame = np.array([row[0] for row in rows], dtype=np.int64)
+	timestamp = np.array([row[1] for row in rows], dtype=np.float64) * 1e6
+	timestamp = timestamp.round().astype(np.int64)
+	dropped = np.array([row[2] if len(row) > 2 and row[2] != '' else 0 for row in rows],
+					   dtype=np.int64)
+	return Timestamps(frame, timestamp, dropped, 0.0, 0)
+
+
+def to_csv(timestamps, filepath):
+	""" Writes Timestamps as a csv file (timestamps in ms, as timestamp_extract.py did) """
+	with open(filepath, 'w', newline='') as csv_file:
+		writer = csv.writer(csv_file)
+		writer.writerow(FIELDS)
+		writer.writerows(zip(np.asarray(timestamps.frame).tolist(),
+							 (np.asarray(timestamps.timestamp) // 1000000).tolist(),
+							 np.asarray(timestamps.dropped).tolist()))
+
+
+def read(filepath):
+	""" Timestamps of a store or of a csv file """
+	if filepath.endswith('.csv'):
+		return from_csv(filepath)
+	return load(filepath)
+
+
+def first_last(filepath):
+	"""
+		First column (frame #) of the first and last rows of a store or csv
+		file, without reading the rest of it.
+	"""
+	if not filepath.endswith('.csv'):
+		frame = load(filepath).frame
+		if not len(frame):
+			raise ValueError(f"{filepath}: no frames")
+		return str(frame[0]), str(frame[-1])
+	with open(filepath, 'rb') as f:
+		f.readline()					# Header
+		first = f.readline()
+		if not first.strip():
+			raise ValueError(f"{filepath}: no frames")
+		# Back from the end of the file to the start of the last line
+		position = f.seek(0, os.SEEK_END)
+		tail = b''
+		while position > 0 and tail.strip().count(b'\n') < 1:
+			step = min(4096, position)
+			position -= step
+			f.seek(position)
+			tail = f.read(step) + tail
+		last = tail.strip().splitlines()[-1]
+	first, last = (next(csv.reader([line.decode()])) for line in (first, last))
+	return first[0], last[0]
+
+
+def main():
+	if len(sys.argv) < 2:
+		print("Please specify path to _ts.csv or _ts.bin file.")
+		exit()
+	for filepath in sys.argv[1:]:
+		root, extension = os.path.splitext(filepath)
+		timestamps = read(filepath)
+		if extension == '.csv':
+			newpath = root + '.bin'
+			write(newpath, timestamps.frame, timestamps.timestamp, timestamps.dropped)
+		else:
+			newpath = root + '.csv'
+			to_csv(timestamps, newpath)
+		print(f"{filepath} -> {newpath}: {len(timestamps.frame)} frames")
+
+
+if __name__ == '__main__':
+	main()